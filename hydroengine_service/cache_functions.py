@@ -0,0 +1,127 @@
+"""Local disk cache for (binary) results."""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# files being written, never evicted
+TMP_PREFIX = '.tmp-'
+
+
+class DiskCache(object):
+    """
+    Stores bytes in files on local disk, addressed by a key. If max_size is given
+    the least recently used files are removed when the cache grows beyond it.
+    """
+
+    def __init__(self, directory, max_size=None):
+        self.directory = str(directory)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._size = None
+
+    def path(self, key):
+        """path of the file for key, key is hashed to get a safe filename"""
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key):
+        """return the cached bytes for key, None if not available"""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+        self.touch(path)
+
+        return data
+
+    def touch(self, path):
+        """mark a file as recently used"""
+        if self.max_size is None:
+            return
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted in the meantime
+            pass
+
+    def put(self, key, data):
+        """store bytes for key"""
+        fd, tmp = self.mkstemp(key)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        self.commit(key, tmp)
+
+    def mkstemp(self, key):
+        """
+        Create a temporary file to write the data for key to, store it with commit.
+        Readers never see a partially written file.
+        :return: tuple of file descriptor and path
+        """
+        directory = os.path.dirname(self.path(key))
+        os.makedirs(directory, exist_ok=True)
+        return tempfile.mkstemp(dir=directory, prefix=TMP_PREFIX)
+
+    def commit(self, key, tmp):
+        """store a temporary file created by mkstemp for key"""
+        size = os.path.getsize(tmp)
+        os.replace(tmp, self.path(key))
+        self.add_size(size)
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith(TMP_PREFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat
+
+    def add_size(self, size):
+        """account for size bytes added to the cache, evict files if it is full"""
+        if self.max_size is None:
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(stat.st_size for _, stat in self._files())
+            else:
+                self._size += size
+
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        # remove least recently used files until 90% of max_size is left
+        files = sorted(self._files(), key=lambda f: f[1].st_mtime)
+        size = sum(stat.st_size for _, stat in files)
+        target = 0.9 * self.max_size
+
+        n_removed = 0
+        for path, stat in files:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= stat.st_size
+            n_removed += 1
+
+        logger.debug('Removed %d files from cache %s', n_removed, self.directory)
+        self._size = size
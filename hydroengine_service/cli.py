@@ -1,10 +1,25 @@
 # -*- coding: utf-8 -*-
 
 """Console script for hydroengine_service."""
+import json
+import logging
 import sys
+import time
+
 import click
+import ee
 
 import hydroengine_service.main
+from hydroengine_service import config
+from hydroengine_service import error_handler
+from hydroengine_service import geometry_functions
+from hydroengine_service import lake_functions
+from hydroengine_service import mbtiles_functions
+from hydroengine_service import occurrence_functions
+from hydroengine_service import river_functions
+from hydroengine_service import skeleton_functions
+from hydroengine_service import tile_blueprints
+from hydroengine_service import water_functions
 
 
 @click.command()
@@ -15,5 +30,112 @@ def main(port, args=None):
     hydroengine_service.main.app.run(host='127.0.0.1', port=port, debug=True)
 
 
+@click.command()
+@click.argument('layer')
+@click.option('--output', default=None, type=click.Path(), help='MBTiles file, defaults to <layer>.mbtiles in the tile archive directory')
+@click.option('--min-zoom', default=None, type=int, help='Lowest zoom level')
+@click.option('--max-zoom', default=None, type=int, help='Highest zoom level')
+@click.option('--bounds', default=None, type=float, nargs=4, help='west south east north')
+@click.option('--workers', default=8, type=int, help='Number of tiles rendered concurrently')
+def export_tiles(layer, output, min_zoom, max_zoom, bounds, workers):
+    """Pre-render the tile pyramid of a static layer into an MBTiles archive."""
+    logging.basicConfig(level=logging.INFO)
+
+    proxy = tile_blueprints.tile_proxy
+    if layer not in proxy.layers:
+        raise click.BadParameter('use one of: %s' % ', '.join(sorted(proxy.layers)), param_hint='LAYER')
+
+    options = config.STATIC_TILE_LAYERS.get(layer, {})
+    min_zoom = options.get('min_zoom', 0) if min_zoom is None else min_zoom
+    max_zoom = options.get('max_zoom', 6) if max_zoom is None else max_zoom
+    bounds = bounds or options.get('bounds', (-180, -85.05, 180, 85.05))
+
+    if output is None:
+        config.TILE_ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+        output = config.TILE_ARCHIVE_DIR / (layer + '.mbtiles')
+
+    def fetch(z, x, y):
+        try:
+            return proxy.fetch(layer, z, x, y)
+        except error_handler.InvalidUsage as e:
+            click.echo('Skipping tile %d/%d/%d: %s' % (z, x, y, e.message), err=True)
+
+    n_tiles = mbtiles_functions.export_tiles(
+        output, fetch, layer, bounds, min_zoom, max_zoom, workers=workers)
+
+    click.echo('Written %d tiles to %s' % (n_tiles, output))
+
+
+@click.command()
+@click.argument('region', type=click.File())
+@click.option('--scale', default=10, type=float, help='Scale in meters')
+@click.option('--start', default='2010-01-01', help='Start of the period of the water mask')
+@click.option('--stop', default='2016-01-01', help='End of the period of the water mask')
+def benchmark_water_network(region, scale, start, stop):
+    """Compare the ee and local skeletonization engines on the water mask of a region (GeoJSON file)."""
+    region = json.load(region)
+
+    t = time.time()
+    water_mask = hydroengine_service.main.get_water_mask_vector(ee.Geometry(region), scale, start, stop).getInfo()
+    click.echo('water mask: %.1f s' % (time.time() - t))
+
+    engines = {
+        'ee': lambda: river_functions.generate_skeleton_from_voronoi(
+            scale, water_functions.to_feature_collection(water_mask))['centerline'].getInfo(),
+        'local': lambda: skeleton_functions.skeletonize(water_mask, scale)
+    }
+
+    for engine, skeletonize in engines.items():
+        t = time.time()
+        try:
+            centerline = skeletonize()
+        except Exception as e:
+            click.echo('%s: failed after %.1f s: %s' % (engine, time.time() - t, e))
+            continue
+
+        click.echo('%s: %.1f s, %d lines, %.0f m' % (
+            engine, time.time() - t, len(centerline['features']), geometry_functions.length(centerline)))
+
+
+@click.command()
+@click.argument('years', nargs=-1, type=int)
+@click.option('--asset', default=None, help='ImageCollection of the yearly counts, defaults to HYDROENGINE_GSW_YEARLY_COUNTS')
+def export_gsw_yearly_counts(years, asset):
+    """Materialize yearly GSW water counts, used by the water occurrence of whole years."""
+    asset = asset or config.GSW_YEARLY_COUNTS
+    if not asset:
+        raise click.BadParameter('set HYDROENGINE_GSW_YEARLY_COUNTS or use --asset', param_hint='--asset')
+
+    first, last = occurrence_functions.RECORD_START.year, occurrence_functions.RECORD_END.year - 1
+    for year in years or range(first + 1, last + 1):
+        task = occurrence_functions.export_yearly_counts(asset, year)
+        click.echo('Started export of %d (%s)' % (year, task.id))
+
+
+@click.command()
+@click.argument('lake_ids', nargs=-1, type=int)
+@click.option('--lake-file', default=None, type=click.File(), help='File with a Hylak_id per line')
+@click.option('--batch-size', default=lake_functions.STORE_BATCH_SIZE, type=int, help='Number of lakes per EE request')
+@click.option('--workers', default=lake_functions.STORE_WORKERS, type=int, help='Number of concurrent EE requests')
+def update_lake_store(lake_ids, lake_file, batch_size, workers):
+    """Add lakes to the store of monthly water areas and add new months for the stored lakes."""
+    logging.basicConfig(level=logging.INFO)
+
+    lake_ids = list(lake_ids)
+    if lake_file:
+        lake_ids += [int(line) for line in lake_file if line.strip()]
+
+    store = hydroengine_service.main.lake_store
+    known = set(store.get_lake_ids())
+
+    # new months first, new lakes get their full series
+    n_rows = lake_functions.update_store(store, batch_size, workers)
+    click.echo('Added %d rows of new months' % n_rows)
+
+    new = [i for i in dict.fromkeys(lake_ids) if i not in known]
+    n_rows = lake_functions.fill_store(store, new, batch_size=batch_size, workers=workers)
+    click.echo('Added %d rows of %d new lakes' % (n_rows, len(new)))
+
+
 if __name__ == "__main__":
     sys.exit(main())  # pragma: no cover
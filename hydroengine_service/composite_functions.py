@@ -0,0 +1,56 @@
+"""Percentile composites of Sentinel-2 scenes, planned from scene metadata to bound the stack size."""
+import ee
+
+S2_COLLECTION = 'COPERNICUS/S2'
+# native resolution of the 10 m bands (B2, B3, B4, B8), in meters
+S2_NATIVE_SCALE = 10
+
+# maximum number of scenes in a composite, the least cloudy are used
+MAX_IMAGES = 100
+# scenes with a higher CLOUDY_PIXEL_PERCENTAGE are skipped ...
+MAX_CLOUD_COVER = 50
+# ... unless fewer scenes than this remain
+MIN_IMAGES = 5
+
+
+def needs_resampling(scale, native_scale=S2_NATIVE_SCALE):
+    """images are resampled (bilinear) only if the output is finer than the native resolution"""
+    return scale < native_scale
+
+
+def get_sentinel2_images(region, start, stop, max_images=None, max_cloud_cover=None):
+    """
+    Sentinel-2 scenes over a region, ranked by cloud cover and capped
+    :param region: ee.Geometry
+    :param max_images: Integer, maximum number of scenes, MAX_IMAGES by default
+    :param max_cloud_cover: Number, maximum CLOUDY_PIXEL_PERCENTAGE, MAX_CLOUD_COVER by default
+    :return: ee.ImageCollection
+    """
+    max_images = max_images or MAX_IMAGES
+    max_cloud_cover = MAX_CLOUD_COVER if max_cloud_cover is None else max_cloud_cover
+
+    images = ee.ImageCollection(S2_COLLECTION) \
+        .filterBounds(region) \
+        .filterDate(start, stop)
+
+    # metadata only, scenes are not loaded
+    clear = images.filter(ee.Filter.lte('CLOUDY_PIXEL_PERCENTAGE', max_cloud_cover))
+    images = ee.ImageCollection(ee.Algorithms.If(clear.size().gte(MIN_IMAGES), clear, images))
+
+    return images.limit(max_images, 'CLOUDY_PIXEL_PERCENTAGE')
+
+
+def get_sentinel2_composite(region, start, stop, bands, percentile, scale, max_images=None, max_cloud_cover=None):
+    """
+    Percentile composite of Sentinel-2 scenes, see get_sentinel2_images
+    :param bands: list of band names
+    :param percentile: Number, percentile of the composite
+    :param scale: Number, scale in meters at which the composite is used
+    :return: ee.Image
+    """
+    images = get_sentinel2_images(region, start, stop, max_images, max_cloud_cover).select(bands)
+
+    if needs_resampling(scale):
+        images = images.map(lambda i: i.resample('bilinear'))
+
+    return images.reduce(ee.Reducer.percentile([percentile]))
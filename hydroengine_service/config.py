@@ -1,5 +1,7 @@
+import os
 import pathlib
 import json
+import tempfile
 
 """Required credentials configuration."""
 EE_ACCOUNT = '578920177147-ul189ho0h6f559k074lrodsd7i7b84rc@developer.gserviceaccount.com'
@@ -12,3 +14,55 @@ DATASET_PATH = DATASET_DIR / 'dataset_visualization_parameters.json'
 # load visualization parameters
 with DATASET_PATH.open() as json_file:
     DATASETS_VIS = json.load(json_file)
+
+"""HTTP caching, Cache-Control max-age (in seconds) per dataset update cadence."""
+# tile urls contain an EE map id, which is only valid for a limited time
+CACHE_MAX_AGE_MAP = 60 * 60
+# static data (HydroBASINS, HydroSHEDS, HydroLAKES, JRC water, Image assets)
+CACHE_MAX_AGE_STATIC = 7 * 24 * 60 * 60
+# dynamic collections without a known cadence
+CACHE_MAX_AGE_DEFAULT = 60 * 60
+# sources with a faster update cadence (forecasts), matched on prefix
+CACHE_MAX_AGE_SOURCES = {
+    'projects/dgds-gee/glossis': 15 * 60,
+    'projects/dgds-gee/gloffis': 15 * 60,
+}
+
+"""Local disk caches (tiles, downloads, intermediate results)."""
+CACHE_DIR = pathlib.Path(os.environ.get('HYDROENGINE_CACHE_DIR', pathlib.Path(tempfile.gettempdir()) / 'hydroengine'))
+# the default sizes of all caches add up to 5 GiB, which leaves room for the system,
+# tile archives and the lake store on the 10 GB disk of app.yaml
+# maximum size (in bytes) of each tile cache (raster and vector tiles)
+TILE_CACHE_MAX_SIZE = int(os.environ.get('HYDROENGINE_TILE_CACHE_SIZE', 1024 ** 3))
+
+"""Pre-rendered tile archives (MBTiles) of static layers, see hydroengine-export-tiles."""
+TILE_ARCHIVE_DIR = pathlib.Path(os.environ.get('HYDROENGINE_TILE_ARCHIVE_DIR', CACHE_DIR / 'mbtiles'))
+# static layers to pre-render, zoom levels and bounds (west, south, east, north)
+STATIC_TILE_LAYERS = {
+    'ssh-trend': {'min_zoom': 0, 'max_zoom': 6, 'bounds': (-180, -85.05, 180, 85.05)},
+    'gebco': {'min_zoom': 0, 'max_zoom': 7, 'bounds': (-180, -85.05, 180, 85.05)},
+    'gtsm-waterlevel-return-period-10': {'min_zoom': 0, 'max_zoom': 7, 'bounds': (-180, -85.05, 180, 85.05)},
+    'gtsm-waterlevel-return-period-100': {'min_zoom': 0, 'max_zoom': 7, 'bounds': (-180, -85.05, 180, 85.05)},
+    'crucial-groundwater-declining-trend': {'min_zoom': 0, 'max_zoom': 6, 'bounds': (-180, -60, 180, 85.05)},
+}
+
+"""Download proxy, finished downloads are cached on local disk."""
+# number of seconds a download link handed out by the service stays valid
+DOWNLOAD_LEASE_TIME = 24 * 60 * 60
+# maximum size (in bytes) of the download cache
+DOWNLOAD_CACHE_MAX_SIZE = int(os.environ.get('HYDROENGINE_DOWNLOAD_CACHE_SIZE', 2 * 1024 ** 3))
+
+"""Time series at points, cached per point."""
+# maximum size (in bytes) of the time series cache
+TIMESERIES_CACHE_MAX_SIZE = int(os.environ.get('HYDROENGINE_TIMESERIES_CACHE_SIZE', 512 * 1024 ** 2))
+
+"""Intermediates of the water endpoints (water masks, networks), referenced by id."""
+# maximum size (in bytes) of the water intermediates cache
+WATER_CACHE_MAX_SIZE = int(os.environ.get('HYDROENGINE_WATER_CACHE_SIZE', 512 * 1024 ** 2))
+
+"""Water occurrence, see occurrence_functions."""
+# ImageCollection of materialized yearly GSW counts, see hydroengine-export-gsw-yearly-counts
+GSW_YEARLY_COUNTS = os.environ.get('HYDROENGINE_GSW_YEARLY_COUNTS', None)
+
+"""Monthly water areas of lakes, see hydroengine-update-lake-store."""
+LAKE_STORE_DIR = pathlib.Path(os.environ.get('HYDROENGINE_LAKE_STORE_DIR', CACHE_DIR / 'lakes'))
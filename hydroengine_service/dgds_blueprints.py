@@ -1,19 +1,25 @@
-import json
-
 import ee
 import logging
 import flask_cors
-from flask import request, Response
+from flask import request
 from flask import Blueprint
 
+from hydroengine_service import cache_functions
+from hydroengine_service import config
 from hydroengine_service import dgds_functions
 from hydroengine_service import error_handler
+from hydroengine_service import response_functions
+from hydroengine_service import timeseries_functions
 
 v1 = Blueprint("dgds-v1", __name__)
 v2 = Blueprint("dgds-v2", __name__)
 
 logger = logging.getLogger(__name__)
 
+timeseries_cache = cache_functions.DiskCache(
+    config.CACHE_DIR / "timeseries", config.TIMESERIES_CACHE_MAX_SIZE
+)
+
 
 @v1.route("/get_glossis_data", methods=["POST"])
 @flask_cors.cross_origin()
@@ -61,7 +67,9 @@ def get_glossis_data():
     if not image_info:
         raise error_handler.InvalidUsage("No images returned.")
 
-    return Response(json.dumps(image_info), status=200, mimetype="application/json")
+    return response_functions.json_response(
+        image_info, max_age=response_functions.get_layer_max_age(source)
+    )
 
 
 @v1.route("/get_gloffis_data", methods=["POST"])
@@ -109,7 +117,9 @@ def get_gloffis_data():
     if not image_info:
         raise error_handler.InvalidUsage("No images returned.")
 
-    return Response(json.dumps(image_info), status=200, mimetype="application/json")
+    return response_functions.json_response(
+        image_info, max_age=response_functions.get_layer_max_age(source)
+    )
 
 
 @v1.route("/get_metocean_data", methods=["POST"])
@@ -155,7 +165,9 @@ def get_metocean_data():
     if not image_info:
         raise error_handler.InvalidUsage("No images returned.")
 
-    return Response(json.dumps(image_info), status=200, mimetype="application/json")
+    return response_functions.json_response(
+        image_info, max_age=response_functions.get_layer_max_age(source)
+    )
 
 
 @v1.route("/get_gebco_data", methods=["GET", "POST"])
@@ -191,7 +203,9 @@ def get_gebco_data():
     if not image_info:
         raise error_handler.InvalidUsage("No images returned.")
 
-    return Response(json.dumps(image_info), status=200, mimetype="application/json")
+    return response_functions.json_response(
+        image_info, max_age=response_functions.get_layer_max_age(source)
+    )
 
 
 @v1.route("/get_gll_dtm_data", methods=["GET", "POST"])
@@ -209,7 +223,9 @@ def get_gll_dtm_data():
     if not image_info:
         raise error_handler.InvalidUsage("No images returned.")
 
-    return Response(json.dumps(image_info), status=200, mimetype="application/json")
+    return response_functions.json_response(
+        image_info, max_age=response_functions.get_layer_max_age(imageid)
+    )
 
 
 @v1.route("/get_stac_item", methods=["GET", "POST"])
@@ -246,7 +262,9 @@ def get_elevation_data():
         dataset_list=source, min=min, max=max
     )
 
-    return Response(json.dumps(image_info), status=200, mimetype="application/json")
+    return response_functions.json_response(
+        image_info, max_age=response_functions.get_layer_max_age()
+    )
 
 
 @v1.route("/get_chasm_data", methods=["POST"])
@@ -296,7 +314,9 @@ def get_chasm_data():
     if not image_info:
         raise error_handler.InvalidUsage("No images returned.")
 
-    return Response(json.dumps(image_info), status=200, mimetype="application/json")
+    return response_functions.json_response(
+        image_info, max_age=response_functions.get_layer_max_age(source)
+    )
 
 
 @v1.route("/get_gtsm_data", methods=["POST"])
@@ -347,7 +367,9 @@ def get_gtsm_data():
     if not image_info:
         raise error_handler.InvalidUsage("No images returned.")
 
-    return Response(json.dumps(image_info), status=200, mimetype="application/json")
+    return response_functions.json_response(
+        image_info, max_age=response_functions.get_layer_max_age(source)
+    )
 
 
 @v1.route("/get_crucial_data", methods=["POST"])
@@ -398,7 +420,9 @@ def get_crucial_data():
     if not image_info:
         raise error_handler.InvalidUsage("No images returned.")
 
-    return Response(json.dumps(image_info), status=200, mimetype="application/json")
+    return response_functions.json_response(
+        image_info, max_age=response_functions.get_layer_max_age(source)
+    )
 
 
 @v1.route("/get_msfd_data", methods=["POST"])
@@ -449,4 +473,76 @@ def get_msfd_data():
     if not image_info:
         raise error_handler.InvalidUsage("No images returned.")
 
-    return Response(json.dumps(image_info), status=200, mimetype="application/json")
+    return response_functions.json_response(
+        image_info, max_age=response_functions.get_layer_max_age(source)
+    )
+
+
+@v1.route("/get_time_series", methods=["POST"])
+@flask_cors.cross_origin()
+def get_time_series():
+    """
+    Get time series of a DGDS source (e.g. GLOSSIS waterlevel, GLOFFIS discharge) at
+    one point, or at many points, as columns t (epoch ms) and v (float32 values).
+    See datasets_visualization_parameters.json for possible sources and bands.
+    :return:
+    """
+    r = request.get_json()
+    source = r.get("source", None)
+    band = r.get("band", None)
+    function = r.get("function", None)
+    start_date = r.get("startDate", None)
+    end_date = r.get("endDate", None)
+    scale = r.get("scale", None)
+    points = r.get("points", None)
+
+    if not (source and start_date and end_date):
+        msg = "source, startDate and endDate are required parameters"
+        logger.error(msg)
+        raise error_handler.InvalidUsage(msg)
+    if not points and not r.get("point"):
+        raise error_handler.InvalidUsage("point or points is a required parameter")
+    if function not in (None, "log", "magnitude"):
+        raise error_handler.InvalidUsage(f"function {function} is not supported for time series")
+
+    data_params = dgds_functions.get_dgds_source_vis_params(source)
+
+    collection = ee.ImageCollection(source)
+    if band:
+        if band not in data_params["bandNames"]:
+            raise error_handler.InvalidUsage(f"band {band} not available for {source}")
+        selected_band = data_params["bandNames"][band]
+        collection = collection.select([selected_band])
+    elif not function:
+        raise error_handler.InvalidUsage("band or function is a required parameter")
+
+    if function:
+        collection = collection.map(
+            lambda i: dgds_functions.apply_image_operation(i, function, data_params, band)
+            .copyProperties(i, ["system:time_start"])
+        )
+        selected_band = function
+
+    if scale is None:
+        scale = ee.ImageCollection(source).first().projection().nominalScale().getInfo()
+
+    series = timeseries_functions.get_time_series(
+        collection,
+        selected_band,
+        points or [r["point"]],
+        start_date,
+        end_date,
+        scale,
+        cache=timeseries_cache,
+        cache_args=(source, function),
+        max_age=response_functions.get_source_max_age(source),
+    )
+
+    if points:
+        data = {"points": points, "series": series}
+    else:
+        data = series[0]
+
+    return response_functions.json_response(
+        data, max_age=response_functions.get_source_max_age(source)
+    )
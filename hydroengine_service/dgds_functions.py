@@ -25,6 +25,12 @@ with open(DATASET_DIR + "/dataset_elevation_parameters.json") as json_file:
 
 logger = logging.getLogger(__name__)
 
+SSH_TREND = "users/fbaart/ssh-trend-map"
+SSH_GRIDS = "users/fbaart/ssh_grids_v1609"
+
+# scale (meters) at which feature info of images without a native scale (mosaics) is sampled
+FEATURE_INFO_SCALE = 10
+
 LAND = ee.Image("users/gena/land_polygons_image")
 LANDMASK = ee.Image(LAND.unmask(1, False).Not().resample("bicubic").focal_mode(2))
 
@@ -53,6 +59,85 @@ def get_dgds_source_vis_params(source, image_id=None):
     return data_params
 
 
+def get_image_at(source, date):
+    """
+    Image of a collection at a time
+    :param source: String, Earth Engine ImageCollection id
+    :param date: String or Number, system:time_start of the image
+    :return: ee.Image
+    """
+    collection = ee.ImageCollection(source)
+    return ee.Image(collection.filter(ee.Filter.eq("system:time_start", ee.Date(date).millis())).first())
+
+
+def get_feature_info_image(image_id, band=None, function=None, datasets=None, source=None):
+    """
+    Image to sample for feature info, with the band and function applied
+    :param image_id: String, Google Earth Engine image id, or ee.Image if source is given
+    :param band: String, name of band in the image
+    :param function: String, function applied to the image
+    :param datasets: List, datasets to mosaic for function mosaic_elevation_datasets
+    :param source: String, source of the image, derived from image_id if None
+    :return: ee.Image
+    """
+    if function == "mosaic_elevation_datasets":
+        if not datasets:
+            msg = f"datsets list expected for function {function}"
+            raise error_handler.InvalidUsage(msg)
+        return ee.Image(mosaic_elevation_datasets(datasets).select("elevation"))
+
+    image = ee.Image(image_id)
+    if source is None:
+        image_location_parameters = image_id.split("/")
+        source = ("/").join(image_location_parameters[:-1])
+        data_params = get_dgds_source_vis_params(source, image_id)
+    else:
+        data_params = get_dgds_source_vis_params(source)
+
+    if band:
+        band_name = data_params["bandNames"][band]
+        image = image.select(band_name)
+    if function:
+        assert (function in data_params.get("function", None)) or (
+            function == data_params["function"].get(band, None)
+        ), f"{function} not an option."
+
+    return apply_image_operation(image, function, data_params, band)
+
+
+def get_feature_info_scale(image_id=None, function=None, source=None):
+    """
+    Scale to sample feature info at: the scale of the dataset parameters if defined,
+    otherwise the native scale of the (first band of the) stored image, evaluated
+    server-side. Functions are applied per pixel and do not change the native scale.
+    Mosaics (of elevation datasets) have no native scale, their default projection
+    is 1 degree, they are sampled at FEATURE_INFO_SCALE.
+    :param image_id: String, Google Earth Engine image id
+    :param function: String, function applied to the image
+    :param source: String, source of the image, derived from image_id if None
+    :return: Number or ee.Number, scale in meters
+    """
+    if function == "mosaic_elevation_datasets":
+        return FEATURE_INFO_SCALE
+
+    if source is None:
+        source = "/".join(image_id.split("/")[:-1])
+    data_params = DATASETS_VIS.get(source) or DATASETS_VIS.get(image_id) or {}
+
+    if "scale" in data_params:
+        return data_params["scale"]
+
+    if image_id is not None:
+        image = ee.Image(image_id)
+    elif data_params.get("type") == "Image":
+        image = ee.Image(source)
+    else:
+        # images of a collection share their projection
+        image = ee.Image(ee.ImageCollection(source).first())
+
+    return image.select(0).projection().nominalScale()
+
+
 def get_dgds_data(
     source,
     dataset=None,
@@ -335,6 +420,25 @@ def generate_elevation_map(dataset_list=None, min=None, max=None):
     return info
 
 
+def visualize_ssh_trend():
+    """
+    Visualize the sea surface height trend
+    :return: Dictionary
+    """
+    image = ee.Image(SSH_TREND)
+
+    image = image.visualize(
+        **{
+            "bands": ["time"],
+            "min": -0.03,
+            "max": 0.03,
+            "palette": ["151d44", "156c72", "7eb390", "fdf5f4", "db8d77", "9c3060", "340d35"],
+        }
+    )
+
+    return {"url": _get_gee_url(image)}
+
+
 def visualize_gebco(source, band, min=None, max=None):
     """
     Specialized function to visualize GEBCO data
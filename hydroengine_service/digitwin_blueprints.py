@@ -1,12 +1,11 @@
-import json
-
 import ee
 import flask_cors
 import geojson
-from flask import request, Response, jsonify
+from flask import request, jsonify
 from flask import Blueprint
 
 from hydroengine_service import digitwin_functions
+from hydroengine_service import response_functions
 from hydroengine_service.digitwin_functions import KNOWN_MODELS, submit_ecopath_jobs
 
 v1 = Blueprint("digitwin-v1", __name__)
@@ -60,26 +59,19 @@ def get_windfarm_data():
         "reducer": ee.Reducer.mean(),
         "scale": 1000
     })
-    # compute area
-    meanWindFarm = meanWindFarm.map(digitwin_functions.compute_area)
-    print('area', meanWindFarm.getInfo())
     # compute grid parameters
     meanWindFarm = meanWindFarm.map(digitwin_functions.create_turbine_grid)
 
     # do the rest local, we need scipy
     mean_wind_farm = meanWindFarm.getInfo()
     features = [
-        digitwin_functions.compute_feature(feature)
+        digitwin_functions.compute_area(feature)
         for feature
         in mean_wind_farm['features']
     ]
-    print(features)
+    features = digitwin_functions.compute_features(features)
     computed = geojson.FeatureCollection(features)
-    response = Response(
-        json.dumps(computed),
-        status=200,
-        mimetype='application/json'
-    )
+    response = response_functions.json_response(computed)
     return response
 
 @v1.route("/start_water_velocity_jobs", methods=["POST"])
@@ -5,6 +5,8 @@ import scipy.interpolate
 
 import ee
 
+from hydroengine_service import geometry_functions
+
 # Levelized Cost of Energy function for AC/DC
 # https://northseawindpowerhub.eu/wp-content/uploads/2019/02/112522-19-001.830-rapd-report-Cost-Evaluation-of-North-Sea-Offshore-Wind....pdf
 # distance to port (km), depth (m), LCoE EUR/MWh
@@ -30,9 +32,17 @@ LCOE_POINTS = np.array([
 
 LCOE_fit = scipy.interpolate.SmoothBivariateSpline(LCOE_POINTS[:, 0], LCOE_POINTS[:, 1], LCOE_POINTS[:, 2], kx=2, ky=2)
 
+# roughness length at sea (m)
+ROUGHNESS = 0.0002
+# height of the wind data and default height of the windfarm (m)
+HEIGHT_0 = 10
+HEIGHT = 130
+# log law conversion of wind speed from HEIGHT_0 to HEIGHT
+WIND_CONVERSION = np.log(HEIGHT / ROUGHNESS) / np.log(HEIGHT_0 / ROUGHNESS)
+
 def compute_area(feature):
-    """compute area of feature"""
-    feature = feature.set('area', feature.geometry().area())
+    """compute (geodesic) area of a GeoJSON feature"""
+    feature['properties']['area'] = geometry_functions.area(feature['geometry'])
     return feature
 
 
@@ -150,48 +160,55 @@ def windpower(V):
     P = (V ** 3) * (1/2 * rho * performance * A *  Ng)
     return P
 
-def compute_feature(feature):
-    """compute relevant properties for windfarm"""
+def _to_list(values):
+    """list of an array, missing values (nan) as None"""
+    return [None if np.isnan(v) else v for v in values.tolist()]
 
-    print(feature)
-    # roughness length at sea
-    roughness = 0.0002 #  m
-    # default height
-    height = 130
-    height_0 = 10
-    feature['height'] = feature['properties'].get('height', 130)
-
-    conversion = (
-        np.log(height / roughness)
-        /
-        np.log(height_0 / roughness)
-    )
 
-    magnitude = feature['properties']['wind_magnitude_mean'] * conversion
+def compute_features(features):
+    """compute relevant properties for windfarms, for all features at once"""
+    if not features:
+        return features
+
+    properties = [feature['properties'] for feature in features]
+
+    def column(name):
+        # missing values (e.g. masked pixels) become nan
+        return np.array([p.get(name) for p in properties], dtype=float)
+
+    magnitude = column('wind_magnitude_mean') * WIND_CONVERSION
     power = windpower(magnitude)
-    area = feature['properties']['area']
-
-    # assuming square  area
-    n_turbines = feature['properties']['n_turbines']
-    turbine_spacing = feature['properties']['turbine_spacing']
-    area_per_turbine = turbine_spacing
-
-    depth = feature['properties']['bathymetry'] * -1
-    distance_to_port = feature['properties']['distance_to_port']
-
-    feature['properties'].update({
-        "wind_magnitude_mean_height": magnitude,
-        "wind_power_mean": power,
-        "levelized_cost_of_energy": lcoe(distance_to_port, depth), # convert to EUR/Wh
-        "n_turbines": n_turbines,
-        "area": area,
-        "area_per_turbine": area_per_turbine,
-        "turbine_spacing": turbine_spacing,
-        # deprecated
-        "spacing": turbine_spacing,
-        "wind_power_total": power * n_turbines
-    })
-    return feature
+    n_turbines = column('n_turbines')
+
+    depth = column('bathymetry') * -1
+    distance_to_port = column('distance_to_port')
+    levelized_cost_of_energy = LCOE_fit.ev(distance_to_port, depth)
+
+    columns = {
+        "wind_magnitude_mean_height": _to_list(magnitude),
+        "wind_power_mean": _to_list(power),
+        "levelized_cost_of_energy": _to_list(levelized_cost_of_energy),
+        "wind_power_total": _to_list(power * n_turbines)
+    }
+
+    for i, feature in enumerate(features):
+        feature['height'] = feature['properties'].get('height', HEIGHT)
+
+        turbine_spacing = feature['properties'].get('turbine_spacing')
+        feature['properties'].update({name: values[i] for name, values in columns.items()})
+        feature['properties'].update({
+            # assuming square  area
+            "area_per_turbine": turbine_spacing,
+            # deprecated
+            "spacing": turbine_spacing
+        })
+
+    return features
+
+
+def compute_feature(feature):
+    """compute relevant properties for windfarm"""
+    return compute_features([feature])[0]
 
 
 def compute_distortion(geometry):
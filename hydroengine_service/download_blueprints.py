@@ -0,0 +1,93 @@
+import flask
+import flask_cors
+from flask import Response
+from flask import Blueprint
+
+from hydroengine_service import cache_functions
+from hydroengine_service import config
+from hydroengine_service import download_functions
+from hydroengine_service import response_functions
+
+v1 = Blueprint("downloads-v1", __name__)
+
+download_proxy = download_functions.DownloadProxy(
+    cache=cache_functions.DiskCache(
+        config.CACHE_DIR / "downloads", config.DOWNLOAD_CACHE_MAX_SIZE
+    ),
+    url_max_age=config.CACHE_MAX_AGE_MAP,
+    lease_time=config.DOWNLOAD_LEASE_TIME,
+)
+
+# downloads produced by the service, e.g. large rasters fetched in parts
+download_jobs = download_functions.DownloadJobs(download_proxy)
+
+
+def get_download_url(name, params, resolve, filename="download", url=None):
+    """
+    Register a download with the download proxy
+    :param name: String, name of the kind of download, e.g. raster
+    :param params: json serializable parameters identifying the download
+    :param resolve: function returning a (new) EE download url
+    :param filename: String, filename used if EE does not provide one
+    :param url: String, EE download url already generated by resolve
+    :return: String, url of the download on this service
+    """
+    key = download_functions.get_request_key(name, params)
+    download_proxy.register(key, resolve, filename=filename, url=url)
+
+    return flask.url_for(v1.name + ".get_download", key=key, _external=True)
+
+
+def _set_filename(response, filename):
+    response.headers["Content-Disposition"] = 'attachment; filename="%s"' % filename
+
+
+@v1.route("/downloads/<key>", methods=["GET"])
+@flask_cors.cross_origin()
+def get_download(key):
+    """
+    Download registered by one of the export routes. Finished downloads are served
+    from disk (with support for range requests), otherwise the download is
+    streamed from EE and cached.
+    """
+    cached = download_proxy.get_cached(key)
+
+    if cached is not None:
+        path, metadata = cached
+        response = flask.send_file(path, mimetype=metadata["mimetype"], conditional=True)
+        response.headers["X-Cache"] = "HIT"
+    else:
+        chunks, metadata = download_proxy.stream(key)
+        response = Response(chunks, mimetype=metadata["mimetype"])
+        if metadata["size"]:
+            response.headers["Content-Length"] = metadata["size"]
+        response.headers["X-Cache"] = "MISS"
+
+    _set_filename(response, metadata["filename"])
+    response.cache_control.public = True
+    response.cache_control.max_age = config.DOWNLOAD_LEASE_TIME
+
+    return response
+
+
+def get_job_info(job):
+    """public status of a download job, with the download url once it is finished"""
+    info = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "error": job["error"],
+        "status_url": flask.url_for(v1.name + ".get_download_job", job_id=job["id"], _external=True),
+    }
+    if job["status"] == "COMPLETED":
+        info["url"] = flask.url_for(v1.name + ".get_download", key=job["key"], _external=True)
+    return info
+
+
+@v1.route("/downloads/jobs/<job_id>", methods=["GET"])
+@flask_cors.cross_origin()
+def get_download_job(job_id):
+    """Progress of a download produced in the background"""
+    job = download_jobs.get(job_id)
+
+    return response_functions.json_response(get_job_info(job))
@@ -0,0 +1,299 @@
+"""Proxy for EE download urls, finished downloads are cached on local disk."""
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+import requests
+import requests.adapters
+
+from hydroengine_service import error_handler
+
+logger = logging.getLogger(__name__)
+
+# size of the chunks streamed to the client
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_request_key(name, params):
+    """
+    Key of a download, a hash of the canonical (sorted) request
+    :param name: String, name of the kind of download, e.g. raster
+    :param params: json serializable request parameters
+    :return: String
+    """
+    canonical = json.dumps([name, params], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def get_filename(response, default):
+    """filename from the Content-Disposition header of a response"""
+    match = re.search(r'filename="?([^";]+)"?', response.headers.get('Content-Disposition', ''))
+    if match:
+        return match.group(1)
+    return default
+
+
+class DownloadProxy(object):
+    """
+    Leases on EE download urls. A download is addressed by the key of the request,
+    the download url is generated again when it expires and finished downloads are
+    stored in a disk cache. Leases are stored in the same cache: after a restart
+    finished downloads are still served and unfinished ones are fetched with the
+    last generated url.
+    """
+
+    def __init__(self, cache, url_max_age, lease_time, timeout=600):
+        """
+        :param cache: DiskCache to store finished downloads in
+        :param url_max_age: Number of seconds a generated download url is used
+        :param lease_time: Number of seconds a download can be requested after it is registered
+        :param timeout: Timeout of upstream requests in seconds
+        """
+        self.cache = cache
+        self.url_max_age = url_max_age
+        self.lease_time = lease_time
+        self.timeout = timeout
+
+        self.leases = {}
+        self._lock = threading.Lock()
+        # one lock per download, generating a url does not block the other downloads
+        self._key_locks = {}
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def register(self, key, resolve, filename='download', url=None):
+        """
+        Register a download
+        :param key: String, key of the request, see get_request_key
+        :param resolve: function returning a (new) download url
+        :param filename: String, filename used if upstream does not provide one
+        :param url: String, download url already generated by resolve
+        """
+        now = time.time()
+        with self._lock:
+            # forget expired leases
+            for k in [k for k, lease in self.leases.items() if lease['expires'] < now]:
+                del self.leases[k]
+                self._key_locks.pop(k, None)
+
+            lease = self._get_lease(key)
+            if lease is None or lease['expires'] < now:
+                lease = {'filename': filename, 'url': url, 'resolved': now}
+            lease['resolve'] = resolve
+            lease['expires'] = now + self.lease_time
+
+            self.leases[key] = lease
+            self._put_lease(key, lease)
+
+    def _put_lease(self, key, lease):
+        # stored next to the download, leases survive a restart of the service
+        data = {k: v for k, v in lease.items() if k != 'resolve'}
+        self.cache.put(key + '/lease', json.dumps(data).encode('utf-8'))
+
+    def _get_lease(self, key):
+        lease = self.leases.get(key)
+        if lease is None:
+            data = self.cache.get(key + '/lease')
+            if data is not None:
+                # registered before a restart, the url can not be generated again
+                lease = dict(json.loads(data.decode('utf-8')), resolve=None)
+                self.leases[key] = lease
+        return lease
+
+    def get_lease(self, key):
+        """lease of a registered download, raises InvalidUsage if it does not exist (anymore)"""
+        with self._lock:
+            lease = self._get_lease(key)
+
+        if lease is None or lease['expires'] < time.time():
+            raise error_handler.InvalidUsage('Download %s is not available (anymore), request it again.' % key,
+                                             status_code=404)
+        return lease
+
+    def _get_key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get_url(self, key):
+        """current download url of a registered download"""
+        lease = self.get_lease(key)
+
+        with self._get_key_lock(key):
+            expired = lease['url'] is None or time.time() - lease['resolved'] > self.url_max_age
+
+            # leases restored from disk keep using their url, upstream tells if it still works
+            if expired and lease['resolve'] is not None:
+                lease['url'] = lease['resolve']()
+                lease['resolved'] = time.time()
+                self._put_lease(key, lease)
+
+            if lease['url'] is None:
+                raise error_handler.InvalidUsage('Download %s is not available (anymore), request it again.' % key,
+                                                 status_code=404)
+
+            return lease['url']
+
+    def get_cached(self, key):
+        """
+        Finished download
+        :return: tuple of path and metadata (mimetype, filename), None if not cached
+        """
+        path = self.cache.path(key)
+        metadata = self.cache.get(key + '/metadata')
+        if metadata is None or not os.path.isfile(path):
+            return None
+
+        self.cache.touch(path)
+
+        return path, json.loads(metadata.decode('utf-8'))
+
+    def stream(self, key):
+        """
+        Start downloading from upstream
+        :return: tuple of a generator of chunks and metadata (mimetype, filename),
+        the download is cached once the generator is exhausted
+        """
+        lease = self.get_lease(key)
+        upstream = self.session.get(self.get_url(key), stream=True, timeout=self.timeout)
+
+        if upstream.status_code != 200:
+            upstream.close()
+            if 400 <= upstream.status_code < 500 and lease['resolve'] is None:
+                # expired url of a lease restored from disk
+                msg = 'Download %s is not available (anymore), request it again.' % key
+                raise error_handler.InvalidUsage(msg, status_code=404)
+            msg = 'Upstream download returned %d for %s' % (upstream.status_code, key)
+            raise error_handler.InvalidUsage(msg, status_code=502)
+
+        metadata = {
+            'mimetype': upstream.headers.get('Content-Type', 'application/octet-stream'),
+            'filename': get_filename(upstream, lease['filename']),
+            'size': None
+        }
+        # content is decoded while streaming, only pass on the size of unencoded content
+        if 'Content-Encoding' not in upstream.headers:
+            metadata['size'] = upstream.headers.get('Content-Length')
+
+        return self._tee(key, upstream, metadata), metadata
+
+    def _tee(self, key, upstream, metadata):
+        # yield chunks to the client and write them to a temporary file
+        fd, tmp = self.cache.mkstemp(key)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in upstream.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    yield chunk
+        except BaseException:
+            # client went away or upstream failed, do not cache a partial download
+            os.remove(tmp)
+            raise
+        finally:
+            upstream.close()
+
+        self.cache.commit(key, tmp)
+        self.cache.put(key + '/metadata', json.dumps(metadata).encode('utf-8'))
+
+    def store(self, key, write, metadata):
+        """
+        Store a download produced by the service itself
+        :param key: String, key of the request, see get_request_key
+        :param write: function (path) writing the download to a file
+        :param metadata: Dictionary with mimetype and filename
+        """
+        fd, tmp = self.cache.mkstemp(key)
+        os.close(fd)
+        try:
+            write(tmp)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        self.cache.commit(key, tmp)
+        self.cache.put(key + '/metadata', json.dumps(metadata).encode('utf-8'))
+
+
+class DownloadJobs(object):
+    """
+    Downloads produced in the background, e.g. rasters fetched from EE in parts.
+    Finished downloads are stored in the cache of a DownloadProxy.
+    """
+
+    def __init__(self, proxy, workers=2, max_age=24 * 60 * 60):
+        """
+        :param proxy: DownloadProxy storing the finished downloads
+        :param workers: Number of jobs running concurrently
+        :param max_age: Number of seconds a finished job is kept
+        """
+        self.proxy = proxy
+        self.max_age = max_age
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+
+    def submit(self, key, write, filename, mimetype='application/octet-stream'):
+        """
+        Start a job, unless the download is cached or already being produced
+        :param key: String, key of the request, see get_request_key
+        :param write: function (path, progress) writing the download to a file and
+        calling progress(done, total)
+        :return: Dictionary, the job
+        """
+        now = time.time()
+        with self._lock:
+            for job_id in [k for k, job in self.jobs.items() if job['finished'] and job['finished'] < now - self.max_age]:
+                del self.jobs[job_id]
+
+            for job in self.jobs.values():
+                if job['key'] == key and job['status'] != 'FAILED':
+                    return job
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'key': key,
+                'status': 'RUNNING',
+                'progress': 0.0,
+                'error': None,
+                'finished': None
+            }
+
+            if self.proxy.get_cached(key) is not None:
+                job.update({'status': 'COMPLETED', 'progress': 1.0, 'finished': now})
+                self.jobs[job['id']] = job
+                return job
+
+            self.jobs[job['id']] = job
+
+        def progress(done, total):
+            job['progress'] = done / total
+
+        def run():
+            try:
+                metadata = {'mimetype': mimetype, 'filename': filename, 'size': None}
+                self.proxy.store(key, lambda path: write(path, progress), metadata)
+                job['status'] = 'COMPLETED'
+            except Exception as e:
+                logger.exception('Download job %s failed', job['id'])
+                job['status'] = 'FAILED'
+                job['error'] = getattr(e, 'message', str(e))
+            job['finished'] = time.time()
+
+        self._executor.submit(run)
+
+        return job
+
+    def get(self, job_id):
+        """job by id, raises InvalidUsage if it does not exist"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise error_handler.InvalidUsage('Job %s does not exist.' % job_id, status_code=404)
+        return job
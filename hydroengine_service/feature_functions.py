@@ -0,0 +1,291 @@
+"""Retrieval of (large) feature collections and their output formats."""
+import io
+import itertools
+import json
+import struct
+
+import ee
+import numpy as np
+from flask import request, Response, stream_with_context
+
+from hydroengine_service import error_handler
+from hydroengine_service import geometry_functions
+from hydroengine_service import response_functions
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+FORMATS = {
+    'geojson': 'application/json',
+    'arrow': ARROW_MIMETYPE
+}
+
+# number of features retrieved from EE per request
+BATCH_SIZE = 1000
+
+WKB_TYPES = {
+    'Point': 1,
+    'LineString': 2,
+    'Polygon': 3,
+    'MultiPoint': 4,
+    'MultiLineString': 5,
+    'MultiPolygon': 6,
+    'GeometryCollection': 7
+}
+
+
+def _wkb_header(geometry_type):
+    # little endian byte order, geometry type
+    return struct.pack('<BI', 1, WKB_TYPES[geometry_type])
+
+
+def _wkb_points(coordinates):
+    points = np.asarray(coordinates, dtype='<f8')
+    if not points.size:
+        return b''
+    return points[:, :2].tobytes()
+
+
+def _wkb_line(coordinates):
+    return struct.pack('<I', len(coordinates)) + _wkb_points(coordinates)
+
+
+def to_wkb(geometry):
+    """
+    Encode a GeoJSON geometry as (2D) Well-Known Binary
+    :param geometry: GeoJSON geometry dictionary
+    :return: bytes, None for a missing geometry
+    """
+    if geometry is None:
+        return None
+
+    geometry_type = geometry['type']
+    header = _wkb_header(geometry_type)
+
+    if geometry_type == 'GeometryCollection':
+        parts = geometry['geometries']
+        return header + struct.pack('<I', len(parts)) + b''.join(to_wkb(g) for g in parts)
+
+    coordinates = geometry['coordinates']
+
+    if geometry_type == 'Point':
+        if not coordinates:
+            return header + struct.pack('<dd', np.nan, np.nan)
+        return header + _wkb_points([coordinates])
+
+    if geometry_type == 'LineString':
+        return header + _wkb_line(coordinates)
+
+    if geometry_type == 'Polygon':
+        return header + struct.pack('<I', len(coordinates)) + b''.join(_wkb_line(r) for r in coordinates)
+
+    part_type = geometry_type[len('Multi'):]
+    parts = [to_wkb({'type': part_type, 'coordinates': c}) for c in coordinates]
+
+    return header + struct.pack('<I', len(parts)) + b''.join(parts)
+
+
+def iter_feature_batches(collection, batch_size=None):
+    """
+    Retrieve features from an EE FeatureCollection in batches, this also avoids
+    the limit on the number of features returned by a single getInfo().
+    :param collection: ee.FeatureCollection
+    :param batch_size: Number of features per batch, BATCH_SIZE if None
+    :return: generator of lists of GeoJSON features
+    """
+    batch_size = batch_size or BATCH_SIZE
+    offset = 0
+    while True:
+        features = collection.toList(batch_size, offset).getInfo()
+
+        if features:
+            yield features
+
+        if len(features) < batch_size:
+            return
+
+        offset += batch_size
+
+
+def get_property_types(collection):
+    """
+    Types of the properties of all features of a collection, evaluated in a single request
+    :param collection: ee.FeatureCollection
+    :return: dictionary of property name and set of types (Integer, Float, String, ...)
+    """
+    def get_type(key, value):
+        value_type = ee.Algorithms.ObjectType(value)
+        number_type = ee.Algorithms.If(ee.Number(value).round().eq(value), 'Integer', 'Float')
+        value_type = ee.Algorithms.If(ee.Algorithms.IsEqual(value_type, 'Number'), number_type, value_type)
+        return ee.String(key).cat(':').cat(value_type)
+
+    def get_feature_types(f):
+        return ee.Feature(None, {'types': f.toDictionary().map(get_type).values()})
+
+    # distinct name:type pairs, not a value per feature
+    pairs = ee.List(collection.map(get_feature_types).aggregate_array('types')).flatten().distinct().getInfo()
+
+    property_types = {}
+    for pair in pairs:
+        name, value_type = pair.rsplit(':', 1)
+        property_types.setdefault(name, set()).add(value_type)
+
+    return property_types
+
+
+def _geometry_field(crs):
+    metadata = {
+        'ARROW:extension:name': 'geoarrow.wkb',
+        'ARROW:extension:metadata': json.dumps({'crs': crs, 'crs_type': 'authority_code'})
+    }
+    return pa.field('geometry', pa.binary(), metadata=metadata)
+
+
+def get_arrow_schema(property_types, crs):
+    """
+    Arrow schema of features: id, GeoArrow (WKB) geometry and a column per property,
+    integers are stored as float64 when a property also has fractional values
+    :param property_types: dictionary of property name and set of types, see get_property_types
+    :param crs: String, coordinate reference system of the geometries
+    :return: pyarrow.Schema
+    """
+    arrow_types = {
+        frozenset(['Integer']): pa.int64(),
+        frozenset(['Float']): pa.float64(),
+        frozenset(['Integer', 'Float']): pa.float64(),
+        frozenset(['String']): pa.string()
+    }
+
+    fields = []
+    for name in sorted(property_types):
+        types = frozenset(property_types[name])
+        if types not in arrow_types:
+            msg = 'property %s has values of type %s, which do not fit a single Arrow column, use format geojson' % (
+                name, ', '.join(sorted(types)))
+            raise error_handler.InvalidUsage(msg)
+        fields.append(pa.field(name, arrow_types[types]))
+
+    return pa.schema([pa.field('id', pa.string()), _geometry_field(crs)] + fields)
+
+
+def _to_array(name, values, arrow_type):
+    # inferred and cast safely: lossy conversions (e.g. 1.5 to int64) raise instead of truncating
+    try:
+        return pa.array(values).cast(arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        raise error_handler.InvalidUsage('property %s does not fit type %s: %s' % (name, arrow_type, e))
+
+
+def features_to_record_batch(features, schema):
+    """
+    Convert GeoJSON features into an Arrow record batch with a GeoArrow (WKB) geometry column
+    :param features: list of GeoJSON features
+    :param schema: pyarrow.Schema, see get_arrow_schema
+    :return: pyarrow.RecordBatch
+    """
+    rows = [f.get('properties') or {} for f in features]
+    ids = [None if f.get('id') is None else str(f['id']) for f in features]
+    geometries = [to_wkb(f.get('geometry')) for f in features]
+
+    fields = list(schema)[2:]
+
+    unknown = set(name for r in rows for name in r if r[name] is not None) - set(f.name for f in fields)
+    if unknown:
+        raise error_handler.InvalidUsage('properties %s are not in the schema' % ', '.join(sorted(unknown)))
+
+    arrays = [pa.array(ids, pa.string()), pa.array(geometries, pa.binary())]
+    arrays += [_to_array(f.name, [r.get(f.name) for r in rows], f.type) for f in fields]
+
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _generate_arrow_stream(batches, schema):
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def flush():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    for batch in batches:
+        writer.write_batch(batch)
+        yield flush()
+
+    writer.close()
+    yield flush()
+
+
+def get_request_format():
+    """Requested output format for features, from format argument or Accept header"""
+    r = request.get_json(silent=True)
+
+    output_format = request.args.get('format')
+    if output_format is None and isinstance(r, dict):
+        output_format = r.get('format')
+
+    if output_format is None:
+        mimetype = request.accept_mimetypes.best_match(
+            ['application/json', ARROW_MIMETYPE], default='application/json')
+        output_format = 'arrow' if mimetype == ARROW_MIMETYPE else 'geojson'
+
+    if output_format not in FORMATS:
+        msg = 'format %s is not supported, use one of: %s' % (output_format, ', '.join(FORMATS))
+        raise error_handler.InvalidUsage(msg)
+
+    return output_format
+
+
+def feature_collection_response(collection, crs='EPSG:4326', max_age=None):
+    """
+    Create a response for a feature collection in the requested format, either
+    GeoJSON or an Arrow IPC stream (GeoArrow WKB geometries) streamed batch by batch
+    :param collection: ee.FeatureCollection
+    :param crs: String, coordinate reference system of the response, features are
+    retrieved in EPSG:4326 and reprojected locally
+    :param max_age: Number of seconds the response may be cached
+    :return: flask.Response
+    """
+    output_format = get_request_format()
+
+    if output_format == 'geojson':
+        data = collection.getInfo()
+        data['features'] = geometry_functions.transform_features(data['features'], crs)
+
+        response = response_functions.json_response(data, max_age=max_age)
+        response.vary.add('Accept')
+        return response
+
+    if pa is None:
+        raise error_handler.InvalidUsage('format arrow is not available, pyarrow is not installed.')
+
+    # the schema is declared from the property types of all features, not inferred per batch
+    schema = get_arrow_schema(get_property_types(collection), crs)
+
+    batches = (
+        features_to_record_batch(geometry_functions.transform_features(features, crs), schema)
+        for features in iter_feature_batches(collection)
+    )
+
+    # retrieve the first batch before streaming, errors result in a normal error response
+    first = next(batches, None)
+    if first is not None:
+        batches = itertools.chain([first], batches)
+
+    response = Response(
+        stream_with_context(_generate_arrow_stream(batches, schema)),
+        status=200,
+        mimetype=ARROW_MIMETYPE
+    )
+    response.vary.add('Accept')
+
+    if max_age is not None:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+
+    return response
@@ -0,0 +1,286 @@
+"""
+Bounds, geodesic area, length and reprojection of GeoJSON geometries (EPSG:4326),
+computed locally with numpy.
+"""
+import functools
+
+import numpy as np
+
+from hydroengine_service import error_handler
+
+try:
+    import pyproj
+except ImportError:
+    pyproj = None
+
+# radius of the sphere used for geodesic computations, in meters
+EARTH_RADIUS = 6378137.0
+
+# number of points per segment transformed for the bounds in another crs
+DENSIFY_POINTS = 21
+
+# nesting depth of positions in the coordinates of geometry types
+COORDINATE_DEPTHS = {
+    'Point': 0,
+    'MultiPoint': 1,
+    'LineString': 1,
+    'MultiLineString': 2,
+    'Polygon': 2,
+    'MultiPolygon': 3
+}
+
+
+def get_geometry(geojson):
+    """geometry of a GeoJSON geometry or Feature"""
+    if geojson.get('type') == 'Feature':
+        return geojson['geometry']
+    return geojson
+
+
+def iter_geometries(geojson):
+    """generate the simple geometries in GeoJSON (FeatureCollection, Feature or geometry)"""
+    if geojson['type'] == 'FeatureCollection':
+        for feature in geojson['features']:
+            yield from iter_geometries(feature)
+        return
+
+    geometry = get_geometry(geojson)
+    if geometry is None:
+        return
+
+    if geometry['type'] == 'GeometryCollection':
+        for g in geometry['geometries']:
+            yield from iter_geometries(g)
+        return
+
+    yield geometry
+
+
+def get_coordinates(geojson):
+    """all coordinates of GeoJSON as an array of (lon, lat)"""
+    parts = []
+    for geometry in iter_geometries(geojson):
+        if geometry['type'] == 'Point':
+            parts.append(np.asarray([geometry['coordinates']], dtype=float)[:, :2])
+        else:
+            parts.extend(np.asarray(line, dtype=float)[:, :2] for line in iter_lines(geometry) if len(line))
+
+    if not parts:
+        return np.empty((0, 2))
+
+    return np.concatenate(parts)
+
+
+def iter_lines(geometry):
+    """generate the lines (line strings and polygon rings) of a geometry"""
+    geometry_type = geometry['type']
+    coordinates = geometry['coordinates']
+
+    if geometry_type in ('LineString', 'MultiPoint'):
+        yield coordinates
+    elif geometry_type in ('MultiLineString', 'Polygon'):
+        yield from coordinates
+    elif geometry_type == 'MultiPolygon':
+        for polygon in coordinates:
+            yield from polygon
+
+
+def get_bounds(geojson):
+    """
+    Bounds of GeoJSON
+    :return: tuple of (west, south, east, north)
+    """
+    coordinates = get_coordinates(geojson)
+    west, south = coordinates.min(axis=0)
+    east, north = coordinates.max(axis=0)
+    return float(west), float(south), float(east), float(north)
+
+
+def bounds_to_polygon(bounds):
+    """GeoJSON Polygon of bounds (west, south, east, north)"""
+    west, south, east, north = bounds
+    return {
+        'type': 'Polygon',
+        'coordinates': [[[west, south], [east, south], [east, north], [west, north], [west, south]]]
+    }
+
+
+def ring_area(ring):
+    """
+    Geodesic area of a ring on a sphere, in square meters
+    :param ring: array of (lon, lat)
+    """
+    ring = np.radians(np.asarray(ring, dtype=float)[:, :2])
+    if len(ring) < 3:
+        return 0.0
+
+    # drop closing point, the ring is closed by wrapping around
+    if np.array_equal(ring[0], ring[-1]):
+        ring = ring[:-1]
+
+    lon, lat = ring[:, 0], ring[:, 1]
+    area = np.sum((np.roll(lon, -1) - np.roll(lon, 1)) * np.sin(lat))
+    return float(abs(area) * EARTH_RADIUS ** 2 / 2)
+
+
+def area(geojson):
+    """
+    Geodesic area of the (multi)polygons in GeoJSON, holes are subtracted
+    :return: Number, area in square meters
+    """
+    total = 0.0
+    for geometry in iter_geometries(geojson):
+        if geometry['type'] == 'Polygon':
+            polygons = [geometry['coordinates']]
+        elif geometry['type'] == 'MultiPolygon':
+            polygons = geometry['coordinates']
+        else:
+            continue
+
+        for polygon in polygons:
+            if not polygon:
+                continue
+            total += ring_area(polygon[0]) - sum(ring_area(hole) for hole in polygon[1:])
+
+    return total
+
+
+def line_distances(line):
+    """
+    Geodesic (haversine) distance along a line on a sphere at each vertex, in meters
+    :param line: array of (lon, lat)
+    :return: array, 0 at the first vertex
+    """
+    line = np.radians(np.asarray(line, dtype=float)[:, :2])
+    if len(line) < 2:
+        return np.zeros(len(line))
+
+    lon, lat = line[:, 0], line[:, 1]
+    a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+    return np.concatenate([[0.0], np.cumsum(2 * EARTH_RADIUS * np.arcsin(np.sqrt(a)))])
+
+
+def line_length(line):
+    """
+    Geodesic (haversine) length of a line on a sphere, in meters
+    :param line: array of (lon, lat)
+    """
+    distances = line_distances(line)
+    if len(distances) < 2:
+        return 0.0
+
+    return float(distances[-1])
+
+
+def length(geojson):
+    """
+    Geodesic length of the (multi)line strings in GeoJSON
+    :return: Number, length in meters
+    """
+    total = 0.0
+    for geometry in iter_geometries(geojson):
+        if geometry['type'] in ('LineString', 'MultiLineString'):
+            total += sum(line_length(line) for line in iter_lines(geometry))
+
+    return total
+
+
+@functools.lru_cache(maxsize=32)
+def get_transformer(crs):
+    """transformer from EPSG:4326 (lon, lat) to crs, cached per crs"""
+    if pyproj is None:
+        raise error_handler.InvalidUsage('Reprojection is not available, pyproj is not installed.')
+
+    try:
+        return pyproj.Transformer.from_crs('EPSG:4326', crs, always_xy=True)
+    except pyproj.exceptions.CRSError:
+        raise error_handler.InvalidUsage('Unknown crs: %s' % crs)
+
+
+def densify_line(line, n):
+    """
+    Line with points inserted along its segments
+    :param line: array of (lon, lat)
+    :param n: Number of points per segment, including its start
+    :return: array of (lon, lat)
+    """
+    line = np.asarray(line, dtype=float)[:, :2]
+    if len(line) < 2:
+        return line
+
+    t = np.arange(n) / n
+    points = line[:-1, None, :] + t[None, :, None] * (line[1:] - line[:-1])[:, None, :]
+
+    return np.concatenate([points.reshape(-1, 2), line[-1:]])
+
+
+def get_projected_bounds(geojson, crs):
+    """
+    Bounds of GeoJSON reprojected to crs. Segments are densified before they are
+    transformed, straight lines (e.g. parallels) may be curved in crs.
+    :return: tuple of (xmin, ymin, xmax, ymax)
+    """
+    if not crs or crs == 'EPSG:4326':
+        return get_bounds(geojson)
+
+    parts = [get_coordinates(geojson)]
+    for geometry in iter_geometries(geojson):
+        if geometry['type'] not in ('Point', 'MultiPoint'):
+            parts.extend(densify_line(line, DENSIFY_POINTS) for line in iter_lines(geometry) if len(line))
+
+    coordinates = np.concatenate(parts)
+    x, y = get_transformer(crs).transform(coordinates[:, 0], coordinates[:, 1])
+    return float(np.min(x)), float(np.min(y)), float(np.max(x)), float(np.max(y))
+
+
+def _flatten(coordinates, depth, positions):
+    if depth == 0:
+        if coordinates:
+            positions.append(coordinates[:2])
+        return
+
+    for c in coordinates:
+        _flatten(c, depth - 1, positions)
+
+
+def _unflatten(coordinates, depth, positions):
+    if depth == 0:
+        return next(positions) if coordinates else coordinates
+
+    return [_unflatten(c, depth - 1, positions) for c in coordinates]
+
+
+def transform_features(features, crs):
+    """
+    Reproject GeoJSON features from EPSG:4326, the coordinates of all features are
+    transformed in a single vectorized call
+    :param features: list of GeoJSON features
+    :param crs: String, e.g. EPSG:3857
+    :return: list of GeoJSON features
+    """
+    if not crs or crs == 'EPSG:4326':
+        return features
+
+    transformer = get_transformer(crs)
+
+    geometries = []
+    for feature in features:
+        geometries.extend(iter_geometries(feature))
+
+    positions = []
+    for geometry in geometries:
+        _flatten(geometry['coordinates'], COORDINATE_DEPTHS[geometry['type']], positions)
+
+    if not positions:
+        return features
+
+    positions = np.asarray(positions, dtype=float)
+    x, y = transformer.transform(positions[:, 0], positions[:, 1])
+    transformed = iter(np.column_stack([x, y]).tolist())
+
+    # geometries are updated in place
+    for geometry in geometries:
+        geometry['coordinates'] = _unflatten(
+            geometry['coordinates'], COORDINATE_DEPTHS[geometry['type']], transformed)
+
+    return features
@@ -0,0 +1,302 @@
+"""
+Monthly water area of HydroLAKES lakes, evaluated for many lakes at once and kept
+in a local columnar store.
+"""
+import concurrent.futures
+import logging
+import os
+import threading
+import uuid
+
+import ee
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+LAKES = 'users/gena/HydroLAKES_polys_v10'
+MONTHLY_WATER = 'JRC/GSW1_2/MonthlyHistory'
+
+# lakes are reduced at the smallest of these scales (meters) above their estimated scale
+SCALES = (30, 60, 120, 240, 480, 960, 1920)
+# number of pixels along the largest side of a lake, used to estimate its scale
+MAX_PIXEL_COUNT = 1000
+
+COLUMNS = ['Hylak_id', 'time', 'water_area']
+
+# lakes per EE request when filling the store
+STORE_BATCH_SIZE = 100
+# number of EE requests running concurrently when filling the store
+STORE_WORKERS = 4
+
+
+def _set_scale(f):
+    # estimate scale from the lake size (bounds in EPSG:3857)
+    coords = ee.List(f.geometry().bounds().transform('EPSG:3857', 30).coordinates().get(0))
+    ll = ee.List(coords.get(0))
+    ur = ee.List(coords.get(2))
+    width = ee.Number(ll.get(0)).subtract(ur.get(0)).abs()
+    height = ee.Number(ll.get(1)).subtract(ur.get(1)).abs()
+
+    return f.set('scale', width.max(height).divide(MAX_PIXEL_COUNT).max(SCALES[0]))
+
+
+def get_water_area_rows(lake_ids, scale=None, start=None, stop=None):
+    """
+    Monthly water area of lakes, one reduceRegions per month and scale class
+    :param lake_ids: list of Hylak_id
+    :param scale: Number, scale in meters, estimated per lake if None
+    :param start: start date of the months, all months if None
+    :param stop: end date (exclusive)
+    :return: ee.List of [Hylak_id, time (epoch ms), water_area (m2)] rows
+    """
+    lakes = ee.FeatureCollection(LAKES).filter(ee.Filter.inList('Hylak_id', list(lake_ids)))
+
+    monthly = ee.ImageCollection(MONTHLY_WATER)
+    if start is not None:
+        monthly = monthly.filterDate(start, stop)
+
+    if scale:
+        groups = [(lakes, scale)]
+    else:
+        lakes = lakes.map(_set_scale)
+        bounds = (0,) + SCALES[:-1]
+        groups = [
+            (lakes.filter(ee.Filter.And(ee.Filter.gt('scale', lower), ee.Filter.lte('scale', upper))), upper)
+            for lower, upper in zip(bounds, SCALES)
+        ]
+        # larger lakes at the coarsest scale
+        groups.append((lakes.filter(ee.Filter.gt('scale', SCALES[-1])), SCALES[-1]))
+
+    reducer = ee.Reducer.sum().setOutputs(['water_area'])
+
+    def reduce_group(group, group_scale):
+        def reduce_month(i):
+            water = i.eq(2).multiply(ee.Image.pixelArea())
+            time = i.date().millis()
+            return water.reduceRegions(group, reducer, group_scale).map(lambda f: f.set('time', time))
+
+        return monthly.map(reduce_month).flatten()
+
+    areas = ee.FeatureCollection([reduce_group(*group) for group in groups]).flatten()
+
+    # a list instead of features, not limited to 5000 elements
+    return ee.List(areas.reduceColumns(ee.Reducer.toList(len(COLUMNS)), COLUMNS).get('list'))
+
+
+def to_lake_columns(rows, lake_ids):
+    """
+    Columns per lake of [Hylak_id, time, water_area] rows
+    :return: list of dictionaries with lake_id, time and water_area, in the order of lake_ids
+    """
+    if rows:
+        ids, times, areas = (np.array(c) for c in zip(*rows))
+    else:
+        ids, times, areas = np.empty(0, dtype=int), np.empty(0, dtype='int64'), np.empty(0)
+
+    order = np.lexsort((times, ids))
+    ids, times, areas = ids[order], times[order].astype('int64'), areas[order].astype(float)
+
+    lakes = []
+    for lake_id in lake_ids:
+        start = np.searchsorted(ids, lake_id, side='left')
+        end = np.searchsorted(ids, lake_id, side='right')
+        lakes.append({'lake_id': lake_id, 'time': times[start:end], 'water_area': areas[start:end]})
+
+    return lakes
+
+
+class LakeAreaStore(object):
+    """
+    Monthly water areas in parquet files in a directory, one row per lake and month.
+    A bulk fill or an update writes new parts and then compacts the store into a
+    single part. The parts are read into memory once and again when they change.
+    """
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        self._lock = threading.Lock()
+        self._signature = None
+        self._ids = self._times = self._areas = None
+
+    def _get_parts(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+
+        return sorted(os.path.join(self.directory, n) for n in names if n.endswith('.parquet'))
+
+    @staticmethod
+    def _read(parts):
+        """rows of parts sorted by lake and time, rows of later parts replace rows of the same lake and month"""
+        ids, times, areas = np.empty(0, dtype='int64'), np.empty(0, dtype='int64'), np.empty(0)
+        if parts and pq is not None:
+            table = pa.concat_tables([pq.read_table(p, columns=COLUMNS) for p in parts])
+            ids, times, areas = (table.column(c).to_numpy() for c in COLUMNS)
+
+        sequence = np.arange(len(ids))
+        order = np.lexsort((-sequence, times, ids))
+        ids, times, areas = ids[order], times[order], areas[order]
+        first = np.ones(len(ids), dtype=bool)
+        first[1:] = (ids[1:] != ids[:-1]) | (times[1:] != times[:-1])
+
+        return ids[first], times[first], areas[first]
+
+    def _load(self):
+        with self._lock:
+            while True:
+                parts = self._get_parts()
+                signature = tuple(parts)
+                if signature == self._signature:
+                    return self._ids, self._times, self._areas
+
+                try:
+                    self._ids, self._times, self._areas = self._read(parts)
+                except FileNotFoundError:
+                    # parts removed by a compaction, read the compacted part
+                    continue
+
+                self._signature = signature
+
+                return self._ids, self._times, self._areas
+
+    def get(self, lake_id):
+        """time series of a lake, None if the lake is not in the store"""
+        ids, times, areas = self._load()
+
+        start = np.searchsorted(ids, lake_id, side='left')
+        end = np.searchsorted(ids, lake_id, side='right')
+        if start == end:
+            return None
+
+        return {'time': times[start:end], 'water_area': areas[start:end]}
+
+    def get_lake_ids(self):
+        """ids of the lakes in the store"""
+        return np.unique(self._load()[0]).tolist()
+
+    def get_last_times(self):
+        """time (epoch ms) of the last month per lake in the store"""
+        ids, times, _ = self._load()
+
+        # rows are sorted by lake and time
+        last = np.ones(len(ids), dtype=bool)
+        last[:-1] = ids[1:] != ids[:-1]
+
+        return dict(zip(ids[last].tolist(), times[last].tolist()))
+
+    def append(self, rows):
+        """
+        Add a part
+        :param rows: list of [Hylak_id, time, water_area]
+        """
+        if pa is None:
+            raise RuntimeError('The lake store is not available, pyarrow is not installed.')
+
+        if not rows:
+            return
+
+        self._write(*zip(*rows))
+
+    def _write(self, ids, times, areas):
+        table = pa.table({
+            'Hylak_id': pa.array(ids, type=pa.int64()),
+            'time': pa.array(times, type=pa.int64()),
+            'water_area': pa.array(areas, type=pa.float64())
+        })
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # parts are numbered, later parts take precedence
+        parts = self._get_parts()
+        number = int(os.path.basename(parts[-1]).split('-')[1]) + 1 if parts else 0
+
+        # written under a temporary name, readers never see a partial part
+        name = 'part-%06d-%s' % (number, uuid.uuid4().hex)
+        tmp = os.path.join(self.directory, '.tmp-' + name)
+        pq.write_table(table, tmp)
+        os.replace(tmp, os.path.join(self.directory, name + '.parquet'))
+
+    def compact(self):
+        """
+        Replace the parts by a single part without replaced rows. The compacted part
+        is written before the parts are removed, readers see all rows at any time.
+        """
+        if pa is None:
+            raise RuntimeError('The lake store is not available, pyarrow is not installed.')
+
+        parts = self._get_parts()
+        if len(parts) < 2:
+            return
+
+        self._write(*self._read(parts))
+
+        for part in parts:
+            os.remove(part)
+
+
+def fill_store(store, lake_ids, start=None, batch_size=None, workers=None, compact=True):
+    """
+    Compute monthly water areas of lakes in batches and add them to the store
+    :param store: LakeAreaStore
+    :param lake_ids: list of Hylak_id
+    :param start: start date (or epoch ms) of the months, all months if None
+    :param compact: Boolean, compact the store once all batches are added
+    :return: Number of rows added
+    """
+    batch_size = batch_size or STORE_BATCH_SIZE
+    batches = [lake_ids[i:i + batch_size] for i in range(0, len(lake_ids), batch_size)]
+
+    def compute(batch):
+        return get_water_area_rows(batch, start=start).getInfo()
+
+    n_rows = 0
+    with concurrent.futures.ThreadPoolExecutor(workers or STORE_WORKERS) as executor:
+        # the store is written from this thread only
+        for i, rows in enumerate(executor.map(compute, batches)):
+            store.append(rows)
+            n_rows += len(rows)
+            logger.info('Added %d rows of batch %d/%d to the lake store', len(rows), i + 1, len(batches))
+
+    if compact:
+        store.compact()
+
+    return n_rows
+
+
+def update_store(store, batch_size=None, workers=None):
+    """
+    Add the months of MonthlyHistory images newer than the last month of each lake in
+    the store. Lakes are updated from their own last month: lakes of batches of an
+    earlier fill or update that failed are caught up.
+    :return: Number of rows added
+    """
+    last_times = store.get_last_times()
+    if not last_times:
+        return 0
+
+    newest = ee.ImageCollection(MONTHLY_WATER).aggregate_max('system:time_start').getInfo()
+    if newest is None:
+        return 0
+
+    # lakes with the same last month are filled together
+    groups = {}
+    for lake_id, last_time in last_times.items():
+        if last_time < newest:
+            groups.setdefault(last_time, []).append(lake_id)
+
+    n_rows = 0
+    for last_time, lake_ids in sorted(groups.items()):
+        n_rows += fill_store(store, lake_ids, start=last_time + 1, batch_size=batch_size, workers=workers,
+                             compact=False)
+
+    store.compact()
+
+    return n_rows
@@ -1,11 +1,14 @@
-import json
-
 import ee
 import flask_cors
-from flask import request, Response
+from flask import request
 from flask import Blueprint
 
+from hydroengine_service import config
+from hydroengine_service import download_blueprints
+from hydroengine_service import download_functions
 from hydroengine_service import liwo_functions
+from hydroengine_service import raster_functions
+from hydroengine_service import response_functions
 
 v1 = Blueprint("liwo-v1", __name__)
 v2 = Blueprint('liwo-v2', __name__)
@@ -14,6 +17,37 @@ v2 = Blueprint('liwo-v2', __name__)
 DEFAULT_COLLECTION = 'projects/deltares-rws/liwo/2021_0_3'
 
 
+def export_image(image, region, info, r, geometry=None):
+    """
+    Export an image through the download proxy, as a cloud optimized GeoTIFF
+    if the request has format 'cog'
+    :param geometry: GeoJSON of the region if given by the client, bounds are computed locally
+    :return: Dictionary, with export_url or, for COG, export_job
+    """
+    if r.get('format') == 'cog':
+        # fetched in windows and assembled into a COG in the background
+        pixel_size = raster_functions.get_pixel_size(info['crs'], info['scale'])
+        bounds = raster_functions.get_bounds(region, info['crs'], pixel_size, info['scale'], geometry=geometry)
+
+        def write(path, progress):
+            raster_functions.download_raster(
+                path, image.clip(region), info['crs'], bounds, pixel_size, progress=progress, cog=True)
+
+        key = download_functions.get_request_key('liwo-cog', r)
+        job = download_blueprints.download_jobs.submit(key, write, filename='export.tif', mimetype='image/tiff')
+        return {'export_job': download_blueprints.get_job_info(job)}
+
+    extra_info = liwo_functions.export_image_response(image, region, info, geometry=geometry)
+    # hand out a download through the proxy, EE download urls expire
+    extra_info['export_url'] = download_blueprints.get_download_url(
+        'liwo', r,
+        lambda: liwo_functions.export_image_response(image, region, info, geometry=geometry)['export_url'],
+        filename='export.zip',
+        url=extra_info['export_url']
+    )
+    return extra_info
+
+
 @v2.route('/get_liwo_scenarios_info', methods=['POST'])
 @flask_cors.cross_origin()
 def get_liwo_scenarios_info():
@@ -43,10 +77,9 @@ def get_liwo_scenarios_info():
 
     # return geojson
     result = selected.map(scenario_info).getInfo()
-    return Response(
-        json.dumps(result),
-        status=200,
-        mimetype='application/json'
+    return response_functions.json_response(
+        result,
+        max_age=config.CACHE_MAX_AGE_STATIC
     )
 
 
@@ -102,13 +135,11 @@ def get_liwo_scenarios():
         info['scale'] = r.get('scale', 5)
         # always
         info['crs'] = r.get('crs', 'EPSG:4326')
-        extra_info = liwo_functions.export_image_response(image, region, info)
-        info.update(extra_info)
+        info.update(export_image(image, region, info, r))
 
-    return Response(
-        json.dumps(info),
-        status=200,
-        mimetype='application/json'
+    return response_functions.json_response(
+        info,
+        max_age=response_functions.get_layer_max_age()
     )
 
 
@@ -160,11 +191,9 @@ def get_liwo_scenarios():
         info['scale'] = float(r['scale'])
         # coordinate system for export projection
         info['crs'] = r['crs']
-        extra_info = liwo_functions.export_image_response(image, region, info)
-        info.update(extra_info)
+        info.update(export_image(image, region, info, r, geometry=r['region']))
 
-    return Response(
-        json.dumps(info),
-        status=200,
-        mimetype='application/json'
+    return response_functions.json_response(
+        info,
+        max_age=response_functions.get_layer_max_age()
     )
@@ -7,6 +7,7 @@ import os
 from hydroengine_service import config
 from hydroengine_service import dgds_functions
 from hydroengine_service import error_handler
+from hydroengine_service import geometry_functions
 
 EE_CREDENTIALS = ee.ServiceAccountCredentials(config.EE_ACCOUNT,
                                               config.EE_PRIVATE_KEY_FILE)
@@ -176,13 +177,21 @@ def generate_image_info(im, params):
     return result
 
 
-def export_image_response(image, region, info):
-    """create export response for image"""
+def export_image_response(image, region, info, geometry=None):
+    """
+    create export response for image
+    geometry is the GeoJSON of the region if available, used to compute its bounds locally
+    """
+    if geometry is not None:
+        bounds = geometry_functions.bounds_to_polygon(geometry_functions.get_bounds(geometry))
+    else:
+        bounds = region.bounds(info['scale']).getInfo()
+
     url = image.getDownloadURL({
         'name': 'export',
         'crs': info['crs'],
         'scale': info['scale'],
-        'region': json.dumps(region.bounds(info['scale']).getInfo())
+        'region': json.dumps(bounds)
     })
     result = {'export_url': url}
     return result
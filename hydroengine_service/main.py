@@ -14,6 +14,8 @@ from flask import Flask
 from flask import request, Response
 from flask import Blueprint
 
+from hydroengine_service import cache_functions
+from hydroengine_service import composite_functions
 from hydroengine_service import config
 from hydroengine_service import error_handler
 
@@ -22,8 +24,23 @@ from hydroengine_service import dgds_blueprints
 
 from hydroengine_service import river_functions
 from hydroengine_service import dgds_functions
+from hydroengine_service import download_functions
+from hydroengine_service import feature_functions
+from hydroengine_service import geometry_functions
+from hydroengine_service import lake_functions
+from hydroengine_service import occurrence_functions
+from hydroengine_service import profile_functions
+from hydroengine_service import raster_functions
+from hydroengine_service import response_functions
+from hydroengine_service import retry_functions
+from hydroengine_service import skeleton_functions
+from hydroengine_service import tile_functions
+from hydroengine_service import timeseries_functions
+from hydroengine_service import water_functions
 
 from hydroengine_service import digitwin_blueprints
+from hydroengine_service import download_blueprints
+from hydroengine_service import tile_blueprints
 
 logger = logging.getLogger(__name__)
 
@@ -79,6 +96,9 @@ rivers = ee.FeatureCollection('users/gena/HydroEngine/riv_15s_lev06')
 
 # HydroLAKES
 lakes = ee.FeatureCollection('users/gena/HydroLAKES_polys_v10')
+lake_store = lake_functions.LakeAreaStore(config.LAKE_STORE_DIR)
+# lake time series follow the monthly updates of the water history
+LAKE_MAX_AGE = response_functions.get_source_max_age(lake_functions.MONTHLY_WATER)
 
 # available datasets for bathymetry
 bathymetry = {
@@ -95,6 +115,25 @@ index = ee.FeatureCollection('users/gena/HydroEngine/hybas_lev06_v1c_index')
 
 monthly_water = ee.ImageCollection("JRC/GSW1_2/MonthlyHistory")
 
+# vector tile layers, properties included in the tiles and minimum zoom level
+vector_tile_layers = {
+    'rivers': {
+        'properties': ['ARCID', 'UP_CELLS', 'HYBAS_ID'],
+        'min_zoom': 3
+    },
+    'catchments': {
+        'properties': ['HYBAS_ID', 'NEXT_DOWN', 'SUB_AREA', 'UP_AREA'],
+        'min_zoom': 2
+    },
+    'lakes': {
+        'properties': ['Hylak_id', 'Lake_name', 'Lake_area', 'Lake_type'],
+        'min_zoom': 4
+    }
+}
+
+vector_tile_cache = cache_functions.DiskCache(
+    config.CACHE_DIR / 'vector-tiles', config.TILE_CACHE_MAX_SIZE)
+
 
 def get_upstream_catchments(level):
     if level != 6:
@@ -228,7 +267,8 @@ def api_get_image_urls():
     infos = [generate_image_info(images.get(i)) for i in
              range(images.size().getInfo())]
 
-    resp = Response(json.dumps(infos), status=200, mimetype='application/json')
+    resp = response_functions.json_response(
+        infos, max_age=response_functions.get_layer_max_age())
 
     return resp
 
@@ -236,53 +276,57 @@ def api_get_image_urls():
 @v1.route('/get_sea_surface_height_time_series', methods=['POST'])
 @flask_cors.cross_origin()
 def get_sea_surface_height_time_series():
-    """generate bathymetry image for a certain timespan (begin_date, end_date) and a dataset {jetski | vaklodingen | kustlidar}"""
+    """
+    Get sea surface height time series at a point (region) or at multiple points,
+    as columns t (epoch ms) and v (float32 values)
+    """
     r = request.get_json()
 
     # get info from the request
-    dataset = r['region']
-    print(dataset)
+    region = r.get('region', None)
+    points = r.get('points', None)
 
     scale = 30
 
     if 'scale' in r:
         scale = float(r['scale'])
 
-    region = ee.Geometry(dataset)
-    images = ee.ImageCollection("users/fbaart/ssh_grids_v1609")
-
-    ssh_list = images.getRegion(region, scale, 'EPSG:4326')
-
-    ssh_rows = ssh_list.slice(1).map(
-        lambda x: {'t': ee.List(x).get(3), 'v': ee.List(x).get(4)}
+    if points is None:
+        if not region or region.get('type') not in ('Point', 'MultiPoint'):
+            raise error_handler.InvalidUsage('region must be a Point or MultiPoint, or points must be given')
+
+        if region['type'] == 'Point':
+            points = [region['coordinates']]
+        else:
+            points = region['coordinates']
+
+    series = timeseries_functions.get_time_series(
+        dgds_functions.SSH_GRIDS,
+        None,
+        points,
+        r.get('startDate', None),
+        r.get('endDate', None),
+        scale,
+        cache=dgds_blueprints.timeseries_cache,
+        cache_args=(dgds_functions.SSH_GRIDS,)
     )
 
-    return Response(json.dumps(ssh_rows.getInfo()), status=200, mimetype='application/json')
+    if len(series) == 1 and 'points' not in r:
+        data = series[0]
+    else:
+        data = {'points': points, 'series': series}
+
+    return response_functions.json_response(data)
 
 
 @v1.route('/get_sea_surface_height_trend_image', methods=['GET', 'POST'])
 @flask_cors.cross_origin()
 def get_sea_surface_height_trend_image():
     """generate bathymetry image for a certain timespan (begin_date, end_date) and a dataset {jetski | vaklodingen | kustlidar}"""
-    r = request.get_json()
-
-    image = ee.Image('users/fbaart/ssh-trend-map')
+    url = dgds_functions.visualize_ssh_trend()['url']
 
-    image = image.visualize(**{'bands': ['time'], 'min': -0.03, 'max': 0.03,
-                               'palette': ["151d44", "156c72", "7eb390",
-                                           "fdf5f4", "db8d77", "9c3060",
-                                           "340d35"]})
-
-    m = image.getMapId()
-
-    mapid = m.get('mapid')
-    url = 'https://earthengine.googleapis.com/v1alpha/{mapid}/tiles/{{z}}/{{x}}/{{y}}' \
-        .format(
-        mapid=mapid
-    )
-
-    response = Response(json.dumps({'url': url}), status=200,
-                        mimetype='application/json')
+    response = response_functions.json_response(
+        {'url': url}, max_age=response_functions.get_layer_max_age())
 
     return response
 
@@ -440,10 +484,39 @@ def api_get_bathymetry():
     if "hillshade" in r:
         info["hillshade"] = r["hillshade"]
 
-    resp = Response(json.dumps(info), status=200, mimetype='application/json')
+    resp = response_functions.json_response(
+        info, max_age=response_functions.get_layer_max_age())
     return resp
 
 
+PROFILE_RASTERS = {
+    'bathymetry_jetski': bathymetry['jetski'],
+    'bathymetry_vaklodingen': bathymetry['vaklodingen'],
+    'bathymetry_maasvlakte': bathymetry['maasvlakte'],
+    'bathymetry_lidar': bathymetry['kustlidar'],
+    'bathymetry_jarkus': bathymetry['jarkus'],
+    'bathymetry_ahn': bathymetry['ahn']
+}
+
+
+def get_profile_raster(dataset, begin_date=None, end_date=None):
+    """
+    Mean of the images of a bathymetry dataset, optionally within a period
+    :param dataset: String, a key of PROFILE_RASTERS, e.g. bathymetry_jetski
+    :return: ee.Image
+    """
+    if dataset not in PROFILE_RASTERS:
+        msg = 'Unknown dataset %s, use one of: %s' % (dataset, ', '.join(PROFILE_RASTERS))
+        raise error_handler.InvalidUsage(msg)
+
+    raster = PROFILE_RASTERS[dataset]
+
+    if begin_date:
+        raster = raster.filterDate(begin_date, end_date)
+
+    return raster.reduce(ee.Reducer.mean())
+
+
 @v1.route('/get_raster_profile', methods=['GET', 'POST'])
 @flask_cors.cross_origin()
 def api_get_raster_profile():
@@ -456,34 +529,54 @@ def api_get_raster_profile():
     begin_date = r['begin_date']
     end_date = r['end_date']
 
-    rasters = {
-        'bathymetry_jetski': bathymetry['jetski'],
-        'bathymetry_vaklodingen': bathymetry['vaklodingen'],
-        'bathymetry_maasvlakte': bathymetry['maasvlakte'],
-        'bathymetry_lidar': bathymetry['kustlidar']
-    }
-
-    raster = rasters[dataset]
-
-    if begin_date:
-        raster = raster.filterDate(begin_date, end_date)
+    raster = get_profile_raster(dataset, begin_date, end_date)
 
     reducer = ee.Reducer.mean()
 
-    raster = raster.reduce(reducer)
-
     data = reduceImageProfile(raster, polyline, reducer, scale).getInfo()
 
     # fill response
-    resp = Response(json.dumps(data), status=200, mimetype='application/json')
+    resp = response_functions.json_response(data)
 
     return resp
 
 
+@v1.route('/get_raster_profiles', methods=['POST'])
+@flask_cors.cross_origin()
+def api_get_raster_profiles():
+    """
+    Get profiles of one or more bathymetry datasets along many polylines, e.g. transects.
+    Request: polylines (list of LineStrings or a FeatureCollection), datasets (list),
+    scale (segment length and scale of the reduction, meters), begin_date and end_date.
+    :return: per profile the distance (meters) and a value per dataset for each segment
+    """
+    r = request.get_json()
+
+    lines = profile_functions.get_lines(r['polylines'])
+    scale = float(r['scale'])
+    datasets = r['datasets']
+    begin_date = r.get('begin_date', None)
+    end_date = r.get('end_date', None)
+
+    if not lines or not datasets:
+        raise error_handler.InvalidUsage('polylines and datasets are required.')
+
+    # datasets are stacked as bands, all are reduced in the same pass
+    image = ee.Image.cat([
+        get_profile_raster(dataset, begin_date, end_date).rename(dataset) for dataset in datasets
+    ])
+
+    profiles = profile_functions.get_profiles(image, datasets, lines, scale, scale)
+
+    return response_functions.json_response({'datasets': datasets, 'profiles': profiles})
+
+
 @v1.route('/get_water_mask_raw', methods=['POST'])
 def get_water_mask_raw():
     """
     Extracts water mask from raw satellite data.
+    Optional max_images and max_cloud_cover (CLOUDY_PIXEL_PERCENTAGE) limit the
+    Sentinel-2 scenes used in the composite.
 
     Code Editor URL:
     https://code.earthengine.google.com/4dd0b18aa43bfabf4845753dc7c6ba5c
@@ -501,53 +594,56 @@ def get_water_mask_raw():
     ndwi_threshold = j['ndwi_threshold'] if 'ndwi_threshold' in j else 0
     scale = j['scale'] if 'scale' in j else 10
 
-    # filter Sentinel-2 images
-    images = ee.ImageCollection('COPERNICUS/S2') \
-        .select(bands) \
-        .filterBounds(region) \
-        .filterDate(start, stop) \
-        .map(lambda i: i.resample('bilinear'))
-
-    # remove noise (clouds, shadows) using percentile composite
-    image = images \
-        .reduce(ee.Reducer.percentile([percentile])) \
- \
-        # computer water mask using NDWI
+    # remove noise (clouds, shadows) using a percentile composite of the least cloudy images,
+    # vectorized at half the scale
+    image = composite_functions.get_sentinel2_composite(
+        region, start, stop, bands, percentile, scale / 2,
+        max_images=j.get('max_images', None), max_cloud_cover=j.get('max_cloud_cover', None))
+
+    # computer water mask using NDWI
     water_mask = image \
         .normalizedDifference() \
         .gt(ndwi_threshold)
 
     # vectorize
-    water_mask_vector = water_mask \
-        .mask(water_mask) \
-        .reduceToVectors(**{
-        "geometry": region,
-        "scale": scale / 2
-    })
+    def vectorize(tile_scale=4, factor=1):
+        water_mask_vector = water_mask \
+            .mask(water_mask) \
+            .reduceToVectors(**{
+            "geometry": region,
+            "scale": scale * factor / 2,
+            "tileScale": tile_scale
+        })
 
-    water_mask_vector = water_mask_vector.toList(10000) \
-        .map(lambda o: ee.Feature(o).simplify(scale))
+        water_mask_vector = water_mask_vector.toList(10000) \
+            .map(lambda o: ee.Feature(o).simplify(scale * factor))
 
-    water_mask_vector = ee.FeatureCollection(water_mask_vector)
+        return ee.FeatureCollection(water_mask_vector)
 
     # create response
     if use_url:
-        url = water_mask_vector.getDownloadURL('json')
+        url = download_blueprints.get_download_url(
+            'water_mask', j, lambda: vectorize().getDownloadURL('json'),
+            filename='water_mask.json')
         data = {'url': url}
     else:
-        data = water_mask_vector.getInfo()
+        data, factor = adaptive_retry.evaluate(
+            'water_mask_raw', geometry_functions.area(j['region']),
+            lambda tile_scale, factor: vectorize(tile_scale, factor).getInfo())
+        # the scale used, coarser than requested if the mask did not fit in EE memory limits
+        data['scale'] = scale * factor
 
-    return Response(json.dumps(data), status=200, mimetype='application/json')
+    return response_functions.json_response(data)
 
 
-def get_water_mask_vector(region, scale, start, stop):
-    #  water occurrence(monthly)
-    water_occurrence = monthly_water \
-        .filterDate(start, stop) \
-        .map(lambda i: i.unmask(0).resample('bicubic')) \
-        .map(lambda i: i.eq(2).updateMask(i.neq(0)))
+def get_water_mask_vector(region, scale, start, stop, tile_scale=4):
+    # water occurrence, from precomputed layers where possible
+    years = ()
+    if config.GSW_YEARLY_COUNTS:
+        years = occurrence_functions.get_yearly_count_years(config.GSW_YEARLY_COUNTS)
 
-    water_occurrence = water_occurrence.sum().divide(water_occurrence.count())
+    water_occurrence = occurrence_functions.get_water_occurrence(
+        start, stop, config.GSW_YEARLY_COUNTS, years)
 
     # computer water mask
     water_mask = water_occurrence.gt(0.3)
@@ -560,7 +656,7 @@ def get_water_mask_vector(region, scale, start, stop):
     water_mask_vector = water_mask.mask(water_mask) \
         .reduceToVectors(**{"geometry": region,
                             "scale": scale / 2,
-                            "tileScale": 4})
+                            "tileScale": tile_scale})
 
     # take the largest
     water_mask_vector = water_mask_vector \
@@ -583,6 +679,87 @@ def transform_feature(crs, scale):
                                  ee.Number(scale).divide(100))
 
 
+# skeletonization of water masks, see get_water_network
+WATER_NETWORK_ENGINES = ('ee', 'local')
+
+# tileScale and scale of memory-limited computations, adapted per region size
+adaptive_retry = retry_functions.AdaptiveRetry()
+
+water_cache = cache_functions.DiskCache(config.CACHE_DIR / 'water', config.WATER_CACHE_MAX_SIZE)
+
+
+def get_water_mask_data(region, scale, start, stop):
+    """
+    Water mask vector (GeoJSON, EPSG:4326) of a region, cached. If the mask can only
+    be computed at a coarser scale it is cached (and identified) by that scale.
+    :param region: GeoJSON geometry
+    :return: tuple of the water mask id and the water mask, with the scale used
+    """
+    water_mask_id = water_functions.get_water_mask_id(region, scale, start, stop)
+
+    water_mask = water_functions.get(water_cache, water_mask_id)
+    if water_mask is None:
+        water_mask, factor = adaptive_retry.evaluate(
+            'water_mask', geometry_functions.area(region),
+            lambda tile_scale, factor: get_water_mask_vector(
+                ee.Geometry(region), scale * factor, start, stop, tile_scale).getInfo())
+
+        water_mask['scale'] = scale * factor
+        water_mask_id = water_functions.get_water_mask_id(region, water_mask['scale'], start, stop)
+        water_functions.put(water_cache, water_mask_id, water_mask)
+
+    return water_mask_id, water_mask
+
+
+def get_water_network_data(region, scale, start, stop, engine='ee'):
+    """
+    Centerline network (GeoJSON, EPSG:4326) of the water mask of a region, cached.
+    If the network can only be computed at a coarser scale it is cached (and
+    identified) by that scale.
+    :param region: GeoJSON geometry
+    :param engine: String, ee (skeleton computed by Earth Engine) or local (scipy)
+    :return: tuple of the network id and a dictionary with the water mask id,
+    the parameters (with the scale used) and the centerline
+    """
+    if engine not in WATER_NETWORK_ENGINES:
+        msg = 'Unknown engine %s, use one of: %s' % (engine, ', '.join(WATER_NETWORK_ENGINES))
+        raise error_handler.InvalidUsage(msg)
+
+    water_mask_id = water_functions.get_water_mask_id(region, scale, start, stop)
+    network_id = water_functions.get_network_id(water_mask_id, engine)
+
+    network = water_functions.get(water_cache, network_id)
+    if network is not None:
+        return network_id, network
+
+    if engine == 'local':
+        water_mask_id, water_mask = get_water_mask_data(region, scale, start, stop)
+        used_scale = water_mask.get('scale', scale)
+        centerline = skeleton_functions.skeletonize(water_mask, used_scale)
+    else:
+        # skeleton of the water mask computed server-side, the mask does not pass through the client
+        def compute_centerline(tile_scale, factor):
+            water_vector = get_water_mask_vector(ee.Geometry(region), scale * factor, start, stop, tile_scale)
+            return river_functions.generate_skeleton_from_voronoi(
+                scale * factor, water_vector, tile_scale)['centerline'].getInfo()
+
+        centerline, factor = adaptive_retry.evaluate(
+            'water_network', geometry_functions.area(region), compute_centerline)
+        used_scale = scale * factor
+        water_mask_id = water_functions.get_water_mask_id(region, used_scale, start, stop)
+
+    network_id = water_functions.get_network_id(water_mask_id, engine)
+    network = {
+        'water_mask': water_mask_id,
+        'engine': engine,
+        'params': {'region': region, 'scale': used_scale, 'start': start, 'stop': stop},
+        'centerline': centerline
+    }
+    water_functions.put(water_cache, network_id, network)
+
+    return network_id, network
+
+
 @v1.route('/get_water_mask', methods=['POST', 'GET'])
 def get_water_mask():
     """
@@ -592,92 +769,101 @@ def get_water_mask():
     j = request.json
 
     use_url = j['use_url']
-    region = ee.Geometry(j['region'])
     start = j['start']
     stop = j['stop']
     scale = j['scale']
     crs = j['crs']
 
-    water_mask_vector = get_water_mask_vector(region, scale, start, stop)
-
-    if crs and crs != 'EPSG:4326':
-        water_mask_vector = water_mask_vector.map(transform_feature(crs, scale))
-
     # create response
     if use_url:
-        url = water_mask_vector.getDownloadURL('json')
+        water_mask_vector = get_water_mask_vector(ee.Geometry(j['region']), scale, start, stop)
+
+        # reprojected by EE, the file is downloaded from EE as is
+        if crs and crs != 'EPSG:4326':
+            water_mask_vector = water_mask_vector.map(transform_feature(crs, scale))
+
+        url = download_blueprints.get_download_url(
+            'water_mask', j, lambda: water_mask_vector.getDownloadURL('json'),
+            filename='water_mask.json')
         data = {'url': url}
     else:
-        data = water_mask_vector.getInfo()
+        # scale is the scale used, coarser than requested if the mask did not fit in EE memory limits
+        water_mask_id, data = get_water_mask_data(j['region'], scale, start, stop)
+        data['features'] = geometry_functions.transform_features(data['features'], crs)
+        data['id'] = water_mask_id
+        data.setdefault('scale', scale)
 
-    return Response(json.dumps(data), status=200, mimetype='application/json')
+    return response_functions.json_response(data)
 
 
 @v1.route('/get_water_network', methods=['POST'])
 def get_water_network():
     """
     Skeletonize water mask given boundary, converts it into a network
-    (undirected graph) and generates a feature collection
+    (undirected graph) and generates a feature collection. engine selects where the
+    skeleton is computed: ee (default) or local (Voronoi diagram with scipy).
     Script: https://code.earthengine.google.com/da4dd67e84910ca42c4f82c41e7f9bcb
     """
 
     j = request.json
 
-    region = ee.Geometry(j['region'])
     start = j['start']
     stop = j['stop']
     scale = j['scale']
     crs = j['crs']
 
-    # get water mask
-    water_vector = get_water_mask_vector(region, scale, start, stop)
-
-    # skeletonize
-    output = river_functions.generate_skeleton_from_voronoi(scale, water_vector)
-    centerline = output["centerline"]
+    # water mask and skeleton, cached and referenced by id
+    network_id, network = get_water_network_data(j['region'], scale, start, stop, j.get('engine', 'ee'))
 
-    centerline = centerline.map(
-        lambda line: line.set('length', line.length(scale / 10)))
+    data = network['centerline']
+    data['id'] = network_id
+    # the scale used, coarser than requested if the network did not fit in EE memory limits
+    data['scale'] = network['params']['scale']
 
-    if crs and crs != 'EPSG:4326':
-        centerline = centerline.map(transform_feature(crs, scale))
+    # geodesic length and reprojection, computed locally
+    for feature in data['features']:
+        feature['properties']['length'] = geometry_functions.length(feature['geometry'])
 
-    # create response
-    data = centerline.getInfo()
+    data['features'] = geometry_functions.transform_features(data['features'], crs)
 
-    return Response(json.dumps(data), status=200, mimetype='application/json')
+    return response_functions.json_response(data)
 
 
 @v1.route('/get_water_network_properties', methods=['POST'])
 def get_water_network_properties():
     """
     Generates variables along water skeleton network polylines.
+    Either region, start, stop, scale and optionally engine, or the id of a network
+    returned by get_water_network (network).
+    Optional variables: list of names in river_functions.NETWORK_VARIABLES, all by default.
     """
 
     j = request.json
 
-    region = ee.Geometry(j['region'])
-    start = j['start']
-    stop = j['stop']
-    scale = j['scale']
-
     step = j['step']
 
     crs = j['crs']
 
-    error = ee.ErrorMargin(scale / 2, 'meters')
-
     if 'network' in j:
-        raise Exception(
-            'TODO: re-using existing networks is not supported yet')
+        # network returned by get_water_network
+        network = water_functions.require(water_cache, j['network'], 'network')
+        params = network['params']
+    else:
+        params = {'region': j['region'], 'scale': j['scale'], 'start': j['start'], 'stop': j['stop']}
+        engine = j.get('engine', 'ee')
+        network = None
+        if engine == 'local':
+            _, network = get_water_network_data(engine=engine, **params)
+
+    scale = params['scale']
+
+    error = ee.ErrorMargin(scale / 2, 'meters')
 
-    # get water mask
-    water_vector = get_water_mask_vector(region, scale, start, stop)
+    # the EE pipeline starts from the water mask computed server-side
+    water_vector = get_water_mask_vector(ee.Geometry(params['region']), scale, params['start'], params['stop'])
 
-    # skeletonize
-    output = river_functions.generate_skeleton_from_voronoi(scale, water_vector)
-    centerline = ee.FeatureCollection(output["centerline"])
-    distance = ee.Image(output["distance"])
+    # a cached network is sampled along its centerline, otherwise the skeleton is computed here
+    centerline, distance = water_functions.get_skeleton(network, scale, water_vector)
 
     # generate width at every offset
     centerline = centerline.map(
@@ -723,50 +909,15 @@ def get_water_network_properties():
 
     points = long_line_points.merge(short_line_points)
 
-    fa = ee.Image('WWF/HydroSHEDS/15ACC')
-    dem = ee.Image('JAXA/ALOS/AW3D30_V1_1').select('MED')
-
-    def add_flow_accumulation(pt):
-        flow_accumulation = fa.reduceRegion(
-            reducer=ee.Reducer.max(),
-            geometry=pt.geometry().buffer(scale * 10),
-            scale=scale).values().get(0)
-
-        return pt \
-            .set("flow_accumulation", ee.Number(flow_accumulation))
+    # all variables in a single pass per buffer radius
+    points = river_functions.sample_network_variables(points, distance, scale, j.get('variables', None))
 
-    def add_width(pt):
-        width = distance.reduceRegion(
-            reducer=ee.Reducer.max(),
-            geometry=pt.geometry(),
-            scale=scale).values().get(0)
-
-        return pt \
-            .set("width", ee.Number(width).multiply(scale).multiply(2))
-
-    def add_elevation(pt):
-        elevation = dem.reduceRegion(
-            reducer=ee.Reducer.median(),
-            geometry=pt.geometry().buffer(scale * 10),
-            scale=scale).values().get(0)
-
-        return pt \
-            .set("elevation", ee.Number(elevation))
-
-    points = points.map(add_width)
-    points = points.map(add_elevation)
-    points = points.map(add_flow_accumulation)
-
-    if crs and crs != 'EPSG:4326':
-        points = points.map(transform_feature(crs, scale))
-
-    # create response
-    data = points.getInfo()
-
-    return Response(json.dumps(data), status=200, mimetype='application/json')
+    # create response, reprojected locally
+    return feature_functions.feature_collection_response(points, crs or 'EPSG:4326')
 
 
 @v1.route('/get_catchments', methods=['GET', 'POST'])
+@response_functions.cache_by_request(config.CACHE_MAX_AGE_STATIC)
 def api_get_catchments():
     region = ee.Geometry(request.json['region'])
     region_filter = request.json['region_filter']
@@ -794,17 +945,14 @@ def api_get_catchments():
     # dissolve output
     # TODO: dissolve output
 
-    # get GeoJSON
-    # TODO: use ZIP to prevent 5000 feature limit
-    data = upstream_catchments.getInfo()
-
-    # fill response
-    resp = Response(json.dumps(data), status=200, mimetype='application/json')
+    # get GeoJSON (single request, limited to 5000 features) or Arrow (retrieved in batches, unlimited)
+    resp = feature_functions.feature_collection_response(upstream_catchments)
 
     return resp
 
 
 @v1.route('/get_rivers', methods=['GET', 'POST'])
+@response_functions.cache_by_request(config.CACHE_MAX_AGE_STATIC)
 def api_get_rivers():
     region = ee.Geometry(request.json['region'])
     region_filter = request.json['region_filter']
@@ -854,9 +1002,7 @@ def api_get_rivers():
 
     # data = {'url': url}
 
-    data = selected_rivers.getInfo()
-
-    return Response(json.dumps(data), status=200, mimetype='application/json')
+    return feature_functions.feature_collection_response(selected_rivers)
 
     # data = selected_rivers.getInfo()  # TODO: use ZIP to prevent 5000 features limit
     # return Response(json.dumps(data), status=200, mimetype='application/octet-stream')
@@ -873,6 +1019,7 @@ def api_get_rivers():
 
 
 @v1.route('/get_lakes', methods=['GET', 'POST'])
+@response_functions.cache_by_request(config.CACHE_MAX_AGE_STATIC)
 def api_get_lakes():
     region = ee.Geometry(request.json['region'])
     id_only = bool(request.json['id_only'])
@@ -885,18 +1032,16 @@ def api_get_lakes():
         ids = selected_lakes.aggregate_array('Hylak_id')
         print(ids.getInfo())
 
-        return Response(json.dumps(ids.getInfo()), status=200,
-                        mimetype='application/json')
+        return response_functions.json_response(ids.getInfo())
 
     #
 
     # create response
-    data = selected_lakes.getInfo()
-
-    return Response(json.dumps(data), status=200, mimetype='application/json')
+    return feature_functions.feature_collection_response(selected_lakes)
 
 
 @v1.route('/get_lake_by_id', methods=['GET', 'POST'])
+@response_functions.cache_by_request(config.CACHE_MAX_AGE_STATIC)
 def get_lake_by_id():
     lake_id = int(request.json['lake_id'])
 
@@ -907,48 +1052,18 @@ def get_lake_by_id():
             )
         ).first()
     )
-    return Response(json.dumps(lake.getInfo()), status=200,
-                    mimetype='application/json')
+    return response_functions.json_response(lake.getInfo())
 
 
 def get_lake_water_area(lake_id, scale):
-    f = ee.Feature(lakes.filter(ee.Filter.eq('Hylak_id', lake_id)).first())
-
-    def get_monthly_water_area(i):
-        # get water mask
-        water = i.clip(f).eq(2)
-
-        s = scale
-        if not scale:
-            # estimate scale from reservoir surface area, currently
-            coords = ee.List(f.geometry().bounds().transform('EPSG:3857',
-                                                             30).coordinates().get(
-                0))
-            ll = ee.List(coords.get(0))
-            ur = ee.List(coords.get(2))
-            width = ee.Number(ll.get(0)).subtract(ur.get(0)).abs()
-            height = ee.Number(ll.get(1)).subtract(ur.get(1)).abs()
-            size = width.max(height)
-
-            MAX_PIXEL_COUNT = 1000
-
-            s = size.divide(MAX_PIXEL_COUNT).max(30)
-
-            print('Automatically estimated scale is: ' + str(s.getInfo()))
-
-        # compute water area
-        water_area = water.multiply(ee.Image.pixelArea()).reduceRegion(
-            ee.Reducer.sum(), f.geometry(), s).values().get(0)
-
-        return ee.Feature(None, {'time': i.date().millis(),
-                                 'water_area': water_area})
-
-    area = monthly_water.map(get_monthly_water_area)
-
-    area_values = area.aggregate_array('water_area')
-    area_times = area.aggregate_array('time')
+    """
+    Monthly water area of a lake, at the scale classes of the lake store if scale
+    is None, so that stored and computed lakes give the same areas
+    """
+    rows = lake_functions.get_water_area_rows([lake_id], scale).getInfo()
+    ts = lake_functions.to_lake_columns(rows, [lake_id])[0]
 
-    return {'time': area_times.getInfo(), 'water_area': area_values.getInfo()}
+    return {'time': ts['time'], 'water_area': ts['water_area']}
 
 
 @v1.route('/get_lake_time_series', methods=['GET', 'POST'])
@@ -961,15 +1076,52 @@ def api_get_lake_time_series():
         scale = int(request.json['scale'])
 
     if variable == 'water_area':
-        ts = get_lake_water_area(lake_id, scale)
+        # the store holds areas at the scale class of each lake, as get_lake_water_area
+        ts = lake_store.get(lake_id) if scale is None else None
+        if ts is None:
+            ts = get_lake_water_area(lake_id, scale)
 
-        return Response(json.dumps(ts), status=200,
-                        mimetype='application/json')
+        # the store is extended monthly, the ETag is derived from the content
+        return response_functions.json_response(ts, max_age=LAKE_MAX_AGE)
 
     return Response('Unknown variable', status=404,
                     mimetype='application/json')
 
 
+@v1.route('/get_lake_time_series_batch', methods=['POST'])
+def api_get_lake_time_series_batch():
+    """
+    Get monthly water area time series of many lakes in a single request.
+    Request: lake_ids (list of Hylak_id), optional scale, start and stop.
+    :return: per lake the columns time (epoch ms) and water_area (m2)
+    """
+    r = request.get_json()
+    lake_ids = [int(i) for i in r['lake_ids']]
+
+    scale = None
+    if 'scale' in r:
+        scale = int(r['scale'])
+
+    start = r.get('start', None)
+    stop = r.get('stop', None)
+
+    # complete series from the store, the other lakes are computed
+    stored = {}
+    if scale is None and start is None and stop is None:
+        stored = {i: lake_store.get(i) for i in lake_ids}
+        stored = {i: ts for i, ts in stored.items() if ts is not None}
+
+    missing = [i for i in lake_ids if i not in stored]
+    rows = []
+    if missing:
+        rows = lake_functions.get_water_area_rows(missing, scale, start, stop).getInfo()
+
+    lakes = {lake['lake_id']: lake for lake in lake_functions.to_lake_columns(rows, missing)}
+    lakes.update({i: dict(ts, lake_id=i) for i, ts in stored.items()})
+
+    return response_functions.json_response({'lakes': [lakes[i] for i in lake_ids]}, max_age=LAKE_MAX_AGE)
+
+
 @v1.route('/get_feature_collection', methods=['GET', 'POST'])
 def api_get_feature_collection():
     region = ee.Geometry(request.json['region'])
@@ -989,14 +1141,79 @@ def api_get_feature_collection():
 
     data = features.getInfo()
 
-    str = json.dumps(data)
+    # assets may be changed by their owners, the ETag is derived from the content
+    return response_functions.json_response(data, max_age=config.CACHE_MAX_AGE_DEFAULT)
+
+
+def get_vector_tile_collection(layer, z):
+    """features of a vector tile layer, with a level of detail depending on zoom level z"""
+    if layer == 'rivers':
+        # only larger rivers at lower zoom levels, all branches from zoom level 10
+        min_upstream_cells = 10 ** max(0, 10 - z)
+        return rivers.filter(ee.Filter.gte('UP_CELLS', min_upstream_cells))
+
+    if layer == 'catchments':
+        level = min(max(z, 5), 9)
+        return basins[level]
+
+    return lakes
+
+
+def get_vector_tile(layer, z, x, y):
+    """clip, simplify and encode features of a layer for a tile"""
+    if z < vector_tile_layers[layer]['min_zoom']:
+        return tile_functions.encode_vector_tile(layer, [], z, x, y)
+
+    west, south, east, north = tile_functions.get_tile_bounds(z, x, y)
+
+    # clip with a small buffer (in pixels) to prevent artifacts at tile edges
+    resolution = tile_functions.get_tile_resolution(z)
+    buffer = (east - west) / tile_functions.TILE_SIZE * 4
+    bounds = ee.Geometry.Rectangle(
+        [west - buffer, max(south - buffer, -90), east + buffer, min(north + buffer, 90)],
+        'EPSG:4326', False)
+
+    error = ee.ErrorMargin(resolution, 'meters')
+
+    def clip_feature(feature):
+        return feature.intersection(bounds, error).simplify(resolution)
+
+    features = get_vector_tile_collection(layer, z) \
+        .filterBounds(bounds) \
+        .select(vector_tile_layers[layer]['properties']) \
+        .map(clip_feature)
+
+    features = [f for batch in feature_functions.iter_feature_batches(features) for f in batch]
+
+    return tile_functions.encode_vector_tile(layer, features, z, x, y)
+
+
+@v1.route('/tiles/vector/<layer>/<int:z>/<int:x>/<int:y>.mvt', methods=['GET'])
+@flask_cors.cross_origin()
+def api_get_vector_tile(layer, z, x, y):
+    """Mapbox Vector Tile of HydroSHEDS rivers, HydroBASINS catchments or HydroLAKES"""
+    if layer not in vector_tile_layers:
+        msg = 'Unknown layer %s, use one of: %s' % (layer, ', '.join(vector_tile_layers))
+        raise error_handler.InvalidUsage(msg, status_code=404)
+
+    tile_functions.validate_tile(z, x, y)
+
+    key = '{}/{}/{}/{}'.format(layer, z, x, y)
+    data = vector_tile_cache.get(key)
 
-    return Response(str, status=200, mimetype='application/json')
+    if data is None:
+        data = get_vector_tile(layer, z, x, y)
+        vector_tile_cache.put(key, data)
+
+    response = Response(data, status=200, mimetype=tile_functions.VECTOR_TILE_MIMETYPE)
+
+    return response_functions.set_cache_headers(response, max_age=config.CACHE_MAX_AGE_STATIC)
 
 
 @v1.route('/get_raster', methods=['GET', 'POST'])
 def api_get_raster():
-    variable = request.json['variable']
+    variable = request.json.get('variable')
+    variables = request.json.get('variables')
     region = ee.Geometry(request.json['region'])
     cell_size = float(request.json['cell_size'])
     crs = request.json['crs']
@@ -1018,52 +1235,67 @@ def api_get_raster():
 
         region = region.geometry().bounds()
 
-    raster_assets = {
-        'dem': 'USGS/SRTMGL1_003',
-        'hand': 'users/gena/global-hand/hand-100',
-        'FirstZoneCapacity': 'users/gena/HydroEngine/static/FirstZoneCapacity',
-        'FirstZoneKsatVer': 'users/gena/HydroEngine/static/FirstZoneKsatVer',
-        'FirstZoneMinCapacity': 'users/gena/HydroEngine/static/FirstZoneMinCapacity',
-        'InfiltCapSoil': 'users/gena/HydroEngine/static/InfiltCapSoil',
-        'M': 'users/gena/HydroEngine/static/M',
-        'PathFrac': 'users/gena/HydroEngine/static/PathFrac',
-        'WaterFrac': 'users/gena/HydroEngine/static/WaterFrac',
-        'thetaS': 'users/gena/HydroEngine/static/thetaS',
-        'soil_type': 'users/gena/HydroEngine/static/wflow_soil',
-        'landuse': 'users/gena/HydroEngine/static/wflow_landuse',
-        'LAI01': 'users/gena/HydroEngine/static/LAI/LAI00000-001',
-        'LAI02': 'users/gena/HydroEngine/static/LAI/LAI00000-002',
-        'LAI03': 'users/gena/HydroEngine/static/LAI/LAI00000-003',
-        'LAI04': 'users/gena/HydroEngine/static/LAI/LAI00000-004',
-        'LAI05': 'users/gena/HydroEngine/static/LAI/LAI00000-005',
-        'LAI06': 'users/gena/HydroEngine/static/LAI/LAI00000-006',
-        'LAI07': 'users/gena/HydroEngine/static/LAI/LAI00000-007',
-        'LAI08': 'users/gena/HydroEngine/static/LAI/LAI00000-008',
-        'LAI09': 'users/gena/HydroEngine/static/LAI/LAI00000-009',
-        'LAI10': 'users/gena/HydroEngine/static/LAI/LAI00000-010',
-        'LAI11': 'users/gena/HydroEngine/static/LAI/LAI00000-011',
-        'LAI12': 'users/gena/HydroEngine/static/LAI/LAI00000-012',
-        'thickness-NASA': 'users/huite/GlobalThicknessNASA/average_soil_and_sedimentary-deposit_thickness',
-        'thickness-SoilGrids': 'users/huite/SoilGrids/AbsoluteDepthToBedrock__cm',
-    }
-
-    if variable == 'hand':
-        image = ee.ImageCollection(raster_assets[variable]).mosaic()
+    # region given by the client, or evaluated once: bounds are computed locally and
+    # every window clips to a constant geometry
+    if region_filter in ('catchments-upstream', 'catchments-intersection'):
+        geometry = region.getInfo()
+        region = ee.Geometry(geometry)
     else:
-        image = ee.Image(raster_assets[variable])
+        geometry = request.json['region']
+
+    pixel_size = raster_functions.get_pixel_size(crs, cell_size)
+    bounds = raster_functions.get_bounds(region, crs, pixel_size, cell_size, geometry=geometry)
+    rows, columns = raster_functions.get_shape(bounds, pixel_size)
+    # cloud optimized GeoTIFF output (tiled, with overviews)
+    cog = request.json.get('format') == 'cog'
+
+    # bundle of variables (e.g. wflow static maps) on a common grid
+    if variables:
+        images = {v: image.clip(region) for v, image in raster_functions.get_bundle_images(variables).items()}
+        bundle_format = request.json.get('bundle_format', 'zip')
+        if bundle_format not in raster_functions.BUNDLE_FORMATS:
+            msg = 'bundle_format must be one of: ' + ', '.join(raster_functions.BUNDLE_FORMATS)
+            raise error_handler.InvalidUsage(msg)
 
-    image = image.clip(region)
+        def write_bundle(path, progress):
+            raster_functions.download_bundle(
+                path, images, crs, bounds, pixel_size, bundle_format=bundle_format, progress=progress, cog=cog)
 
-    # create response
-    url = image.getDownloadURL({
-        'name': 'variable',
-        'crs': crs,
-        'scale': cell_size,
-        'region': json.dumps(region.bounds(cell_size).getInfo())
-    })
+        key = download_functions.get_request_key('raster-bundle', request.json)
+        filename, mimetype = raster_functions.BUNDLE_FORMATS[bundle_format]
+        job = download_blueprints.download_jobs.submit(key, write_bundle, filename=filename, mimetype=mimetype)
+
+        return response_functions.json_response(download_blueprints.get_job_info(job), status=202)
+
+    image = raster_functions.get_raster_image(variable).clip(region)
+
+    # rasters beyond the size limit of a download url, and COGs, are fetched in windows concurrently
+    if cog or request.json.get('tiled') or rows * columns > raster_functions.MAX_DOWNLOAD_PIXELS:
+        def write(path, progress):
+            raster_functions.download_raster(path, image, crs, bounds, pixel_size, progress=progress, cog=cog)
+
+        key = download_functions.get_request_key('raster-tiled', request.json)
+        job = download_blueprints.download_jobs.submit(
+            key, write, filename=variable + '.tif', mimetype='image/tiff')
+
+        return response_functions.json_response(download_blueprints.get_job_info(job), status=202)
+
+    def get_download_url():
+        download_region = geometry_functions.bounds_to_polygon(geometry_functions.get_bounds(geometry))
+
+        return image.getDownloadURL({
+            'name': 'variable',
+            'crs': crs,
+            'scale': cell_size,
+            'region': json.dumps(download_region)
+        })
+
+    # create response, EE download urls expire, hand out a download through the proxy
+    url = download_blueprints.get_download_url(
+        'raster', request.json, get_download_url, filename=variable + '.zip')
 
     data = {'url': url}
-    return Response(json.dumps(data), status=200, mimetype='application/json')
+    return response_functions.json_response(data)
 
 
 
@@ -1083,35 +1315,15 @@ def get_feature_info():
     band = r.get('band', None)
     function = r.get('function', None)
     info_format = r.get('info_format', 'JSON')
-    if function == 'mosaic_elevation_datasets':
-        if not datasets:
-            msg = f'datsets list expected for function {function}'
-            raise error_handler.InvalidUsage(msg)
-        image = ee.Image(dgds_functions.mosaic_elevation_datasets(datasets).select('elevation'))
-    else:
-        image = ee.Image(image_id)
-        image_location_parameters = image_id.split('/')
-        source = ('/').join(image_location_parameters[:-1])
-
-        data_params = dgds_functions.get_dgds_source_vis_params(source, image_id)
 
-        if band:
-            band_name = data_params['bandNames'][band]
-            image = image.select(band_name)
-        if function:
-            assert (function in data_params.get('function', None)) or \
-                   (function == data_params['function'].get(band, None)), \
-                f'{function} not an option.'
-
-        image = dgds_functions.apply_image_operation(image, function, data_params, band)
+    image = dgds_functions.get_feature_info_image(image_id, band, function, datasets)
 
     image = image.rename('value')
-    # TODO: get scale of image, or load default scale from parameters
     value = (
         image.sample(**{
             'region': ee.Geometry(bbox),
             'geometries': True,
-            'scale': 10
+            'scale': dgds_functions.get_feature_info_scale(image_id, function)
         })
         .first()
         .getInfo()
@@ -1134,11 +1346,70 @@ def get_feature_info():
     if info_format == 'JSON':
         value = value['properties']
 
-    return Response(
-        json.dumps(value),
-        status=200,
-        mimetype='application/json'
-    )
+    return response_functions.json_response(value)
+
+
+@v1.route('/get_feature_info_batch', methods=['POST'])
+@flask_cors.cross_origin()
+def get_feature_info_batch():
+    """
+    Get values of one or more images at many points, sampled in a single request
+    at the scale of the request, or the feature info scale of the dataset.
+    Request: points as a list of [lon, lat] and either imageIds, or source and dates
+    (system:time_start) of images in a collection. band, function and datasets as
+    for get_feature_info.
+    :return: columnar result, values per image, a value (or null) per point
+    """
+    r = request.get_json()
+    points = r['points']
+    band = r.get('band', None)
+    function = r.get('function', None)
+    datasets = r.get('datasets', None)
+
+    if r.get('dates'):
+        source = r['source']
+        image_ids = r['dates']
+        images = [
+            dgds_functions.get_feature_info_image(
+                dgds_functions.get_image_at(source, date), band, function, datasets, source=source)
+            for date in image_ids
+        ]
+        default_scale = dgds_functions.get_feature_info_scale(function=function, source=source)
+    else:
+        image_ids = r.get('imageIds') or [r['imageId']]
+        images = [dgds_functions.get_feature_info_image(i, band, function, datasets) for i in image_ids]
+        default_scale = dgds_functions.get_feature_info_scale(image_ids[0], function) if image_ids else None
+
+    if not points or not images:
+        raise error_handler.InvalidUsage('points and images are required.')
+
+    names = ['v%d' % i for i in range(len(images))]
+    image = ee.Image.cat([i.rename(name) for i, name in zip(images, names)])
+
+    scale = r.get('scale') or default_scale
+
+    collection = ee.FeatureCollection([
+        ee.Feature(ee.Geometry.Point(point), {'index': i}) for i, point in enumerate(points)
+    ])
+
+    samples = image.reduceRegions(collection=collection, reducer=ee.Reducer.first(), scale=scale)
+
+    # only properties, no geometries
+    samples = samples.select(['index'] + names, None, False).getInfo()
+
+    values = [[None] * len(points) for _ in images]
+    for feature in samples['features']:
+        properties = feature['properties']
+        for i, name in enumerate(names):
+            values[i][properties['index']] = properties.get(name)
+
+    data = {
+        'points': points,
+        'imageIds': image_ids,
+        'values': values
+    }
+
+    return response_functions.json_response(data)
 
 
 @v1.route('/get_image_collection_info', methods=['POST'])
@@ -1154,10 +1425,9 @@ def get_image_collection_info():
     if not info:
         raise error_handler.InvalidUsage('No images returned.')
 
-    return Response(
-        json.dumps(info),
-        status=200,
-        mimetype='application/json'
+    return response_functions.json_response(
+        info,
+        max_age=response_functions.get_source_max_age(source)
     )
 
 
@@ -1176,10 +1446,9 @@ def get_wms_url():
 
     info = dgds_functions.get_wms_url(image_id, 'Image', band, datasets, function, min, max, palette)
 
-    return Response(
-        json.dumps(info),
-        status=200,
-        mimetype='application/json'
+    return response_functions.json_response(
+        info,
+        max_age=response_functions.get_layer_max_age()
     )
 
 
@@ -1254,11 +1523,17 @@ app.register_blueprint(dgds_blueprints.v2, url_prefix="/v2")
 app.register_blueprint(digitwin_blueprints.v1, url_prefix="/v1")
 app.register_blueprint(digitwin_blueprints.v2, url_prefix="/v2")
 
+app.register_blueprint(tile_blueprints.v1, url_prefix="/v1")
+
+app.register_blueprint(download_blueprints.v1, url_prefix="/v1")
+
 # use version 1
 app.register_blueprint(v1, url_prefix="/")
 app.register_blueprint(liwo_blueprints.v1, url_prefix="/")
 app.register_blueprint(dgds_blueprints.v1, url_prefix="/")
 app.register_blueprint(digitwin_blueprints.v1, url_prefix="/")
+app.register_blueprint(tile_blueprints.v1, url_prefix="/")
+app.register_blueprint(download_blueprints.v1, url_prefix="/")
 
 
 if __name__ == '__main__':
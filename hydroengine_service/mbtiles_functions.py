@@ -0,0 +1,179 @@
+"""Tile archives in the MBTiles format (sqlite), written offline and served memory-mapped."""
+import concurrent.futures
+import logging
+import os
+import sqlite3
+import threading
+
+from hydroengine_service import tile_functions
+
+logger = logging.getLogger(__name__)
+
+# bytes of the archive mapped into memory by sqlite
+MMAP_SIZE = 2 ** 30
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tiles (
+    zoom_level INTEGER,
+    tile_column INTEGER,
+    tile_row INTEGER,
+    tile_data BLOB,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+'''
+
+
+def _tms_row(z, y):
+    # MBTiles uses TMS rows, counted from the south
+    return 2 ** z - 1 - y
+
+
+class MBTiles(object):
+    """
+    Read only access to an MBTiles archive, each thread uses its own memory-mapped
+    sqlite connection. The connections are kept to close them all at once.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.metadata = dict(self.connection.execute('SELECT name, value FROM metadata'))
+
+        self.min_zoom = int(self.metadata.get('minzoom', 0))
+        self.max_zoom = int(self.metadata.get('maxzoom', tile_functions.MAX_ZOOM))
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            uri = 'file:{}?mode=ro'.format(self.path)
+            connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            connection.execute('PRAGMA mmap_size = %d' % MMAP_SIZE)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def close(self):
+        """close the connections of all threads, using the archive afterwards raises sqlite3.ProgrammingError"""
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+    def get_tile(self, z, x, y):
+        """tile data, None if the tile is not in the archive"""
+        if not self.min_zoom <= z <= self.max_zoom:
+            return None
+
+        row = self.connection.execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+            (z, x, _tms_row(z, y))
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        return bytes(row[0])
+
+
+class TileArchives(object):
+    """
+    MBTiles archives in a directory, named <layer>.mbtiles, opened on first use.
+    Archives exported while the service runs are picked up, an archive is opened
+    again when its modification time changes.
+    """
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        # archive and modification time per layer, missing archives are not remembered
+        self._archives = {}
+        self._lock = threading.Lock()
+
+    def get(self, layer):
+        """archive of a layer, None if there is no archive"""
+        path = os.path.join(self.directory, layer + '.mbtiles')
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        with self._lock:
+            archive, archive_mtime = self._archives.get(layer, (None, None))
+            if archive is None or archive_mtime != mtime:
+                # the replaced archive is closed, its file descriptors and mappings are released
+                if archive is not None:
+                    archive.close()
+                archive = MBTiles(path)
+                self._archives[layer] = (archive, mtime)
+
+            return archive
+
+    def get_tile(self, layer, z, x, y):
+        """tile data from the archive of a layer, None if not available"""
+        for retry in (False, True):
+            archive = self.get(layer)
+            if archive is None:
+                return None
+
+            try:
+                return archive.get_tile(z, x, y)
+            except sqlite3.ProgrammingError:
+                # closed while in use, replaced by a newer export
+                if retry:
+                    raise
+
+
+def export_tiles(path, fetch, name, bounds, min_zoom, max_zoom, workers=8, fmt='png'):
+    """
+    Render a tile pyramid into an MBTiles archive
+    :param path: path of the archive, an existing archive is updated
+    :param fetch: function (z, x, y) returning tile data
+    :param name: String, name of the layer
+    :param bounds: (west, south, east, north) in EPSG:4326
+    :param min_zoom: Integer, lowest zoom level
+    :param max_zoom: Integer, highest zoom level
+    :param workers: Number of tiles fetched concurrently
+    :return: Number of tiles written
+    """
+    metadata = {
+        'name': name,
+        'format': fmt,
+        'type': 'overlay',
+        'minzoom': str(min_zoom),
+        'maxzoom': str(max_zoom),
+        'bounds': ','.join(str(v) for v in bounds),
+    }
+
+    connection = sqlite3.connect(str(path))
+    connection.executescript(SCHEMA)
+    connection.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?)', metadata.items())
+
+    def fetch_tile(tile):
+        return tile, fetch(*tile)
+
+    n_tiles = 0
+    tiles = tile_functions.iter_tiles(bounds, min_zoom, max_zoom)
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        # sqlite is written from this thread only
+        for (z, x, y), data in executor.map(fetch_tile, tiles):
+            if data is None:
+                continue
+
+            connection.execute(
+                'INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)',
+                (z, x, _tms_row(z, y), sqlite3.Binary(data))
+            )
+            n_tiles += 1
+
+            if n_tiles % 1000 == 0:
+                connection.commit()
+                logger.info('Written %d tiles to %s', n_tiles, path)
+
+    connection.commit()
+    connection.close()
+
+    return n_tiles
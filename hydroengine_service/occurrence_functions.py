@@ -0,0 +1,154 @@
+"""
+Water occurrence (fraction of valid months with water) from the JRC Global Surface
+Water products. Periods are planned into parts answered by precomputed layers where
+possible: whole years from materialized yearly counts, only the remaining months
+from the monthly history. The GSW metadata (detections and valid_obs) is not used,
+it counts scenes instead of months and gives a different occurrence.
+"""
+import datetime
+import functools
+import time
+
+import ee
+
+GSW_MONTHLY = 'JRC/GSW1_2/MonthlyHistory'
+
+# months of the monthly history, end exclusive
+RECORD_START = datetime.date(1984, 3, 1)
+RECORD_END = datetime.date(2020, 1, 1)
+
+# number of seconds the years of the yearly counts are cached, years exported
+# later are used from then on
+YEARS_MAX_AGE = 60 * 60
+
+
+def parse_date(date):
+    """date of a date string (YYYY-MM-DD...)"""
+    return datetime.datetime.strptime(str(date)[:10], '%Y-%m-%d').date()
+
+
+def _next_month(date):
+    if date.month == 12:
+        return datetime.date(date.year + 1, 1, 1)
+    return datetime.date(date.year, date.month + 1, 1)
+
+
+def _first_month(date):
+    """first monthly image starting at or after date"""
+    if date.day == 1:
+        return date
+    return _next_month(date)
+
+
+def plan_occurrence(start, stop, years=()):
+    """
+    Parts of a period, monthly images start on the first of the month and are
+    included if they start within [start, stop)
+    :param start: start date string
+    :param stop: end date string, exclusive
+    :param years: years for which materialized yearly counts are available
+    :return: list of ('year', year) and ('months', start, stop) parts
+    """
+    first = max(_first_month(parse_date(start)), RECORD_START)
+    end = min(_first_month(parse_date(stop)), RECORD_END)
+
+    if first >= end:
+        return []
+
+    parts = []
+    month = first
+    while month < end:
+        next_year = datetime.date(month.year + 1, 1, 1)
+        if month.month == 1 and next_year <= end and month.year in years:
+            parts.append(('year', month.year))
+            month = next_year
+            continue
+
+        # merge consecutive months
+        if parts and parts[-1][0] == 'months' and parts[-1][2] == month:
+            parts[-1] = ('months', parts[-1][1], _next_month(month))
+        else:
+            parts.append(('months', month, _next_month(month)))
+        month = _next_month(month)
+
+    return parts
+
+
+def get_monthly_counts(start, stop):
+    """
+    Number of months with water and with valid observations
+    :return: ee.Image with bands water and valid
+    """
+    def count(i):
+        i = i.unmask(0).resample('bicubic')
+        return i.eq(2).addBands(i.neq(0)).rename(['water', 'valid'])
+
+    return ee.ImageCollection(GSW_MONTHLY) \
+        .filterDate(str(start), str(stop)) \
+        .map(count) \
+        .sum()
+
+
+def get_part_counts(part, yearly_counts=None):
+    """counts (bands water and valid) of a part of a plan"""
+    if part[0] == 'year':
+        return ee.ImageCollection(yearly_counts).filter(ee.Filter.eq('year', part[1])).first() \
+            .select(['water', 'valid']).resample('bicubic')
+
+    return get_monthly_counts(part[1], part[2])
+
+
+def get_water_occurrence(start, stop, yearly_counts=None, years=()):
+    """
+    Water occurrence over a period
+    :param yearly_counts: String, ImageCollection of materialized yearly counts (bands
+    water and valid, property year), see get_monthly_counts
+    :param years: years available in yearly_counts
+    :return: ee.Image, masked where there are no valid observations
+    """
+    parts = plan_occurrence(start, stop, years if yearly_counts else ())
+    if not parts:
+        return ee.Image(0).selfMask()
+
+    counts = [get_part_counts(part, yearly_counts) for part in parts]
+    total = ee.ImageCollection(counts).sum() if len(counts) > 1 else counts[0]
+
+    valid = total.select('valid')
+    return total.select('water').toFloat().divide(valid).updateMask(valid.gt(0))
+
+
+@functools.lru_cache(maxsize=8)
+def _get_yearly_count_years(yearly_counts, period):
+    return tuple(ee.ImageCollection(yearly_counts).aggregate_array('year').getInfo())
+
+
+def get_yearly_count_years(yearly_counts):
+    """years available in a collection of materialized yearly counts, cached for YEARS_MAX_AGE"""
+    return _get_yearly_count_years(yearly_counts, int(time.time() // YEARS_MAX_AGE))
+
+
+def export_yearly_counts(yearly_counts, year):
+    """
+    Start a task materializing the counts of a year into the yearly counts collection
+    :param yearly_counts: String, ImageCollection asset id
+    :return: ee.batch.Task
+    """
+    image = get_monthly_counts(datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)) \
+        .toUint8() \
+        .set('year', year)
+
+    # native grid of the monthly history
+    projection = ee.Image(ee.ImageCollection(GSW_MONTHLY).first()).projection().getInfo()
+
+    task = ee.batch.Export.image.toAsset(
+        image=image,
+        description='gsw-yearly-counts-%d' % year,
+        assetId='%s/%d' % (yearly_counts, year),
+        region=ee.Geometry.Rectangle([-180, -80, 180, 80], None, False),
+        crs=projection['crs'],
+        crsTransform=projection['transform'],
+        maxPixels=1e13
+    )
+    task.start()
+
+    return task
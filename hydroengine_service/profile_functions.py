@@ -0,0 +1,153 @@
+"""Raster profiles along many polylines, segmented locally and reduced in bulk with reduceRegions."""
+import concurrent.futures
+import logging
+
+import ee
+import numpy as np
+
+from hydroengine_service import error_handler
+from hydroengine_service import geometry_functions
+
+logger = logging.getLogger(__name__)
+
+# maximum number of segments reduced in a single request
+MAX_SEGMENTS = 5000
+# number of requests evaluated concurrently
+WORKERS = 4
+
+
+def get_lines(polylines):
+    """
+    Coordinates of the polylines of a request
+    :param polylines: list of GeoJSON LineStrings (or Features), or a GeoJSON FeatureCollection
+    :return: list of arrays of (lon, lat)
+    """
+    if isinstance(polylines, dict):
+        geometries = list(geometry_functions.iter_geometries(polylines))
+    else:
+        geometries = [geometry_functions.get_geometry(p) for p in polylines]
+
+    lines = []
+    for geometry in geometries:
+        if geometry['type'] != 'LineString':
+            raise error_handler.InvalidUsage('Profiles are computed along LineStrings, got %s' % geometry['type'])
+        lines.append(np.asarray(geometry['coordinates'], dtype=float)[:, :2])
+
+    return lines
+
+
+def segment_line(line, step):
+    """
+    Cut a line into segments of (geodesic) length step, the vertices of the line
+    within a segment are kept
+    :param line: array of (lon, lat)
+    :param step: Number, segment length in meters
+    :return: tuple of the distances of the segment starts and a list of segment coordinates
+    """
+    distances = geometry_functions.line_distances(line)
+    if len(distances) < 2 or distances[-1] == 0:
+        return np.empty(0), []
+
+    starts = np.arange(0, distances[-1], step)
+    ends = np.append(starts[1:], distances[-1])
+
+    # positions of segment starts and ends, interpolated along the line
+    lon = np.interp(np.concatenate([starts, ends]), distances, line[:, 0])
+    lat = np.interp(np.concatenate([starts, ends]), distances, line[:, 1])
+    start_points = np.column_stack([lon[:len(starts)], lat[:len(starts)]]).tolist()
+    end_points = np.column_stack([lon[len(starts):], lat[len(starts):]]).tolist()
+
+    # vertices strictly within each segment
+    first = np.searchsorted(distances, starts, side='right')
+    last = np.searchsorted(distances, ends, side='left')
+    vertices = line.tolist()
+
+    segments = [
+        [start] + vertices[i:j] + [end]
+        for start, end, i, j in zip(start_points, end_points, first, last)
+    ]
+
+    return starts, segments
+
+
+def get_segments(lines, step):
+    """
+    Segments of all lines as GeoJSON features with properties profile (index of the
+    line), distance (meters along the line) and index (of the segment)
+    """
+    features = []
+    for profile, line in enumerate(lines):
+        distances, segments = segment_line(line, step)
+        for distance, segment in zip(distances.tolist(), segments):
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'LineString', 'coordinates': segment},
+                'properties': {'profile': profile, 'distance': distance, 'index': len(features)}
+            })
+
+    return features
+
+
+def get_profile_columns(features, samples, bands, n_profiles):
+    """
+    Reshape reduced segments to columns per profile
+    :param features: list of segment features, see get_segments
+    :param samples: list of properties (index and band values) of the reduced segments
+    :param bands: list of band names
+    :return: list of dictionaries with distance and a list of values per band, per profile
+    """
+    profile = np.array([f['properties']['profile'] for f in features], dtype=int)
+    distance = np.array([f['properties']['distance'] for f in features], dtype=float)
+
+    values = {band: [None] * len(features) for band in bands}
+    for properties in samples:
+        for band in bands:
+            values[band][properties['index']] = properties.get(band)
+
+    # segments are ordered by profile and distance, split at the profile boundaries
+    boundaries = np.searchsorted(profile, np.arange(n_profiles + 1))
+
+    profiles = []
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        columns = {'distance': distance[start:end]}
+        for band in bands:
+            columns[band] = values[band][start:end]
+        profiles.append(columns)
+
+    return profiles
+
+
+def get_profiles(image, bands, lines, step, scale, reducer=None):
+    """
+    Reduce an image along the segments of many lines
+    :param image: ee.Image, every band is reduced
+    :param bands: list of the band names of the image
+    :param lines: list of arrays of (lon, lat)
+    :param step: Number, segment length in meters
+    :param scale: Number, scale in meters of the reduction
+    :param reducer: ee.Reducer with a single output, mean by default
+    :return: list of dictionaries with distance and a list of values per band, per profile
+    """
+    reducer = reducer or ee.Reducer.mean()
+
+    # reduceRegions names the outputs by band for multiple bands, a single band gets the reducer output name
+    if len(bands) == 1:
+        reducer = reducer.setOutputs(bands)
+
+    features = get_segments(lines, step)
+
+    def reduce(start):
+        collection = ee.FeatureCollection([ee.Feature(f) for f in features[start:start + MAX_SEGMENTS]])
+        reduced = image.reduceRegions(collection, reducer, scale)
+
+        # only properties, no geometries
+        reduced = reduced.select(['index'] + bands, None, False).getInfo()
+        return [f['properties'] for f in reduced['features']]
+
+    chunks = range(0, len(features), MAX_SEGMENTS)
+    logger.debug('Reducing %d segments of %d profiles in %d requests', len(features), len(lines), len(chunks))
+
+    with concurrent.futures.ThreadPoolExecutor(WORKERS) as executor:
+        samples = [s for part in executor.map(reduce, chunks) for s in part]
+
+    return get_profile_columns(features, samples, bands, len(lines))
@@ -0,0 +1,411 @@
+"""Raster downloads larger than the EE request size limit, fetched as a grid of windows."""
+import concurrent.futures
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+
+import ee
+import numpy as np
+
+from hydroengine_service import error_handler
+from hydroengine_service import geometry_functions
+
+try:
+    import rasterio
+    import rasterio.enums
+    import rasterio.shutil
+    import rasterio.transform
+    import rasterio.windows
+except ImportError:
+    rasterio = None
+
+logger = logging.getLogger(__name__)
+
+# maximum size (in pixels) of the windows requested from EE
+WINDOW_SIZE = 2048
+# maximum size (in bytes) of the pixels of a window, keeps requests below the EE
+# payload limit and the windows in flight within the memory of the instance
+MAX_WINDOW_BYTES = 32 * 1024 ** 2
+# rasters with more pixels than this are not downloaded with a single download url
+MAX_DOWNLOAD_PIXELS = 4096 * 4096
+# number of windows fetched concurrently
+WORKERS = 8
+
+NODATA = -9999
+
+# block size of (cloud optimized) GeoTIFFs
+BLOCK_SIZE = 512
+
+# variables available for download (e.g. wflow static maps)
+RASTER_ASSETS = {
+    'dem': 'USGS/SRTMGL1_003',
+    'hand': 'users/gena/global-hand/hand-100',
+    'FirstZoneCapacity': 'users/gena/HydroEngine/static/FirstZoneCapacity',
+    'FirstZoneKsatVer': 'users/gena/HydroEngine/static/FirstZoneKsatVer',
+    'FirstZoneMinCapacity': 'users/gena/HydroEngine/static/FirstZoneMinCapacity',
+    'InfiltCapSoil': 'users/gena/HydroEngine/static/InfiltCapSoil',
+    'M': 'users/gena/HydroEngine/static/M',
+    'PathFrac': 'users/gena/HydroEngine/static/PathFrac',
+    'WaterFrac': 'users/gena/HydroEngine/static/WaterFrac',
+    'thetaS': 'users/gena/HydroEngine/static/thetaS',
+    'soil_type': 'users/gena/HydroEngine/static/wflow_soil',
+    'landuse': 'users/gena/HydroEngine/static/wflow_landuse',
+    'LAI01': 'users/gena/HydroEngine/static/LAI/LAI00000-001',
+    'LAI02': 'users/gena/HydroEngine/static/LAI/LAI00000-002',
+    'LAI03': 'users/gena/HydroEngine/static/LAI/LAI00000-003',
+    'LAI04': 'users/gena/HydroEngine/static/LAI/LAI00000-004',
+    'LAI05': 'users/gena/HydroEngine/static/LAI/LAI00000-005',
+    'LAI06': 'users/gena/HydroEngine/static/LAI/LAI00000-006',
+    'LAI07': 'users/gena/HydroEngine/static/LAI/LAI00000-007',
+    'LAI08': 'users/gena/HydroEngine/static/LAI/LAI00000-008',
+    'LAI09': 'users/gena/HydroEngine/static/LAI/LAI00000-009',
+    'LAI10': 'users/gena/HydroEngine/static/LAI/LAI00000-010',
+    'LAI11': 'users/gena/HydroEngine/static/LAI/LAI00000-011',
+    'LAI12': 'users/gena/HydroEngine/static/LAI/LAI00000-012',
+    'thickness-NASA': 'users/huite/GlobalThicknessNASA/average_soil_and_sedimentary-deposit_thickness',
+    'thickness-SoilGrids': 'users/huite/SoilGrids/AbsoluteDepthToBedrock__cm',
+}
+
+# output formats of a bundle of variables: filename and mimetype
+BUNDLE_FORMATS = {
+    'zip': ('bundle.zip', 'application/zip'),
+    'multiband': ('bundle.tif', 'image/tiff'),
+}
+# number of variables of a bundle downloaded concurrently
+BUNDLE_WORKERS = 4
+
+# length of a degree at the equator in meters
+DEGREE_LENGTH = 111319.49079327357
+
+
+def get_raster_image(variable):
+    """
+    Image of a variable in RASTER_ASSETS
+    :param variable: String, e.g. dem
+    :return: ee.Image
+    """
+    if variable not in RASTER_ASSETS:
+        msg = 'Unknown variable %s, use one of: %s' % (variable, ', '.join(RASTER_ASSETS))
+        raise error_handler.InvalidUsage(msg)
+
+    if variable == 'hand':
+        return ee.ImageCollection(RASTER_ASSETS[variable]).mosaic()
+
+    return ee.Image(RASTER_ASSETS[variable])
+
+
+def get_bundle_images(variables):
+    """
+    Images of a bundle of variables, the first band of each variable named by the variable
+    :param variables: list of variable names in RASTER_ASSETS, repeated names are ignored
+    :return: Dictionary of variable name and ee.Image, in order of variables
+    """
+    if not isinstance(variables, list) or not variables or not all(isinstance(v, str) for v in variables):
+        raise error_handler.InvalidUsage('variables must be a list of variable names.')
+
+    # a single band per variable, the multiband bundle has a band per variable
+    return {v: get_raster_image(v).select([0], [v]) for v in dict.fromkeys(variables)}
+
+
+def get_pixel_size(crs, cell_size):
+    """
+    Pixel size in units of crs, EE interprets the scale of geographic coordinate
+    systems in meters
+    :param cell_size: Number, in meters
+    """
+    if crs == 'EPSG:4326':
+        return cell_size / DEGREE_LENGTH
+    return cell_size
+
+
+def snap_bounds(bounds, cell_size):
+    """extend bounds (xmin, ymin, xmax, ymax) to multiples of the cell size"""
+    xmin, ymin, xmax, ymax = bounds
+    xmin, ymin = np.floor(np.array([xmin, ymin]) / cell_size) * cell_size
+    xmax, ymax = np.ceil(np.array([xmax, ymax]) / cell_size) * cell_size
+
+    return float(xmin), float(ymin), float(xmax), float(ymax)
+
+
+def get_bounds(region, crs, cell_size, max_error, geometry=None):
+    """
+    Bounds of a region in a coordinate system, snapped to the cell size
+    :param region: ee.Geometry
+    :param crs: String, e.g. EPSG:3857
+    :param cell_size: Number, in units of crs
+    :param max_error: Number, error margin in meters
+    :param geometry: GeoJSON of the region if available, used to compute bounds locally
+    :return: tuple of (xmin, ymin, xmax, ymax)
+    """
+    if geometry is not None:
+        return snap_bounds(geometry_functions.get_projected_bounds(geometry, crs), cell_size)
+
+    projection = ee.Projection(crs)
+    bounds = region.transform(projection, max_error).bounds(max_error, projection)
+    coordinates = np.array(bounds.coordinates().getInfo()[0])
+
+    return snap_bounds(np.concatenate([coordinates.min(axis=0), coordinates.max(axis=0)]), cell_size)
+
+
+def get_shape(bounds, cell_size):
+    """number of (rows, columns) covering bounds"""
+    xmin, ymin, xmax, ymax = bounds
+    return int(round((ymax - ymin) / cell_size)), int(round((xmax - xmin) / cell_size))
+
+
+def get_window_size(n_bands, dtype):
+    """
+    Size (in pixels) of square windows of which the pixels fit in MAX_WINDOW_BYTES,
+    a multiple of the GeoTIFF block size when possible
+    :param n_bands: Number of bands
+    :param dtype: String, numpy dtype of the pixels
+    """
+    bytes_per_pixel = n_bands * np.dtype(dtype).itemsize
+    window_size = min(WINDOW_SIZE, int(np.sqrt(MAX_WINDOW_BYTES / bytes_per_pixel)))
+
+    if window_size >= BLOCK_SIZE:
+        window_size -= window_size % BLOCK_SIZE
+
+    return max(1, window_size)
+
+
+def get_windows(shape, window_size=None):
+    """
+    Split a raster into windows
+    :param shape: tuple of (rows, columns)
+    :return: list of (row_off, col_off, rows, columns)
+    """
+    window_size = window_size or WINDOW_SIZE
+    rows, columns = shape
+
+    return [
+        (row_off, col_off, min(window_size, rows - row_off), min(window_size, columns - col_off))
+        for row_off in range(0, rows, window_size)
+        for col_off in range(0, columns, window_size)
+    ]
+
+
+def compute_window(image, crs, bounds, cell_size, window):
+    """
+    Pixels of an image in a window of the raster covering bounds
+    :return: numpy array of (bands, rows, columns)
+    """
+    xmin, _, _, ymax = bounds
+    row_off, col_off, rows, columns = window
+
+    pixels = ee.data.computePixels({
+        'expression': image,
+        'fileFormat': 'NUMPY_NDARRAY',
+        'grid': {
+            'dimensions': {'width': columns, 'height': rows},
+            'affineTransform': {
+                'scaleX': cell_size,
+                'shearX': 0,
+                'translateX': xmin + col_off * cell_size,
+                'shearY': 0,
+                'scaleY': -cell_size,
+                'translateY': ymax - row_off * cell_size
+            },
+            'crsCode': crs
+        }
+    })
+
+    # structured array with a field per band
+    return np.stack([pixels[name] for name in pixels.dtype.names])
+
+
+def iter_windows(fetch, windows, workers=None):
+    """
+    Fetch windows concurrently, at most 2 x workers windows are in flight (or
+    fetched and not yet consumed) at once
+    :param fetch: function (window) returning a numpy array
+    :return: generator of (window, array), in order of completion
+    """
+    workers = workers or WORKERS
+    windows = iter(windows)
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures = {}
+
+        def submit(n):
+            for window in windows:
+                futures[executor.submit(fetch, window)] = window
+                if len(futures) >= n:
+                    break
+
+        submit(2 * workers)
+        while futures:
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                # the array is released once it is consumed
+                window = futures.pop(future)
+                yield window, future.result()
+            submit(2 * workers)
+
+
+def write_geotiff(path, fetch, crs, bounds, cell_size, band_names, dtype, progress=None, workers=None):
+    """
+    Fetch a raster in windows concurrently and write it to a (tiled, compressed) GeoTIFF,
+    windows are written as they arrive, the raster is never in memory as a whole
+    :param path: String, path of the GeoTIFF
+    :param fetch: function (window) returning a numpy array of (bands, rows, columns)
+    :param progress: function (done, total) called after each window
+    """
+    if rasterio is None:
+        raise error_handler.InvalidUsage('Large raster downloads are not available, rasterio is not installed.')
+
+    shape = get_shape(bounds, cell_size)
+    windows = get_windows(shape, get_window_size(len(band_names), dtype))
+
+    profile = {
+        'driver': 'GTiff',
+        'height': shape[0],
+        'width': shape[1],
+        'count': len(band_names),
+        'dtype': dtype,
+        'crs': crs,
+        'transform': rasterio.transform.from_origin(bounds[0], bounds[3], cell_size, cell_size),
+        'nodata': NODATA,
+        'tiled': True,
+        'blockxsize': BLOCK_SIZE,
+        'blockysize': BLOCK_SIZE,
+        'compress': 'deflate',
+        'BIGTIFF': 'IF_SAFER'
+    }
+
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.descriptions = tuple(band_names)
+        for i, (window, data) in enumerate(iter_windows(fetch, windows, workers)):
+            row_off, col_off, rows, columns = window
+            dst.write(data.astype(dtype), window=rasterio.windows.Window(col_off, row_off, columns, rows))
+            if progress:
+                progress(i + 1, len(windows))
+
+
+def get_band_info(image):
+    """names and a common numpy dtype of the bands of an image"""
+    info = image.getInfo()
+    band_names = [band['id'] for band in info['bands']]
+
+    dtypes = []
+    for band in info['bands']:
+        data_type = band['data_type']
+        if data_type.get('precision') == 'int':
+            dtypes.append(np.int32)
+        elif data_type.get('precision') == 'float':
+            dtypes.append(np.float32)
+        else:
+            dtypes.append(np.float64)
+
+    return band_names, np.result_type(*dtypes).name
+
+
+def get_overview_factors(shape):
+    """decimation factors of overviews, until the raster fits in a single block"""
+    factors = []
+    factor = 2
+    while max(shape) / factor >= BLOCK_SIZE / 2:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def write_cog(src, dst):
+    """
+    Convert a GeoTIFF to a cloud optimized GeoTIFF: tiled, compressed and with
+    internal overviews, which allows clients to read windows with range requests
+    :param src: String, path of the GeoTIFF, overviews are added to it
+    :param dst: String, path of the COG
+    """
+    with rasterio.open(src, 'r+') as ds:
+        ds.build_overviews(get_overview_factors(ds.shape), rasterio.enums.Resampling.nearest)
+        ds.update_tags(ns='rio_overview', resampling='nearest')
+
+    rasterio.shutil.copy(
+        src, dst,
+        driver='GTiff',
+        tiled=True,
+        blockxsize=BLOCK_SIZE,
+        blockysize=BLOCK_SIZE,
+        compress='deflate',
+        copy_src_overviews=True,
+        BIGTIFF='IF_SAFER'
+    )
+
+
+def download_raster(path, image, crs, bounds, cell_size, progress=None, cog=False, workers=None):
+    """
+    Download an image as a GeoTIFF, in windows fetched concurrently
+    :param path: String, path of the GeoTIFF
+    :param image: ee.Image
+    :param bounds: tuple of (xmin, ymin, xmax, ymax) in crs
+    :param progress: function (done, total) called after each window
+    :param cog: Boolean, write a cloud optimized GeoTIFF
+    :param workers: Number of windows fetched concurrently, WORKERS if None
+    """
+    band_names, dtype = get_band_info(image)
+    image = image.unmask(NODATA, False)
+
+    def fetch(window):
+        return compute_window(image, crs, bounds, cell_size, window)
+
+    logger.debug('Downloading raster of %s pixels, bounds: %s', get_shape(bounds, cell_size), bounds)
+
+    if not cog:
+        write_geotiff(path, fetch, crs, bounds, cell_size, band_names, dtype, progress=progress, workers=workers)
+        return
+
+    fd, tmp = tempfile.mkstemp(suffix='.tif')
+    os.close(fd)
+    try:
+        write_geotiff(tmp, fetch, crs, bounds, cell_size, band_names, dtype, progress=progress, workers=workers)
+        write_cog(tmp, path)
+    finally:
+        os.remove(tmp)
+
+
+def download_bundle(path, images, crs, bounds, cell_size, bundle_format='zip', progress=None, cog=False):
+    """
+    Download images on a common grid, as a ZIP of GeoTIFFs or a single multi-band GeoTIFF
+    :param path: String, path of the ZIP or GeoTIFF
+    :param images: Dictionary of variable name and ee.Image
+    :param bundle_format: String, zip or multiband
+    :param progress: function (done, total) called after each window
+    :param cog: Boolean, write cloud optimized GeoTIFFs
+    """
+    if bundle_format == 'multiband':
+        image = ee.Image.cat([image.rename(name) for name, image in images.items()])
+        download_raster(path, image, crs, bounds, cell_size, progress=progress, cog=cog)
+        return
+
+    # progress of all variables combined
+    done = {name: 0 for name in images}
+    lock = threading.Lock()
+
+    def download(name, directory):
+        def progress_variable(n, total):
+            with lock:
+                done[name] = n / total
+                if progress:
+                    progress(sum(done.values()), len(images))
+
+        # the variables share the window workers, the number of windows in flight stays the same
+        filename = os.path.join(directory, name + '.tif')
+        download_raster(filename, images[name], crs, bounds, cell_size, progress=progress_variable, cog=cog,
+                        workers=max(1, WORKERS // BUNDLE_WORKERS))
+        return filename
+
+    directory = tempfile.mkdtemp()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(BUNDLE_WORKERS) as executor:
+            filenames = list(executor.map(lambda name: download(name, directory), images))
+
+        # GeoTIFFs are compressed already
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True) as f:
+            for filename in filenames:
+                f.write(filename, os.path.basename(filename))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,265 @@
+"""Helpers to create (cacheable, compressed) HTTP responses."""
+import functools
+import gzip
+import hashlib
+import io
+import json
+
+import numpy as np
+from flask import request, Response, make_response
+
+import hydroengine_service
+from hydroengine_service import config
+from hydroengine_service import error_handler
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+def get_source_max_age(source):
+    """
+    Cache-Control max-age for data derived from a source, based on its update cadence
+    :param source: String, source/location of Earth Engine Object
+    :return: Number of seconds
+    """
+    for prefix, max_age in config.CACHE_MAX_AGE_SOURCES.items():
+        if source and source.startswith(prefix):
+            return max_age
+
+    data_params = config.DATASETS_VIS.get(source, {})
+    if data_params.get('type') == 'Image':
+        return config.CACHE_MAX_AGE_STATIC
+
+    return config.CACHE_MAX_AGE_DEFAULT
+
+
+def get_layer_max_age(source=None):
+    """
+    Cache-Control max-age for a response containing tile urls, limited by map id lifetime
+    :param source: String, source/location of Earth Engine Object
+    :return: Number of seconds
+    """
+    if not source:
+        return config.CACHE_MAX_AGE_MAP
+
+    return min(config.CACHE_MAX_AGE_MAP, get_source_max_age(source))
+
+
+def set_cache_headers(response, etag=None, max_age=None):
+    """
+    Add a strong ETag (content hash if etag is None) and Cache-Control to a response
+    and turn it into a 304 Not Modified if it matches If-None-Match of a GET or HEAD request
+    :param response: flask.Response
+    :param etag: String, ETag to use instead of a hash of the content
+    :param max_age: Number of seconds the response may be cached
+    :return: flask.Response
+    """
+    if response.status_code != 200:
+        return response
+
+    if etag is None:
+        response.add_etag()
+    else:
+        response.set_etag(etag)
+
+    if max_age is not None:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+
+    return response.make_conditional(request)
+
+
+def _default(o):
+    """serialize numpy values for the standard json module"""
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError('Object of type %s is not JSON serializable' % type(o).__name__)
+
+
+def dumps(data):
+    """
+    Serialize data to JSON bytes, using orjson if available
+    :param data: JSON serializable object, may contain numpy arrays
+    :return: bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+    return json.dumps(data, default=_default).encode('utf-8')
+
+
+def _round_coordinates(coordinates, precision):
+    try:
+        return np.round(np.asarray(coordinates, dtype=float), precision).tolist()
+    except ValueError:
+        # ragged, e.g. a polygon with holes or a multi-geometry, round per part
+        return [_round_coordinates(c, precision) for c in coordinates]
+
+
+def quantize_coordinates(data, precision):
+    """
+    Round all GeoJSON coordinates in data to a number of decimals
+    :param data: GeoJSON object (or any JSON object containing GeoJSON)
+    :param precision: Number of decimals
+    :return: copy of data with rounded coordinates
+    """
+    if isinstance(data, dict):
+        return {
+            k: _round_coordinates(v, precision) if k == 'coordinates' else quantize_coordinates(v, precision)
+            for k, v in data.items()
+        }
+    if isinstance(data, list):
+        return [quantize_coordinates(v, precision) for v in data]
+
+    return data
+
+
+def get_request_precision():
+    """Requested coordinate precision (number of decimals), from arguments or JSON body"""
+    precision = request.args.get('precision')
+
+    r = request.get_json(silent=True)
+    if precision is None and isinstance(r, dict):
+        precision = r.get('precision')
+
+    if precision is None:
+        return None
+
+    try:
+        precision = int(precision)
+    except (TypeError, ValueError):
+        raise error_handler.InvalidUsage('precision must be an integer number of decimals.')
+
+    if not 0 <= precision <= 15:
+        raise error_handler.InvalidUsage('precision must be between 0 and 15.')
+
+    return precision
+
+
+def get_accept_encoding():
+    """Best content encoding accepted by the client, None if identity"""
+    encodings = ['gzip']
+    if brotli is not None:
+        encodings.insert(0, 'br')
+
+    return request.accept_encodings.best_match(encodings)
+
+
+def compress(data, encoding):
+    """
+    Compress bytes deterministically (equal input gives equal output, needed for strong ETags)
+    :param data: bytes
+    :param encoding: String, br or gzip
+    :return: bytes
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6, mtime=0) as f:
+        f.write(data)
+
+    return buffer.getvalue()
+
+
+def json_response(data, max_age=None, status=200, precision=None):
+    """
+    Create a (compressed) JSON response with a strong ETag derived from its content.
+    Coordinates are rounded to the requested precision.
+    :param data: JSON serializable object, may contain numpy arrays
+    :param max_age: Number of seconds the response may be cached, no Cache-Control if None
+    :param status: HTTP status code
+    :param precision: Number of decimals for coordinates, taken from the request if None
+    :return: flask.Response
+    """
+    if precision is None:
+        precision = get_request_precision()
+
+    if precision is not None:
+        data = quantize_coordinates(data, precision)
+
+    body = dumps(data)
+
+    response = Response(status=status, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+
+    encoding = get_accept_encoding()
+    if encoding and len(body) >= MIN_COMPRESS_SIZE:
+        body = compress(body, encoding)
+        response.content_encoding = encoding
+
+    response.set_data(body)
+
+    return set_cache_headers(response, max_age=max_age)
+
+
+def get_request_etag():
+    """
+    Strong ETag derived from the cache key of the current request (path, arguments,
+    accepted format and JSON body), independent of the order of the keys in the request.
+    """
+    key = {
+        'version': hydroengine_service.__version__,
+        'path': request.path,
+        'accept': request.headers.get('Accept'),
+        'args': sorted(request.args.items(multi=True)),
+        'json': request.get_json(silent=True)
+    }
+    key = json.dumps(key, sort_keys=True, separators=(',', ':'))
+
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def cache_by_request(max_age):
+    """
+    Decorator for deterministic routes, the ETag is derived from the request, which
+    allows answering a matching If-None-Match with 304 without evaluating the route.
+    Routes whose data may change for the same request (e.g. the lake store or assets
+    passed by the caller) use the content ETag of json_response instead.
+    Only GET and HEAD requests are answered with 304, POST requests (with the
+    parameters in the JSON body) are always evaluated and only get the headers.
+    :param max_age: Number of seconds the response may be cached
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            etag = get_request_etag()
+
+            # a representation is identified by request and content encoding
+            etags = [etag]
+            encoding = get_accept_encoding()
+            if encoding:
+                etags.append(etag + '-' + encoding)
+
+            if request.method in ('GET', 'HEAD'):
+                for e in etags:
+                    if request.if_none_match.contains(e):
+                        response = Response(status=304)
+                        response.set_etag(e)
+                        response.vary.add('Accept-Encoding')
+                        response.cache_control.public = True
+                        response.cache_control.max_age = max_age
+                        return response
+
+            response = make_response(f(*args, **kwargs))
+
+            if response.content_encoding:
+                etag = etag + '-' + response.content_encoding
+
+            return set_cache_headers(response, etag=etag, max_age=max_age)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,96 @@
+"""
+Evaluation of memory-limited EE computations: failures caused by memory or time
+limits are retried with a larger tileScale and then with a coarser scale. The
+tileScale that worked is remembered for a while per computation and region size
+class, the scale always starts at the requested one.
+"""
+import logging
+import math
+import threading
+import time
+
+import ee
+
+logger = logging.getLogger(__name__)
+
+# messages of EE errors that may succeed with smaller tiles or a coarser scale
+RESOURCE_ERRORS = (
+    'User memory limit exceeded',
+    'Computation timed out',
+    'Too many concurrent aggregations',
+    'Output of image computation is too large',
+)
+
+# tileScale values tried at the requested scale
+TILE_SCALES = (4, 8, 16)
+# factors applied to the scale, at the largest tileScale
+SCALE_FACTORS = (2, 4)
+# number of seconds a tileScale that worked is remembered, e.g. a transient
+# timeout under load does not affect later requests for long
+MEMORY_TIME = 60 * 60
+
+
+def is_resource_error(e):
+    """True if an exception is an EE error caused by memory or time limits"""
+    return isinstance(e, ee.EEException) and any(m in str(e) for m in RESOURCE_ERRORS)
+
+
+def get_size_class(area):
+    """size class of a region, the order of magnitude of its area in square meters"""
+    return int(math.floor(math.log10(max(area, 1))))
+
+
+class AdaptiveRetry(object):
+    """
+    Evaluates computations with increasing tileScale and scale until they succeed.
+    Settings are tried in order: every tileScale at the requested scale, then the
+    largest tileScale at coarser scales.
+    """
+
+    def __init__(self, tile_scales=TILE_SCALES, scale_factors=SCALE_FACTORS, memory_time=MEMORY_TIME):
+        self.settings = [(tile_scale, 1) for tile_scale in tile_scales]
+        self.settings += [(tile_scales[-1], factor) for factor in scale_factors]
+        self.memory_time = memory_time
+
+        # index of the tileScale that worked and when, per (name, size class)
+        self.known = {}
+        self._lock = threading.Lock()
+        self._n_tile_scales = len(tile_scales)
+
+    def get_start(self, key):
+        """index of the first setting to try, the remembered tileScale at the requested scale"""
+        with self._lock:
+            index, remembered = self.known.get(key, (0, 0))
+            if time.time() - remembered > self.memory_time:
+                self.known.pop(key, None)
+                return 0
+            return index
+
+    def evaluate(self, name, area, compute):
+        """
+        Evaluate a computation
+        :param name: String, name of the computation
+        :param area: Number, area of the region in square meters
+        :param compute: function (tile_scale, scale_factor) returning the evaluated
+        result, e.g. by calling getInfo
+        :return: tuple of the result of compute and the scale factor used, results
+        at a coarser scale (factor > 1) should be reported and cached as such
+        """
+        key = (name, get_size_class(area))
+
+        for i in range(self.get_start(key), len(self.settings)):
+            tile_scale, scale_factor = self.settings[i]
+            try:
+                result = compute(tile_scale, scale_factor)
+            except ee.EEException as e:
+                if not is_resource_error(e) or i == len(self.settings) - 1:
+                    raise
+                logger.warning('%s failed with tileScale %d and scale x %d (%s), retrying',
+                               name, tile_scale, scale_factor, e)
+                continue
+
+            with self._lock:
+                # later requests of the same size class start with this tileScale, at the requested scale
+                self.known[key] = (min(i, self._n_tile_scales - 1), time.time())
+
+            return result, scale_factor
@@ -1,5 +1,31 @@
 import ee
 
+from hydroengine_service import error_handler
+
+# variables sampled at the points of a water network: a function (distance, scale)
+# returning the image, the name of the ee.Reducer and the buffer radius around the
+# points, in multiples of the scale. distance is the skeleton distance image.
+NETWORK_VARIABLES = {
+    "width": {
+        "image": lambda distance, scale: distance.multiply(scale * 2),
+        "reducer": "max",
+        "buffer": 0
+    },
+    "elevation": {
+        "image": lambda distance, scale: ee.Image("JAXA/ALOS/AW3D30_V1_1").select("MED"),
+        "reducer": "median",
+        "buffer": 10
+    },
+    "flow_accumulation": {
+        "image": lambda distance, scale: ee.Image("WWF/HydroSHEDS/15ACC"),
+        "reducer": "max",
+        "buffer": 10
+    }
+}
+
+# property holding the point of a network sample while it is reduced over a buffer
+POINT_PROPERTY = "_point"
+
 
 def generate_perimeter_points(geom, step):
     """
@@ -46,12 +72,28 @@ def generate_perimeter_points(geom, step):
     return ee.FeatureCollection(points)
 
 
-def generate_voronoi_polygons(points, scale, aoi):
+def generate_distance(points, scale, aoi):
+    """
+    Distance (in pixels) to the nearest of the perimeter points
+    :param points:
+    :param scale:
+    :param aoi:
+    :return:
+    """
+    proj = ee.Projection('EPSG:4326').atScale(scale)
+
+    return ee.Image(0).float().paint(points, 1) \
+        .fastDistanceTransform().sqrt().clip(aoi) \
+        .reproject(proj)
+
+
+def generate_voronoi_polygons(points, scale, aoi, tile_scale=4):
     """
     Generates Voronoi polygons
     :param points:
     :param scale:
     :param aoi:
+    :param tile_scale: tileScale of the vectorization
     :return:
     """
 
@@ -59,9 +101,7 @@ def generate_voronoi_polygons(points, scale, aoi):
     # proj = ee.Projection('EPSG:3857').atScale(scale)
     proj = ee.Projection('EPSG:4326').atScale(scale)
 
-    distance = ee.Image(0).float().paint(points, 1) \
-        .fastDistanceTransform().sqrt().clip(aoi) \
-        .reproject(proj)
+    distance = generate_distance(points, scale, aoi)
 
     concavity = distance.convolve(ee.Kernel.laplacian8()) \
         .reproject(proj)
@@ -99,7 +139,7 @@ def generate_voronoi_polygons(points, scale, aoi):
         "geometry": aoi,
         "eightConnected": True,
         "labelProperty": 'labels',
-        "tileScale": 4
+        "tileScale": tile_scale
     })
 
     # polygons = polygons.map(lambda o: o.snap(error, proj))
@@ -107,16 +147,16 @@ def generate_voronoi_polygons(points, scale, aoi):
     return {"polygons": polygons, "distance": distance}
 
 
-def generate_skeleton_from_voronoi(scale, water_vector):
+def prepare_water_geometry(scale, water_vector):
+    """
+    Removes small holes from the water mask and buffers it
+    :return: buffered geometry, its perimeter and points along the perimeter
+    """
     # step between points along perimeter
     step = scale * 10
-    simplify_centerline_factor = 15
 
     error = ee.ErrorMargin(1, 'meters')
 
-    # proj = ee.Projection('EPSG:3857').atScale(scale)
-    proj = ee.Projection('EPSG:4326').atScale(scale)
-
     # turn water mask into a skeleton
     def add_coords_count(o):
         return ee.Feature(None, {"count": ee.List(o).length(), "values": o})
@@ -140,11 +180,31 @@ def generate_skeleton_from_voronoi(scale, water_vector):
     perimeter_geometry = geometry_buffer \
         .difference(geometry_buffer.buffer(-scale * 2, error), error)
 
-    geometry = geometry_buffer
+    points = generate_perimeter_points(geometry_buffer, step)
 
-    points = generate_perimeter_points(geometry, step)
+    return geometry_buffer, perimeter_geometry, points
 
-    output = generate_voronoi_polygons(points, scale, geometry)
+
+def generate_skeleton_distance(scale, water_vector):
+    """
+    Distance image of the skeleton, without computing the skeleton itself
+    """
+    geometry, _, points = prepare_water_geometry(scale, water_vector)
+
+    return generate_distance(points, scale, geometry)
+
+
+def generate_skeleton_from_voronoi(scale, water_vector, tile_scale=4):
+    simplify_centerline_factor = 15
+
+    error = ee.ErrorMargin(1, 'meters')
+
+    # proj = ee.Projection('EPSG:3857').atScale(scale)
+    proj = ee.Projection('EPSG:4326').atScale(scale)
+
+    geometry, perimeter_geometry, points = prepare_water_geometry(scale, water_vector)
+
+    output = generate_voronoi_polygons(points, scale, geometry, tile_scale)
 
     polygons = output["polygons"]
     distance = output["distance"]
@@ -191,3 +251,51 @@ def generate_skeleton_from_voronoi(scale, water_vector):
         # .map(lambda o: o.transform(ee.Projection('EPSG:4326').atScale(scale)), error)
 
     return {"centerline": centerline, "distance": distance}
+
+
+def _restore_point(f):
+    f = f.setGeometry(ee.Geometry(f.get(POINT_PROPERTY)))
+    return f.select(f.propertyNames().remove(POINT_PROPERTY))
+
+
+def sample_network_variables(points, distance, scale, variables=None):
+    """
+    Sample variables at the points of a water network. Variables sharing a buffer
+    radius are stacked into one image and reduced with a combined reducer, in a
+    single reduceRegions pass per radius.
+    :param points: ee.FeatureCollection of points
+    :param distance: ee.Image, skeleton distance
+    :param scale: Number, scale in meters
+    :param variables: list of names in NETWORK_VARIABLES, all if None
+    :return: ee.FeatureCollection
+    """
+    variables = variables or list(NETWORK_VARIABLES)
+
+    groups = {}
+    for name in variables:
+        if name not in NETWORK_VARIABLES:
+            msg = "Unknown variable %s, use one of: %s" % (name, ", ".join(NETWORK_VARIABLES))
+            raise error_handler.InvalidUsage(msg)
+        groups.setdefault(NETWORK_VARIABLES[name]["buffer"], []).append(name)
+
+    for buffer, names in sorted(groups.items()):
+        image = ee.Image.cat([
+            NETWORK_VARIABLES[name]["image"](distance, scale).rename(name) for name in names
+        ])
+
+        # every reducer takes its own band
+        reducer = None
+        for name in names:
+            r = getattr(ee.Reducer, NETWORK_VARIABLES[name]["reducer"])().setOutputs([name])
+            reducer = r if reducer is None else reducer.combine(reducer2=r, sharedInputs=False)
+
+        if not buffer:
+            points = image.reduceRegions(points, reducer, scale)
+            continue
+
+        # the buffer is only the reduction region, the original point is kept in a property
+        radius = scale * buffer
+        buffered = points.map(lambda pt: pt.set(POINT_PROPERTY, pt.geometry()).buffer(radius))
+        points = image.reduceRegions(buffered, reducer, scale).map(_restore_point)
+
+    return points
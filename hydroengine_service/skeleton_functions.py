@@ -0,0 +1,267 @@
+"""
+Centerlines of water masks computed locally: the perimeter of the (GeoJSON) water
+mask is sampled, the Voronoi diagram of the samples gives the medial axis and its
+edges are joined into polylines.
+"""
+import numpy as np
+import scipy.spatial
+
+from hydroengine_service import error_handler
+from hydroengine_service import geometry_functions
+
+# rings (holes) with fewer coordinates are ignored, as in river_functions
+MIN_RING_COORDINATES = 6
+# Voronoi edges between perimeter samples closer along the ring are boundary artefacts
+MIN_RING_SEPARATION = 3
+
+# larger water masks are rejected, the Voronoi diagram needs about 1.5 KB per sample
+MAX_COORDINATES = 200000
+MAX_SAMPLES = 100000
+# maximum number of (point, ring segment) pairs tested at once in points_in_rings
+MAX_PAIRS = 2 ** 20
+
+
+def get_polygons(geojson):
+    """polygons (lists of rings) of GeoJSON"""
+    polygons = []
+    for geometry in geometry_functions.iter_geometries(geojson):
+        if geometry['type'] == 'Polygon':
+            polygons.append(geometry['coordinates'])
+        elif geometry['type'] == 'MultiPolygon':
+            polygons.extend(geometry['coordinates'])
+
+    return polygons
+
+
+def to_local(lonlat, origin):
+    """equirectangular projection (meters) around origin (lon, lat)"""
+    lonlat = np.radians(np.asarray(lonlat, dtype=float))
+    lon0, lat0 = np.radians(origin)
+    x = (lonlat[:, 0] - lon0) * np.cos(lat0) * geometry_functions.EARTH_RADIUS
+    y = (lonlat[:, 1] - lat0) * geometry_functions.EARTH_RADIUS
+    return np.column_stack([x, y])
+
+
+def from_local(xy, origin):
+    """inverse of to_local"""
+    lon0, lat0 = np.radians(origin)
+    lon = xy[:, 0] / (np.cos(lat0) * geometry_functions.EARTH_RADIUS) + lon0
+    lat = xy[:, 1] / geometry_functions.EARTH_RADIUS + lat0
+    return np.degrees(np.column_stack([lon, lat]))
+
+
+def sample_ring(ring, step):
+    """points along a closed ring (array of x, y) at distances step, the ring is not closed"""
+    ring = np.asarray(ring, dtype=float)
+    if not np.array_equal(ring[0], ring[-1]):
+        ring = np.vstack([ring, ring[:1]])
+
+    distances = np.concatenate([[0.0], np.cumsum(np.hypot(*np.diff(ring, axis=0).T))])
+    n = max(3, int(np.ceil(distances[-1] / step)))
+    samples = np.linspace(0, distances[-1], n, endpoint=False)
+
+    return np.column_stack([np.interp(samples, distances, ring[:, 0]), np.interp(samples, distances, ring[:, 1])])
+
+
+def points_in_rings(points, rings):
+    """
+    even-odd test of points (array of x, y) against rings (arrays of x, y), only
+    points within the bounds of a ring are tested, in chunks of at most MAX_PAIRS
+    """
+    inside = np.zeros(len(points), dtype=bool)
+
+    for ring in rings:
+        x1, y1 = ring[:, 0], ring[:, 1]
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+
+        within_x = (points[:, 0] >= x1.min()) & (points[:, 0] <= x1.max())
+        within_y = (points[:, 1] >= y1.min()) & (points[:, 1] <= y1.max())
+        candidates = np.flatnonzero(within_x & within_y)
+
+        chunk_size = max(1, MAX_PAIRS // len(ring))
+        for start in range(0, len(candidates), chunk_size):
+            chunk = candidates[start:start + chunk_size]
+            x, y = points[chunk, 0, None], points[chunk, 1, None]
+
+            crosses = (y1 > y) != (y2 > y)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+            inside[chunk] ^= (crosses & (x < x_cross)).sum(axis=1) % 2 == 1
+
+    return inside
+
+
+def simplify_line(line, tolerance):
+    """Douglas-Peucker simplification of a line (array of x, y)"""
+    keep = np.zeros(len(line), dtype=bool)
+    keep[[0, -1]] = True
+
+    stack = [(0, len(line) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+
+        segment = line[j] - line[i]
+        offsets = line[i + 1:j] - line[i]
+        norm = np.hypot(*segment)
+        if norm == 0:
+            d = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            d = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / norm
+
+        k = int(np.argmax(d))
+        if d[k] > tolerance:
+            keep[i + 1 + k] = True
+            stack.extend([(i, i + 1 + k), (i + 1 + k, j)])
+
+    return line[keep]
+
+
+def _build_adjacency(edges):
+    adjacency = {}
+    for a, b in edges:
+        adjacency.setdefault(a, set()).add(b)
+        adjacency.setdefault(b, set()).add(a)
+    return adjacency
+
+
+def _remove_node(adjacency, node):
+    for neighbour in adjacency.pop(node):
+        adjacency[neighbour].discard(node)
+
+
+def prune_branches(adjacency, positions, min_length):
+    """remove branches from a leaf to the first junction shorter than min_length"""
+    short = []
+    for leaf in [node for node, neighbours in adjacency.items() if len(neighbours) == 1]:
+        path = [leaf]
+        length = 0.0
+        previous, current = None, leaf
+        while len(adjacency[current]) <= 2:
+            following = [n for n in adjacency[current] if n != previous]
+            if not following:
+                break
+            previous, current = current, following[0]
+            length += np.hypot(*(positions[current] - positions[previous]))
+            path.append(current)
+
+        # only branches ending at a junction, isolated lines are kept
+        if len(adjacency[current]) > 2 and length < min_length:
+            short.append(path[:-1])
+
+    # all short branches are removed at once, e.g. both corners at the end of a channel
+    for path in short:
+        for node in path:
+            _remove_node(adjacency, node)
+
+
+def get_chains(adjacency):
+    """join the edges of a graph into chains of nodes between nodes with degree != 2"""
+    visited = set()
+    chains = []
+
+    def walk(start, neighbour):
+        chain = [start, neighbour]
+        visited.add(frozenset((start, neighbour)))
+        previous, current = start, neighbour
+        while len(adjacency[current]) == 2 and current != start:
+            following = [n for n in adjacency[current] if n != previous][0]
+            edge = frozenset((current, following))
+            if edge in visited:
+                break
+            visited.add(edge)
+            chain.append(following)
+            previous, current = current, following
+        return chain
+
+    nodes = sorted(adjacency, key=lambda node: len(adjacency[node]) == 2)
+    for node in nodes:
+        for neighbour in sorted(adjacency[node]):
+            if frozenset((node, neighbour)) not in visited:
+                chains.append(walk(node, neighbour))
+
+    return chains
+
+
+def skeletonize(water_mask, scale, step=None, min_branch_length=None, tolerance=None):
+    """
+    Centerline network of a water mask
+    :param water_mask: GeoJSON (FeatureCollection) of the water mask polygons, EPSG:4326
+    :param scale: Number, scale in meters
+    :param step: Number, distance between perimeter samples in meters, the scale by default
+    :param min_branch_length: Number, shorter side branches are removed, 10 x scale by default
+    :param tolerance: Number, simplification tolerance in meters, 1.5 x scale by default
+    :return: GeoJSON FeatureCollection of LineStrings, each with the mean width in meters
+    """
+    step = step or scale
+    min_branch_length = min_branch_length or scale * 10
+    tolerance = tolerance or scale * 1.5
+
+    collection = {'type': 'FeatureCollection', 'features': []}
+
+    polygons = [
+        [ring for i, ring in enumerate(polygon) if i == 0 or len(ring) >= MIN_RING_COORDINATES]
+        for polygon in get_polygons(water_mask)
+    ]
+    rings = [np.asarray(ring, dtype=float)[:, :2] for polygon in polygons for ring in polygon if len(ring) >= 4]
+    if not rings:
+        return collection
+
+    n_coordinates = sum(len(ring) for ring in rings)
+    if n_coordinates > MAX_COORDINATES:
+        msg = 'The water mask has %d coordinates, the local engine supports up to %d, use a coarser scale ' \
+              'or engine ee.' % (n_coordinates, MAX_COORDINATES)
+        raise error_handler.InvalidUsage(msg)
+
+    origin = np.concatenate(rings).mean(axis=0)
+    rings = [to_local(ring, origin) for ring in rings]
+
+    # perimeter samples, with the ring and the position along the ring
+    samples = [sample_ring(ring, step) for ring in rings]
+
+    n_samples = sum(len(s) for s in samples)
+    if n_samples > MAX_SAMPLES:
+        msg = 'The perimeter of the water mask has %d samples, the local engine supports up to %d, use a ' \
+              'coarser scale or engine ee.' % (n_samples, MAX_SAMPLES)
+        raise error_handler.InvalidUsage(msg)
+    points = np.concatenate(samples)
+    ring_index = np.concatenate([np.full(len(s), i) for i, s in enumerate(samples)])
+    ring_position = np.concatenate([np.arange(len(s)) for s in samples])
+    ring_size = np.array([len(s) for s in samples])[ring_index]
+
+    voronoi = scipy.spatial.Voronoi(points)
+
+    ridge_vertices = np.array(voronoi.ridge_vertices)
+    ridge_points = voronoi.ridge_points
+
+    # finite edges between samples far apart along the perimeter, with both ends in the water
+    a, b = ridge_points[:, 0], ridge_points[:, 1]
+    separation = np.abs(ring_position[a] - ring_position[b])
+    separation = np.minimum(separation, ring_size[a] - separation)
+    keep = (ridge_vertices >= 0).all(axis=1)
+    keep &= (ring_index[a] != ring_index[b]) | (separation >= MIN_RING_SEPARATION)
+
+    vertices_inside = points_in_rings(voronoi.vertices, rings)
+    keep &= vertices_inside[np.clip(ridge_vertices, 0, None)].all(axis=1)
+
+    edges = ridge_vertices[keep]
+    if not len(edges):
+        return collection
+
+    # distance to the perimeter, half the width
+    radius, _ = scipy.spatial.cKDTree(points).query(voronoi.vertices)
+
+    adjacency = _build_adjacency(edges.tolist())
+    prune_branches(adjacency, voronoi.vertices, min_branch_length)
+
+    for chain in get_chains(adjacency):
+        line = simplify_line(voronoi.vertices[chain], tolerance)
+        coordinates = from_local(line, origin).tolist()
+        collection['features'].append({
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': coordinates},
+            'properties': {'width': float(2 * radius[chain].mean())}
+        })
+
+    return collection
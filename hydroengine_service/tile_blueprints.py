@@ -0,0 +1,95 @@
+import flask_cors
+from flask import Response
+from flask import Blueprint
+
+from hydroengine_service import cache_functions
+from hydroengine_service import config
+from hydroengine_service import dgds_functions
+from hydroengine_service import mbtiles_functions
+from hydroengine_service import response_functions
+from hydroengine_service import tile_functions
+
+v1 = Blueprint("tiles-v1", __name__)
+
+GEBCO = "projects/dgds-gee/bathymetry/gebco/2019"
+
+# DGDS layers served through the tile proxy: source, band and function
+DGDS_TILE_LAYERS = {
+    "glossis-waterlevel": ("projects/dgds-gee/glossis/waterlevel", "water_level", None),
+    "glossis-waterlevel-surge": ("projects/dgds-gee/glossis/waterlevel", "water_level_surge", None),
+    "glossis-currents": ("projects/dgds-gee/glossis/currents", None, "magnitude"),
+    "glossis-wind": ("projects/dgds-gee/glossis/wind", None, "magnitude"),
+    "glossis-waveheight": ("projects/dgds-gee/glossis/waveheight", "waveheight", None),
+    "gloffis-discharge": ("projects/dgds-gee/gloffis/hydro", "discharge_routed_simulated", None),
+    "crucial-groundwater-declining-trend": ("projects/dgds-gee/crucial/groundwater_declining_trend", "b1", None),
+}
+for period in (2, 5, 10, 25, 50, 75, 100):
+    DGDS_TILE_LAYERS["gtsm-waterlevel-return-period-%d" % period] = (
+        "projects/dgds-gee/gtsm/waterlevel_return_period", "waterlevel_%d" % period, None
+    )
+
+tile_proxy = tile_functions.RasterTileProxy(
+    cache=cache_functions.DiskCache(
+        config.CACHE_DIR / "raster-tiles", config.TILE_CACHE_MAX_SIZE
+    ),
+    url_max_age=config.CACHE_MAX_AGE_MAP,
+)
+
+# pre-rendered static layers, served before the tile proxy
+tile_archives = mbtiles_functions.TileArchives(config.TILE_ARCHIVE_DIR)
+
+
+def _resolve_dgds_layer(source, band, function):
+    def resolve():
+        # only the latest image is needed for the url
+        info = dgds_functions.get_dgds_data(source=source, band=band, function=function, image_num_limit=1)
+        return info["url"]
+
+    return resolve
+
+
+def _resolve_gebco():
+    return dgds_functions.visualize_gebco(GEBCO, "elevation")["url"]
+
+
+def _resolve_ssh_trend():
+    return dgds_functions.visualize_ssh_trend()["url"]
+
+
+def _resolve_elevation():
+    return dgds_functions.generate_elevation_map()["url"]
+
+
+for key, (source, band, function) in DGDS_TILE_LAYERS.items():
+    tile_proxy.register(
+        key,
+        _resolve_dgds_layer(source, band, function),
+        response_functions.get_source_max_age(source),
+        url_max_age=response_functions.get_layer_max_age(source),
+    )
+
+tile_proxy.register("gebco", _resolve_gebco, config.CACHE_MAX_AGE_STATIC)
+tile_proxy.register("ssh-trend", _resolve_ssh_trend, config.CACHE_MAX_AGE_STATIC)
+tile_proxy.register("elevation", _resolve_elevation, config.CACHE_MAX_AGE_STATIC)
+
+
+@v1.route("/tiles/raster/<layer>/<int:z>/<int:x>/<int:y>", methods=["GET"])
+@flask_cors.cross_origin()
+def get_raster_tile(layer, z, x, y):
+    """
+    Raster tile of a layer with a stable key, the tile is fetched from EE using
+    a current map id and cached locally. Static layers are served from a
+    pre-rendered archive when available.
+    """
+    data = tile_archives.get_tile(layer, z, x, y)
+    if data is not None:
+        cached = True
+        max_age = config.CACHE_MAX_AGE_STATIC
+    else:
+        data, cached = tile_proxy.get_tile(layer, z, x, y)
+        max_age = tile_proxy.layers[layer]["max_age"]
+
+    response = Response(data, status=200, mimetype=tile_functions.get_image_mimetype(data))
+    response.headers["X-Cache"] = "HIT" if cached else "MISS"
+
+    return response_functions.set_cache_headers(response, max_age=max_age)
@@ -0,0 +1,275 @@
+"""Web Mercator tile math, tile encoding and the raster tile proxy."""
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+import requests
+import requests.adapters
+
+from hydroengine_service import error_handler
+
+try:
+    import mapbox_vector_tile
+except ImportError:
+    mapbox_vector_tile = None
+
+logger = logging.getLogger(__name__)
+
+VECTOR_TILE_MIMETYPE = 'application/vnd.mapbox-vector-tile'
+
+EARTH_RADIUS = 6378137.0
+ORIGIN_SHIFT = math.pi * EARTH_RADIUS
+
+TILE_SIZE = 256
+# MVT coordinate extent of a tile
+TILE_EXTENT = 4096
+MAX_ZOOM = 24
+
+
+def validate_tile(z, x, y):
+    """raise InvalidUsage if z/x/y is not a valid tile"""
+    if not 0 <= z <= MAX_ZOOM:
+        raise error_handler.InvalidUsage('Zoom level must be between 0 and %d.' % MAX_ZOOM)
+
+    n = 2 ** z
+    if not (0 <= x < n and 0 <= y < n):
+        raise error_handler.InvalidUsage('Tile %d/%d/%d does not exist.' % (z, x, y))
+
+
+def get_tile_resolution(z):
+    """size of a pixel in meters (Web Mercator, at the equator) at zoom level z"""
+    return 2 * ORIGIN_SHIFT / (TILE_SIZE * 2 ** z)
+
+
+def get_tile_mercator_bounds(z, x, y):
+    """bounds of a tile in EPSG:3857 as (xmin, ymin, xmax, ymax)"""
+    size = 2 * ORIGIN_SHIFT / 2 ** z
+    xmin = -ORIGIN_SHIFT + x * size
+    ymax = ORIGIN_SHIFT - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def get_tile_bounds(z, x, y):
+    """bounds of a tile in EPSG:4326 as (west, south, east, north)"""
+    xmin, ymin, xmax, ymax = get_tile_mercator_bounds(z, x, y)
+    west, south = mercator_to_lonlat(xmin, ymin)
+    east, north = mercator_to_lonlat(xmax, ymax)
+    return float(west), float(south), float(east), float(north)
+
+
+def get_tile_range(bounds, z):
+    """
+    Tiles covering bounds at zoom level z
+    :param bounds: (west, south, east, north) in EPSG:4326
+    :return: tuple of (xmin, xmax, ymin, ymax), inclusive
+    """
+    west, south, east, north = bounds
+    n = 2 ** z
+    (x0, x1), (y0, y1) = lonlat_to_mercator([west, east], [north, south])
+
+    def to_tile(v):
+        return min(max(int(math.floor((v + ORIGIN_SHIFT) / (2 * ORIGIN_SHIFT) * n)), 0), n - 1)
+
+    # tile rows are counted from the north
+    return to_tile(x0), to_tile(x1), n - 1 - to_tile(y0), n - 1 - to_tile(y1)
+
+
+def iter_tiles(bounds, min_zoom, max_zoom):
+    """generate (z, x, y) of all tiles covering bounds for the zoom levels"""
+    for z in range(min_zoom, max_zoom + 1):
+        xmin, xmax, ymin, ymax = get_tile_range(bounds, z)
+        for x in range(xmin, xmax + 1):
+            for y in range(ymin, ymax + 1):
+                yield z, x, y
+
+
+def lonlat_to_mercator(lon, lat):
+    """convert (arrays of) longitude and latitude to EPSG:3857"""
+    lon = np.asarray(lon, dtype=float)
+    lat = np.clip(np.asarray(lat, dtype=float), -85.0511287798, 85.0511287798)
+    x = np.radians(lon) * EARTH_RADIUS
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * EARTH_RADIUS
+    return x, y
+
+
+def mercator_to_lonlat(x, y):
+    """convert (arrays of) EPSG:3857 coordinates to longitude and latitude"""
+    lon = np.degrees(np.asarray(x, dtype=float) / EARTH_RADIUS)
+    lat = np.degrees(2 * np.arctan(np.exp(np.asarray(y, dtype=float) / EARTH_RADIUS)) - np.pi / 2)
+    return lon, lat
+
+
+def _project_coordinates(coordinates):
+    try:
+        points = np.asarray(coordinates, dtype=float)
+    except ValueError:
+        # ragged, e.g. a polygon with holes, project per part
+        return [_project_coordinates(c) for c in coordinates]
+
+    if points.ndim == 1:
+        if not points.size:
+            return []
+        x, y = lonlat_to_mercator(points[0], points[1])
+        return [float(x), float(y)]
+
+    if points.ndim == 2:
+        x, y = lonlat_to_mercator(points[:, 0], points[:, 1])
+        return np.column_stack([x, y]).tolist()
+
+    return [_project_coordinates(c) for c in coordinates]
+
+
+def project_geometry(geometry):
+    """project a GeoJSON geometry from EPSG:4326 to EPSG:3857"""
+    if geometry['type'] == 'GeometryCollection':
+        return {
+            'type': 'GeometryCollection',
+            'geometries': [project_geometry(g) for g in geometry['geometries']]
+        }
+
+    return {'type': geometry['type'], 'coordinates': _project_coordinates(geometry['coordinates'])}
+
+
+def encode_vector_tile(layer, features, z, x, y):
+    """
+    Encode GeoJSON features (EPSG:4326) as a Mapbox Vector Tile
+    :param layer: String, name of the layer in the tile
+    :param features: list of GeoJSON features, clipped to the tile
+    :return: bytes
+    """
+    if mapbox_vector_tile is None:
+        raise error_handler.InvalidUsage('Vector tiles are not available, mapbox-vector-tile is not installed.')
+
+    tile_features = []
+    for feature in features:
+        if not feature.get('geometry'):
+            continue
+
+        properties = {
+            k: v for k, v in (feature.get('properties') or {}).items() if v is not None
+        }
+
+        tile_features.append({
+            'geometry': project_geometry(feature['geometry']),
+            'properties': properties
+        })
+
+    options = {
+        'quantize_bounds': get_tile_mercator_bounds(z, x, y),
+        'extents': TILE_EXTENT
+    }
+
+    return mapbox_vector_tile.encode([{'name': layer, 'features': tile_features}], default_options=options)
+
+
+def get_image_mimetype(data):
+    """mimetype of an encoded tile image"""
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    if data.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    return 'application/octet-stream'
+
+
+class RasterTileProxy(object):
+    """
+    Serves raster tiles of layers with a stable key. The key resolves to a current
+    tile url template (e.g. containing an EE map id), tiles are fetched upstream
+    with pooled connections and stored in a disk cache.
+    """
+
+    def __init__(self, cache, url_max_age, pool_size=16, timeout=30):
+        """
+        :param cache: DiskCache to store tiles in
+        :param url_max_age: Number of seconds a resolved url template is used at most (map id lifetime)
+        :param pool_size: Number of pooled connections to the upstream tile server
+        :param timeout: Timeout of upstream requests in seconds
+        """
+        self.cache = cache
+        self.url_max_age = url_max_age
+        self.timeout = timeout
+        self.layers = {}
+
+        self._urls = {}
+        # one lock per layer, resolving a layer does not block the other layers
+        self._locks = {}
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def register(self, key, resolve, max_age, url_max_age=None):
+        """
+        Register a layer
+        :param key: String, stable key of the layer
+        :param resolve: function returning a url template with {z}, {x} and {y}
+        :param max_age: Number of seconds tiles of this layer are valid
+        :param url_max_age: Number of seconds a resolved url template of this layer is
+        used, the smallest of max_age and the url_max_age of the proxy by default
+        """
+        if url_max_age is None:
+            url_max_age = min(self.url_max_age, max_age)
+
+        self.layers[key] = {'resolve': resolve, 'max_age': max_age, 'url_max_age': url_max_age}
+        self._locks[key] = threading.Lock()
+
+    def get_url_template(self, key, refresh=False):
+        """current url template of a layer, resolved again if it is too old"""
+        with self._locks[key]:
+            url, resolved = self._urls.get(key, (None, 0))
+
+            if refresh or url is None or time.time() - resolved > self.layers[key]['url_max_age']:
+                logger.debug('Resolving tile url for layer %s', key)
+                url = self.layers[key]['resolve']()
+                self._urls[key] = (url, time.time())
+
+        return url
+
+    def get_cache_key(self, key, z, x, y):
+        # tiles are cached for at most max_age of the layer
+        max_age = self.layers[key]['max_age']
+        period = int(time.time() // max_age)
+        return '{}/{}/{}/{}/{}'.format(key, period, z, x, y)
+
+    def fetch(self, key, z, x, y):
+        """fetch a tile upstream, resolves the url again once if it is no longer valid"""
+        for refresh in (False, True):
+            url = self.get_url_template(key, refresh).format(z=z, x=x, y=y)
+            response = self.session.get(url, timeout=self.timeout)
+
+            # expired map ids result in a client error
+            if 400 <= response.status_code < 500 and not refresh:
+                continue
+
+            break
+
+        if response.status_code != 200:
+            msg = 'Upstream tile server returned %d for tile %s/%d/%d/%d' % (
+                response.status_code, key, z, x, y)
+            raise error_handler.InvalidUsage(msg, status_code=502)
+
+        return response.content
+
+    def get_tile(self, key, z, x, y):
+        """
+        Get a tile from cache, or from upstream
+        :return: tuple of bytes and boolean, True if served from cache
+        """
+        if key not in self.layers:
+            msg = 'Unknown layer %s, use one of: %s' % (key, ', '.join(sorted(self.layers)))
+            raise error_handler.InvalidUsage(msg, status_code=404)
+
+        validate_tile(z, x, y)
+
+        cache_key = self.get_cache_key(key, z, x, y)
+        data = self.cache.get(cache_key)
+        if data is not None:
+            return data, True
+
+        data = self.fetch(key, z, x, y)
+        self.cache.put(cache_key, data)
+
+        return data, False
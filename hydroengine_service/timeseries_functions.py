@@ -0,0 +1,186 @@
+"""Point time series of image collections, fetched with getRegion in chunks and returned as columns."""
+import concurrent.futures
+import hashlib
+import io
+import json
+import logging
+import time
+
+import ee
+import numpy as np
+
+from hydroengine_service import geometry_functions
+
+logger = logging.getLogger(__name__)
+
+# maximum number of values in a single getRegion request (EE limit is 1048576)
+MAX_REGION_VALUES = 250000
+# number of chunks fetched concurrently
+WORKERS = 8
+# coordinates are rounded to this number of decimals in cache keys
+FINGERPRINT_DECIMALS = 6
+
+# columns of a getRegion table before the band values
+REGION_COLUMNS = ['id', 'longitude', 'latitude', 'time']
+
+# maximum distance of a point to its pixel center, as a fraction of the scale
+# (half the diagonal of a pixel is 0.71)
+MAX_PIXEL_DISTANCE = 0.75
+
+
+def get_chunks(times, n_points, n_bands=1, max_values=None):
+    """
+    Split sorted image times into chunks that fit in a single getRegion request
+    :param times: sorted list of image times (epoch ms)
+    :param n_points: Number of points sampled
+    :param n_bands: Number of bands sampled
+    :return: list of (start, end) with end exclusive
+    """
+    max_values = max_values or MAX_REGION_VALUES
+    n_images = max(1, max_values // (n_points * (len(REGION_COLUMNS) + n_bands)))
+
+    return [
+        (times[i], times[min(i + n_images, len(times)) - 1] + 1)
+        for i in range(0, len(times), n_images)
+    ]
+
+
+def parse_region(table):
+    """
+    Parse a getRegion table (header and rows)
+    :return: arrays of longitude, latitude, time (int64 epoch ms) and values (float32) of the first band
+    """
+    rows = table[1:]
+    if not rows:
+        return np.empty(0), np.empty(0), np.empty(0, dtype='int64'), np.empty(0, dtype='float32')
+
+    # values are None where the image is masked
+    columns = list(zip(*rows))
+    lon = np.array(columns[1], dtype=float)
+    lat = np.array(columns[2], dtype=float)
+    t = np.array(columns[3], dtype='int64')
+    v = np.array(columns[4], dtype=float).astype('float32')
+
+    return lon, lat, t, v
+
+
+def split_by_point(points, lon, lat, t, v, max_distance=None):
+    """
+    Assign the rows of a getRegion table to the requested points, rows are located
+    at pixel centers, each point gets the rows of the nearest pixel
+    :param points: array of (lon, lat)
+    :param max_distance: Number, in meters, points farther from the nearest pixel
+    center (e.g. outside the image footprint) get empty columns
+    :return: list of dictionaries with sorted columns t and v per point
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    empty = {'t': np.empty(0, dtype='int64'), 'v': np.empty(0, dtype='float32')}
+
+    if not len(t):
+        return [dict(empty) for _ in points]
+
+    pixels, pixel_index = np.unique(np.column_stack([lon, lat]), axis=0, return_inverse=True)
+    pixel_index = pixel_index.ravel()
+
+    # distances in meters, equirectangular around each point
+    d_lon = np.radians(pixels[None, :, 0] - points[:, None, 0]) * np.cos(np.radians(points[:, None, 1]))
+    d_lat = np.radians(pixels[None, :, 1] - points[:, None, 1])
+    distance = np.hypot(d_lon, d_lat) * geometry_functions.EARTH_RADIUS
+    nearest = distance.argmin(axis=1)
+
+    series = []
+    for i, pixel in enumerate(nearest):
+        if max_distance is not None and distance[i, pixel] > max_distance:
+            # no rows for this point, the nearest rows belong to another point
+            series.append(dict(empty))
+            continue
+
+        selection = pixel_index == pixel
+        order = np.argsort(t[selection], kind='stable')
+        series.append({'t': t[selection][order], 'v': v[selection][order]})
+
+    return series
+
+
+def get_fingerprint(point, *args):
+    """cache key of the time series at a point, for the other parameters given as args"""
+    point = [round(float(c), FINGERPRINT_DECIMALS) for c in point]
+    canonical = json.dumps([point] + list(args), sort_keys=True, default=str)
+    return 'timeseries/' + hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def _to_bytes(series):
+    buffer = io.BytesIO()
+    np.savez(buffer, t=series['t'], v=series['v'])
+    return buffer.getvalue()
+
+
+def _from_bytes(data):
+    with np.load(io.BytesIO(data)) as f:
+        return {'t': f['t'], 'v': f['v']}
+
+
+def get_time_series(collection, band, points, start, end, scale, cache=None, cache_args=(), max_age=None):
+    """
+    Time series of a band of an image collection at points
+    :param collection: ee.ImageCollection
+    :param band: String, name of the band, the first band if None
+    :param points: list of (lon, lat)
+    :param start: start date, ee.Date compatible, the whole collection if None
+    :param end: end date (exclusive), ee.Date compatible
+    :param scale: Number, scale in meters at which the images are sampled
+    :param cache: DiskCache to store the time series per point in
+    :param cache_args: parameters identifying the collection, part of the cache key
+    :param max_age: Number of seconds a cached time series is valid
+    :return: list of dictionaries with columns t (epoch ms, int64) and v (float32) per point
+    """
+    period = int(time.time() // max_age) if max_age else None
+    keys = [get_fingerprint(p, band, start, end, scale, period, *cache_args) for p in points]
+
+    series = [None] * len(points)
+    if cache is not None:
+        for i, key in enumerate(keys):
+            data = cache.get(key)
+            if data is not None:
+                series[i] = _from_bytes(data)
+
+    missing = [i for i, s in enumerate(series) if s is None]
+    if not missing:
+        return series
+
+    missing_points = [points[i] for i in missing]
+
+    collection = ee.ImageCollection(collection)
+    if start is not None:
+        collection = collection.filterDate(start, end)
+    if band is not None:
+        collection = collection.select([band])
+
+    # image times determine the chunks, a single small request
+    times = sorted(collection.aggregate_array('system:time_start').getInfo())
+
+    geometry = ee.Geometry.MultiPoint([list(p) for p in missing_points])
+
+    def fetch(chunk):
+        table = collection.filterDate(chunk[0], chunk[1]).getRegion(geometry, scale).getInfo()
+        return parse_region(table)
+
+    chunks = get_chunks(times, len(missing_points))
+    logger.debug('Fetching time series of %d images at %d points in %d chunks',
+                 len(times), len(missing_points), len(chunks))
+
+    with concurrent.futures.ThreadPoolExecutor(WORKERS) as executor:
+        parts = list(executor.map(fetch, chunks))
+
+    if parts:
+        lon, lat, t, v = (np.concatenate(column) for column in zip(*parts))
+    else:
+        lon, lat, t, v = parse_region([])
+
+    max_distance = scale * MAX_PIXEL_DISTANCE
+    for i, s in zip(missing, split_by_point(missing_points, lon, lat, t, v, max_distance)):
+        series[i] = s
+        if cache is not None:
+            cache.put(keys[i], _to_bytes(s))
+
+    return series
@@ -0,0 +1,88 @@
+"""
+Intermediates of the water endpoints (water mask vectors and centerline networks),
+stored on local disk as GeoJSON (EPSG:4326) and referenced by id.
+"""
+import json
+
+import ee
+
+from hydroengine_service import download_functions
+from hydroengine_service import error_handler
+from hydroengine_service import river_functions
+
+
+def get_water_mask_id(region, scale, start, stop):
+    """id of the water mask of a region (GeoJSON), scale and period"""
+    params = {'region': region, 'scale': scale, 'start': start, 'stop': stop}
+    return 'water_mask-' + download_functions.get_request_key('water_mask', params)
+
+
+def get_network_id(water_mask_id, engine='ee'):
+    """id of the centerline network derived from a water mask"""
+    return 'network-' + download_functions.get_request_key('network', [water_mask_id, engine])
+
+
+def put(cache, intermediate_id, data):
+    """
+    Store an intermediate
+    :param cache: DiskCache
+    :param data: Dictionary, json serializable
+    """
+    cache.put(intermediate_id, json.dumps(data).encode('utf-8'))
+
+
+def get(cache, intermediate_id):
+    """intermediate by id, None if not available"""
+    data = cache.get(intermediate_id)
+    if data is None:
+        return None
+
+    return json.loads(data.decode('utf-8'))
+
+
+def get_or_compute(cache, intermediate_id, compute):
+    """
+    Cached intermediate, computed and stored if not available
+    :param compute: function returning the (json serializable) intermediate
+    """
+    data = get(cache, intermediate_id)
+    if data is None:
+        data = compute()
+        put(cache, intermediate_id, data)
+
+    return data
+
+
+def require(cache, intermediate_id, kind):
+    """intermediate by id, raises InvalidUsage if it does not exist (anymore)"""
+    if not intermediate_id.startswith(kind + '-'):
+        raise error_handler.InvalidUsage('%s is not a %s id.' % (intermediate_id, kind))
+
+    data = get(cache, intermediate_id)
+    if data is None:
+        msg = '%s %s is not available (anymore), request it again.' % (kind, intermediate_id)
+        raise error_handler.InvalidUsage(msg, status_code=404)
+
+    return data
+
+
+def to_feature_collection(data):
+    """ee.FeatureCollection of a GeoJSON FeatureCollection"""
+    return ee.FeatureCollection([ee.Feature(f) for f in data['features']])
+
+
+def get_skeleton(network, scale, water_vector):
+    """
+    Centerline and skeleton distance image of a water mask
+    :param network: Dictionary, cached network (see get_network_id), None to compute the centerline
+    :param scale: Number, scale in meters
+    :param water_vector: ee.FeatureCollection, water mask
+    :return: tuple of ee.FeatureCollection (centerline) and ee.Image (distance)
+    """
+    if network is not None:
+        # the centerline is known, it is small compared to the water mask, only the distance is computed
+        centerline = to_feature_collection(network['centerline'])
+        return centerline, river_functions.generate_skeleton_distance(scale, water_vector)
+
+    output = river_functions.generate_skeleton_from_voronoi(scale, water_vector)
+    return ee.FeatureCollection(output['centerline']), ee.Image(output['distance'])
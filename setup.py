@@ -41,6 +41,10 @@ setup(
     entry_points={
         'console_scripts': [
             'hydroengine-service=hydroengine_service.cli:main',
+            'hydroengine-export-tiles=hydroengine_service.cli:export_tiles',
+            'hydroengine-benchmark-water-network=hydroengine_service.cli:benchmark_water_network',
+            'hydroengine-export-gsw-yearly-counts=hydroengine_service.cli:export_gsw_yearly_counts',
+            'hydroengine-update-lake-store=hydroengine_service.cli:update_lake_store',
         ],
     },
     install_requires=[],
@@ -1,3 +1,4 @@
+import ee
 import logging
 import pytest
 
@@ -33,3 +34,17 @@ class TestDGDSFunctions:
         assert "imageId" in image_date_list[0]
 
         assert "date" in image_date_list[0]
+
+    def test_get_feature_info_scale(self):
+        # GEBCO 2019 has a native resolution of 15 arc seconds
+        scale = dgds_functions.get_feature_info_scale('projects/dgds-gee/bathymetry/gebco/2019')
+        assert ee.Number(scale).getInfo() == pytest.approx(463.8, rel=0.01)
+
+        scale = dgds_functions.get_feature_info_scale(function='mosaic_elevation_datasets')
+        assert scale == dgds_functions.FEATURE_INFO_SCALE
+
+    def test_get_feature_info_scale_parameters(self, monkeypatch):
+        source = 'projects/dgds-gee/glossis/waterlevel'
+        monkeypatch.setitem(dgds_functions.DATASETS_VIS, source, dict(dgds_functions.DATASETS_VIS[source], scale=5000))
+
+        assert dgds_functions.get_feature_info_scale(source + '/20201101000000') == 5000
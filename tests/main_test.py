@@ -248,6 +248,23 @@ class TestClient:
         )
         assert r.status_code == 200
 
+    def test_get_sea_surface_height_time_series_points(self):
+        """test sea surface height timeseries at multiple points"""
+        request = {
+            "points": [[54.0, 0.0], [55.0, 1.0]]
+        }
+
+        r = self.client.post(
+            '/get_sea_surface_height_time_series',
+            data=json.dumps(request),
+            content_type='application/json'
+        )
+        assert r.status_code == 200
+
+        result = json.loads(r.data)
+        assert len(result['series']) == 2
+        assert len(result['series'][0]['t']) == len(result['series'][0]['v'])
+
     def test_get_liwo_scenarios_max_no_region(self):
         """test get liwo scenarios max"""
         request = {
@@ -633,6 +650,31 @@ class TestClient:
 
         assert result['value'] == 3.02
 
+    def test_get_feature_info_batch(self):
+        request = {
+            "imageIds": [
+                "projects/dgds-gee/metocean/waves/percentiles",
+                "projects/dgds-gee/metocean/waves/percentiles"
+            ],
+            "band": "50th",
+            "points": [
+                [-28.23, 49.05],
+                [4.38, 51.98]
+            ]
+        }
+        resp = self.client.post(
+            '/get_feature_info_batch',
+            data=json.dumps(request),
+            content_type='application/json'
+        )
+        assert resp.status_code == 200
+
+        result = json.loads(resp.data)
+
+        assert len(result['values']) == 2
+        assert len(result['values'][0]) == 2
+        assert round(result['values'][0][0], 2) == 3.02
+
     def test_get_feature_info_elevation(self):
         request = {
             "imageId": None,
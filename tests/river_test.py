@@ -99,5 +99,41 @@ class TestClient(unittest.TestCase):
         print(r.data)
 
 
+    def test_get_water_network_local(self):
+        request = {
+            "region": {
+                "geodesic": False,
+                "type": "Polygon",
+                "coordinates": [[
+                    [5.986862182617186, 52.517369933821186],
+                    [6.030635833740234, 52.517369933821186],
+                    [6.030635833740234, 52.535439735112924],
+                    [5.986862182617186, 52.535439735112924],
+                    [5.986862182617186, 52.517369933821186]
+                ]]
+            },
+            "start": "2010-01-01",
+            "stop": "2016-01-01",
+            "scale": 8,
+            "crs": "EPSG:4326",
+            "engine": "local"
+        }
+
+        r = self.client.post('/get_water_network', data=json.dumps(request),
+                             content_type='application/json')
+
+        assert r.status_code == 200
+
+        network = json.loads(r.data)
+        assert network['features']
+
+        # properties of the same network, referenced by id
+        request = {"network": network['id'], "crs": "EPSG:4326", "step": 100}
+
+        r = self.client.post('/get_water_network_properties', data=json.dumps(request),
+                             content_type='application/json')
+
+        assert r.status_code == 200
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,8 @@
+from hydroengine_service import composite_functions
+
+
+def test_needs_resampling():
+    # vectorized at half the default scale of 10 m, finer than the 10 m bands
+    assert composite_functions.needs_resampling(5)
+    assert not composite_functions.needs_resampling(10)
+    assert not composite_functions.needs_resampling(30)
@@ -0,0 +1,165 @@
+import http.server
+import threading
+
+import pytest
+from flask import Flask
+
+from hydroengine_service import cache_functions
+from hydroengine_service import download_blueprints
+from hydroengine_service import download_functions
+from hydroengine_service import error_handler
+
+CONTENT = bytes(range(256)) * 1000
+
+
+class FakeDownloadHandler(http.server.BaseHTTPRequestHandler):
+    """serves CONTENT as a zip file"""
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Disposition', 'attachment; filename="dem.zip"')
+        self.send_header('Content-Length', str(len(CONTENT)))
+        self.end_headers()
+        self.wfile.write(CONTENT)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def download_server():
+    server = http.server.HTTPServer(('127.0.0.1', 0), FakeDownloadHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    FakeDownloadHandler.requests = []
+    yield 'http://127.0.0.1:%d' % server.server_port
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    proxy = download_functions.DownloadProxy(
+        cache_functions.DiskCache(tmp_path), url_max_age=3600, lease_time=3600)
+    monkeypatch.setattr(download_blueprints, 'download_proxy', proxy)
+
+    app = Flask(__name__)
+    app.register_blueprint(error_handler.error_handler)
+    app.register_blueprint(download_blueprints.v1)
+
+    return app.test_client()
+
+
+def test_request_key():
+    key = download_functions.get_request_key('raster', {'variable': 'dem', 'cell_size': 100})
+    assert key == download_functions.get_request_key('raster', {'cell_size': 100, 'variable': 'dem'})
+    assert key != download_functions.get_request_key('raster', {'cell_size': 50, 'variable': 'dem'})
+
+
+def test_download_proxy(client, download_server):
+    resolved = []
+
+    def resolve():
+        resolved.append(1)
+        return download_server + '/download/%d' % len(resolved)
+
+    with client.application.test_request_context():
+        url = download_blueprints.get_download_url('raster', {'variable': 'dem'}, resolve)
+
+    r = client.get(url)
+    assert r.status_code == 200
+    assert r.headers['X-Cache'] == 'MISS'
+    assert r.data == CONTENT
+    assert 'dem.zip' in r.headers['Content-Disposition']
+
+    r = client.get(url)
+    assert r.headers['X-Cache'] == 'HIT'
+    assert r.data == CONTENT
+    assert r.mimetype == 'application/zip'
+
+    r = client.get(url, headers={'Range': 'bytes=100-199'})
+    assert r.status_code == 206
+    assert r.data == CONTENT[100:200]
+
+    assert len(FakeDownloadHandler.requests) == 1
+    assert len(resolved) == 1
+
+    r = client.get('/downloads/unknown')
+    assert r.status_code == 404
+
+
+def test_download_lease_survives_restart(tmp_path, download_server):
+    def resolve():
+        return download_server + '/download/1'
+
+    cache = cache_functions.DiskCache(tmp_path)
+    proxy = download_functions.DownloadProxy(cache, url_max_age=3600, lease_time=3600)
+    proxy.register('raster-key', resolve, filename='dem.zip', url=resolve())
+
+    # a new process, leases are read from the cache
+    restarted = download_functions.DownloadProxy(cache, url_max_age=3600, lease_time=3600)
+    assert restarted.get_url('raster-key') == download_server + '/download/1'
+
+    chunks, metadata = restarted.stream('raster-key')
+    assert b''.join(chunks) == CONTENT
+    assert restarted.get_cached('raster-key') is not None
+
+    with pytest.raises(error_handler.InvalidUsage):
+        restarted.get_url('unknown')
+
+
+def test_download_proxy_resolves_downloads_independently(tmp_path):
+    resolving = threading.Event()
+    release = threading.Event()
+
+    def resolve_slow():
+        resolving.set()
+        release.wait(5)
+        return 'slow'
+
+    proxy = download_functions.DownloadProxy(cache_functions.DiskCache(tmp_path), url_max_age=3600, lease_time=3600)
+    proxy.register('slow', resolve_slow)
+    proxy.register('fast', lambda: 'fast')
+
+    thread = threading.Thread(target=proxy.get_url, args=('slow',))
+    thread.start()
+    resolving.wait(5)
+
+    # not blocked by the download whose url is being generated
+    assert proxy.get_url('fast') == 'fast'
+    proxy.register('other', lambda: 'other')
+    assert thread.is_alive()
+
+    release.set()
+    thread.join()
+    assert proxy.get_url('slow') == 'slow'
+
+
+def test_download_jobs(client, monkeypatch):
+    jobs = download_functions.DownloadJobs(download_blueprints.download_proxy)
+    monkeypatch.setattr(download_blueprints, 'download_jobs', jobs)
+
+    def write(path, progress):
+        with open(path, 'wb') as f:
+            f.write(CONTENT)
+        progress(1, 1)
+
+    job = jobs.submit('raster-key', write, filename='dem.tif', mimetype='image/tiff')
+    jobs._executor.shutdown(wait=True)
+
+    assert job['status'] == 'COMPLETED'
+    assert job['progress'] == 1.0
+
+    r = client.get('/downloads/jobs/' + job['id'])
+    assert r.json['status'] == 'COMPLETED'
+
+    r = client.get(r.json['url'])
+    assert r.data == CONTENT
+    assert r.mimetype == 'image/tiff'
+    assert 'dem.tif' in r.headers['Content-Disposition']
+
+    r = client.get('/downloads/jobs/unknown')
+    assert r.status_code == 404
@@ -0,0 +1,118 @@
+import struct
+
+import pyarrow as pa
+import pytest
+from flask import Flask
+
+from hydroengine_service import error_handler
+from hydroengine_service import feature_functions
+
+
+class FakeList:
+    def __init__(self, features):
+        self.features = features
+
+    def getInfo(self):
+        return self.features
+
+
+class FakeCollection:
+    """mimics paging of an ee.FeatureCollection"""
+    def __init__(self, features):
+        self.features = features
+        self.calls = 0
+
+    def toList(self, count, offset):
+        self.calls += 1
+        return FakeList(self.features[offset:offset + count])
+
+    def getInfo(self):
+        return {'type': 'FeatureCollection', 'features': self.features}
+
+
+def make_features(n):
+    return [
+        {
+            'type': 'Feature',
+            'id': str(i),
+            'geometry': {'type': 'LineString', 'coordinates': [[i, 0], [i, 1.5]]},
+            'properties': {'HYBAS_ID': 2060000000 + i, 'UP_CELLS': i * 0.5}
+        }
+        for i in range(n)
+    ]
+
+
+def test_to_wkb():
+    wkb = feature_functions.to_wkb({'type': 'Point', 'coordinates': [4.0, 52.0]})
+    assert wkb == struct.pack('<BIdd', 1, 1, 4.0, 52.0)
+
+    polygon = {
+        'type': 'MultiPolygon',
+        'coordinates': [[[[0, 0], [1, 0], [1, 1], [0, 0]]], [[[2, 2], [3, 2], [3, 3], [2, 2]]]]
+    }
+    wkb = feature_functions.to_wkb(polygon)
+    # header and count, 2 polygons each: header, 1 ring, 4 points
+    assert len(wkb) == 9 + 2 * (5 + 4 + 4 + 4 * 16)
+    assert struct.unpack('<BII', wkb[:9]) == (1, 6, 2)
+
+
+def test_arrow_stream_in_batches(monkeypatch):
+    monkeypatch.setattr(feature_functions, 'BATCH_SIZE', 10)
+    monkeypatch.setattr(feature_functions, 'get_property_types',
+                        lambda c: {'HYBAS_ID': {'Integer'}, 'UP_CELLS': {'Integer', 'Float'}})
+
+    collection = FakeCollection(make_features(25))
+
+    app = Flask(__name__)
+
+    @app.route('/features', methods=['GET', 'POST'])
+    def features():
+        return feature_functions.feature_collection_response(collection)
+
+    client = app.test_client()
+    r = client.get('/features', headers={'Accept': feature_functions.ARROW_MIMETYPE})
+
+    assert r.status_code == 200
+    assert r.mimetype == feature_functions.ARROW_MIMETYPE
+
+    table = pa.ipc.open_stream(r.data).read_all()
+    assert table.num_rows == 25
+    assert table.column('HYBAS_ID')[24].as_py() == 2060000024
+    assert table.schema.field('geometry').metadata[b'ARROW:extension:name'] == b'geoarrow.wkb'
+    assert collection.calls == 3
+
+    # default is GeoJSON
+    r = client.get('/features')
+    assert r.mimetype == 'application/json'
+
+    r = client.get('/features?format=flatgeobuf')
+    assert r.status_code != 200
+
+
+def test_arrow_schema_from_property_types():
+    schema = feature_functions.get_arrow_schema(
+        {'a': {'Integer'}, 'b': {'Integer', 'Float'}, 'c': {'String'}}, 'EPSG:4326')
+    assert schema.names == ['id', 'geometry', 'a', 'b', 'c']
+    assert [f.type for f in list(schema)[2:]] == [pa.int64(), pa.float64(), pa.string()]
+
+    # mixed types are rejected before anything is streamed
+    with pytest.raises(error_handler.InvalidUsage):
+        feature_functions.get_arrow_schema({'a': {'Integer', 'String'}}, 'EPSG:4326')
+
+
+def test_record_batch_is_not_cast_silently():
+    schema = feature_functions.get_arrow_schema({'a': {'Integer'}}, 'EPSG:4326')
+
+    features = [{'type': 'Feature', 'geometry': None, 'properties': {'a': v}} for v in (1, 2.0, None)]
+    batch = feature_functions.features_to_record_batch(features, schema)
+    assert batch.column(2).to_pylist() == [1, 2, None]
+
+    # a fractional value in an integer column
+    features = [{'type': 'Feature', 'geometry': None, 'properties': {'a': 1.5}}]
+    with pytest.raises(error_handler.InvalidUsage):
+        feature_functions.features_to_record_batch(features, schema)
+
+    # a property missing from the schema
+    features = [{'type': 'Feature', 'geometry': None, 'properties': {'a': 1, 'b': 'x'}}]
+    with pytest.raises(error_handler.InvalidUsage):
+        feature_functions.features_to_record_batch(features, schema)
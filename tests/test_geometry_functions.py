@@ -0,0 +1,82 @@
+import copy
+
+import pytest
+
+from hydroengine_service import geometry_functions
+
+SQUARE = {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}
+
+
+def test_bounds():
+    collection = {
+        'type': 'FeatureCollection',
+        'features': [
+            {'type': 'Feature', 'geometry': SQUARE, 'properties': {}},
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [5, -3]}, 'properties': {}},
+        ]
+    }
+    assert geometry_functions.get_bounds(collection) == (0, -3, 5, 1)
+
+    polygon = geometry_functions.bounds_to_polygon((0, -3, 5, 1))
+    assert geometry_functions.get_bounds(polygon) == (0, -3, 5, 1)
+
+
+def test_area():
+    # 1 degree square at the equator
+    assert geometry_functions.area(SQUARE) == pytest.approx(12391e6, rel=1e-3)
+
+    # hole of a quarter of the square
+    with_hole = {
+        'type': 'Polygon',
+        'coordinates': SQUARE['coordinates'] + [[[0, 0], [0, 0.5], [0.5, 0.5], [0.5, 0], [0, 0]]]
+    }
+    assert geometry_functions.area(with_hole) == pytest.approx(0.75 * geometry_functions.area(SQUARE), rel=1e-3)
+
+    multi = {'type': 'MultiPolygon', 'coordinates': [SQUARE['coordinates']] * 2}
+    assert geometry_functions.area({'type': 'Feature', 'geometry': multi}) == pytest.approx(
+        2 * geometry_functions.area(SQUARE))
+
+    # whole earth between the poles, 2 pi R^2
+    band = {'type': 'Polygon', 'coordinates': [[[-180, -90], [180, -90], [180, 90], [-180, 90], [-180, -90]]]}
+    assert geometry_functions.area(band) == pytest.approx(4 * 3.141592653589793 * 6378137.0 ** 2, rel=1e-9)
+
+
+def test_length():
+    line = {'type': 'LineString', 'coordinates': [[0, 0], [1, 0], [1, 1]]}
+    degree = 6378137.0 * 3.141592653589793 / 180
+    assert geometry_functions.length(line) == pytest.approx(2 * degree)
+
+    multi = {'type': 'MultiLineString', 'coordinates': [line['coordinates'], [[0, 0], [0, 1]]]}
+    assert geometry_functions.length(multi) == pytest.approx(3 * degree)
+    assert geometry_functions.length(SQUARE) == 0
+
+
+def test_transform_features():
+    pytest.importorskip('pyproj')
+
+    features = [
+        {'type': 'Feature', 'geometry': copy.deepcopy(SQUARE), 'properties': {}},
+        {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [180, 0]}, 'properties': {}},
+        {'type': 'Feature', 'geometry': None, 'properties': {}},
+    ]
+    features = geometry_functions.transform_features(features, 'EPSG:3857')
+
+    ring = features[0]['geometry']['coordinates'][0]
+    assert len(ring) == 5
+    assert ring[2] == pytest.approx([111319.49, 111325.14], abs=0.01)
+    assert features[1]['geometry']['coordinates'] == pytest.approx([20037508.34, 0], abs=0.01)
+
+    bounds = geometry_functions.get_projected_bounds(SQUARE, 'EPSG:3857')
+    assert bounds == pytest.approx((0, 0, 111319.49, 111325.14), abs=0.01)
+
+
+def test_projected_bounds_densified():
+    pytest.importorskip('pyproj')
+    # the parallel at 60N is an arc around the pole in a polar stereographic projection,
+    # it extends beyond the vertices
+    polygon = {'type': 'Polygon', 'coordinates': [[[-30, 60], [30, 60], [30, 70], [-30, 70], [-30, 60]]]}
+    _, ymin, _, _ = geometry_functions.get_projected_bounds(polygon, 'EPSG:3995')
+
+    # the vertices at 30W and 30E are at y = -2886579
+    _, y = geometry_functions.get_transformer('EPSG:3995').transform(0, 60)
+    assert ymin == pytest.approx(y, rel=1e-3)
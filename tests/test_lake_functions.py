@@ -0,0 +1,94 @@
+from hydroengine_service import lake_functions
+
+
+def test_to_lake_columns():
+    rows = [
+        [2, 2000, 20.0],
+        [1, 2000, 10.0],
+        [2, 1000, 21.0],
+        [1, 1000, 11.0],
+    ]
+
+    lakes = lake_functions.to_lake_columns(rows, [2, 1, 3])
+
+    assert [lake['lake_id'] for lake in lakes] == [2, 1, 3]
+    assert list(lakes[0]['time']) == [1000, 2000]
+    assert list(lakes[0]['water_area']) == [21.0, 20.0]
+    assert list(lakes[1]['water_area']) == [11.0, 10.0]
+
+    # lakes without rows (unknown ids) get empty columns
+    assert len(lakes[2]['time']) == 0
+
+    assert len(lake_functions.to_lake_columns([], [1])[0]['time']) == 0
+
+
+def test_lake_area_store(tmp_path):
+    store = lake_functions.LakeAreaStore(tmp_path / 'lakes')
+
+    assert store.get(1) is None
+    assert store.get_last_times() == {}
+
+    store.append([[1, 2000, 10.0], [1, 1000, 11.0], [2, 1000, 21.0]])
+
+    ts = store.get(1)
+    assert list(ts['time']) == [1000, 2000]
+    assert list(ts['water_area']) == [11.0, 10.0]
+    assert store.get_lake_ids() == [1, 2]
+    assert store.get_last_times() == {1: 2000, 2: 1000}
+
+    # a new part extends the series, later rows replace earlier rows of the same month
+    store.append([[1, 3000, 12.0], [1, 2000, 13.0]])
+
+    ts = store.get(1)
+    assert list(ts['time']) == [1000, 2000, 3000]
+    assert list(ts['water_area']) == [11.0, 13.0, 12.0]
+    assert store.get(3) is None
+    assert store.get_last_times() == {1: 3000, 2: 1000}
+
+    # parts are read by other instances (processes)
+    assert list(lake_functions.LakeAreaStore(tmp_path / 'lakes').get(2)['water_area']) == [21.0]
+
+
+def test_update_store_per_lake(tmp_path, monkeypatch):
+    store = lake_functions.LakeAreaStore(tmp_path / 'lakes')
+    # lake 2 is behind, e.g. its batch of an earlier update failed
+    store.append([[1, 1000, 10.0], [1, 2000, 10.0], [2, 1000, 20.0]])
+
+    class Newest:
+        def aggregate_max(self, name):
+            return self
+
+        def getInfo(self):
+            return 3000
+
+    monkeypatch.setattr(lake_functions.ee, 'ImageCollection', lambda asset: Newest())
+
+    fills = []
+
+    def fill_store(store, lake_ids, start=None, batch_size=None, workers=None, compact=True):
+        fills.append((lake_ids, start, compact))
+        return len(lake_ids)
+
+    monkeypatch.setattr(lake_functions, 'fill_store', fill_store)
+
+    assert lake_functions.update_store(store) == 2
+    # the store is compacted once, after all groups
+    assert fills == [([2], 1001, False), ([1], 2001, False)]
+
+
+def test_lake_area_store_compact(tmp_path):
+    store = lake_functions.LakeAreaStore(tmp_path / 'lakes')
+    store.append([[1, 1000, 10.0], [2, 1000, 20.0]])
+    store.append([[1, 1000, 11.0], [1, 2000, 12.0]])
+    reader = lake_functions.LakeAreaStore(tmp_path / 'lakes')
+    assert list(reader.get(1)['water_area']) == [11.0, 12.0]
+
+    store.compact()
+
+    assert len(list((tmp_path / 'lakes').glob('*.parquet'))) == 1
+    assert list(reader.get(1)['water_area']) == [11.0, 12.0]
+    assert list(reader.get(2)['water_area']) == [20.0]
+
+    # parts added after a compaction take precedence
+    store.append([[2, 1000, 21.0]])
+    assert list(reader.get(2)['water_area']) == [21.0]
@@ -0,0 +1,66 @@
+import datetime
+
+from hydroengine_service import occurrence_functions
+
+date = datetime.date
+
+
+def test_plan_full_record():
+    # months of the full record, limited to the monthly history
+    assert occurrence_functions.plan_occurrence('1984-01-01', '2021-01-01') == [
+        ('months', date(1984, 3, 1), date(2020, 1, 1))
+    ]
+
+    plan = occurrence_functions.plan_occurrence('1984-03-01', '2020-01-01', range(1985, 2020))
+    assert plan[0] == ('months', date(1984, 3, 1), date(1985, 1, 1))
+    assert plan[1:] == [('year', year) for year in range(1985, 2020)]
+
+
+def test_yearly_count_years(monkeypatch):
+    calls = []
+
+    def get_years(yearly_counts, period):
+        calls.append(period)
+        return (2010,)
+
+    monkeypatch.setattr(occurrence_functions, '_get_yearly_count_years', get_years)
+    monkeypatch.setattr(occurrence_functions.time, 'time', lambda: 0)
+    assert occurrence_functions.get_yearly_count_years('counts') == (2010,)
+
+    # the years are evaluated again after YEARS_MAX_AGE
+    monkeypatch.setattr(occurrence_functions.time, 'time', lambda: occurrence_functions.YEARS_MAX_AGE)
+    occurrence_functions.get_yearly_count_years('counts')
+    assert calls == [0, 1]
+
+
+def test_plan_months():
+    # monthly images starting within the period
+    assert occurrence_functions.plan_occurrence('2010-01-15', '2010-04-01') == [
+        ('months', date(2010, 2, 1), date(2010, 4, 1))
+    ]
+    assert occurrence_functions.plan_occurrence('2010-01-15', '2010-01-20') == []
+    assert occurrence_functions.plan_occurrence('2030-01-01', '2031-01-01') == []
+
+
+def test_plan_years():
+    years = range(1985, 2020)
+
+    plan = occurrence_functions.plan_occurrence('2009-11-01', '2012-02-15', years)
+    assert plan == [
+        ('months', date(2009, 11, 1), date(2010, 1, 1)),
+        ('year', 2010),
+        ('year', 2011),
+        ('months', date(2012, 1, 1), date(2012, 3, 1)),
+    ]
+
+    # without yearly counts all months come from the monthly history
+    plan = occurrence_functions.plan_occurrence('2009-11-01', '2012-02-15')
+    assert plan == [('months', date(2009, 11, 1), date(2012, 3, 1))]
+
+    # years missing from the yearly counts
+    plan = occurrence_functions.plan_occurrence('2010-01-01', '2013-01-01', [2011])
+    assert plan == [
+        ('months', date(2010, 1, 1), date(2011, 1, 1)),
+        ('year', 2011),
+        ('months', date(2012, 1, 1), date(2013, 1, 1)),
+    ]
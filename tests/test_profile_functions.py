@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from hydroengine_service import error_handler
+from hydroengine_service import geometry_functions
+from hydroengine_service import profile_functions
+
+LINE = {'type': 'LineString', 'coordinates': [[0, 0], [0.01, 0], [0.01, 0.01]]}
+
+
+def test_get_lines():
+    collection = {
+        'type': 'FeatureCollection',
+        'features': [{'type': 'Feature', 'geometry': LINE, 'properties': {}}] * 2
+    }
+    assert len(profile_functions.get_lines(collection)) == 2
+    assert len(profile_functions.get_lines([LINE])) == 1
+
+    with pytest.raises(error_handler.InvalidUsage):
+        profile_functions.get_lines([{'type': 'Point', 'coordinates': [0, 0]}])
+
+
+def test_segment_line():
+    line = np.array(LINE['coordinates'], dtype=float)
+    length = geometry_functions.line_length(line)
+
+    distances, segments = profile_functions.segment_line(line, 500)
+
+    assert len(segments) == int(np.ceil(length / 500))
+    assert distances[0] == 0
+    assert np.all(np.diff(distances) == 500)
+
+    # segments are connected and cover the line
+    assert segments[0][0] == [0, 0]
+    assert segments[-1][-1] == pytest.approx([0.01, 0.01])
+    for a, b in zip(segments[:-1], segments[1:]):
+        assert a[-1] == b[0]
+
+    # the corner vertex is kept in the segment containing it
+    assert sum([0.01, 0] in s[1:-1] for s in segments) == 1
+
+    total = sum(geometry_functions.line_length(s) for s in segments)
+    assert total == pytest.approx(length)
+
+
+def test_profile_columns():
+    lines = [np.array(LINE['coordinates'], dtype=float), np.array([[1, 1], [1, 1.001]])]
+    features = profile_functions.get_segments(lines, 1000)
+
+    # masked segments are missing from the samples
+    samples = [{'index': f['properties']['index'], 'depth': 1.0} for f in features[1:]]
+    profiles = profile_functions.get_profile_columns(features, samples, ['depth'], len(lines))
+
+    assert len(profiles) == 2
+    assert len(profiles[0]['distance']) == len(profiles[0]['depth']) == 3
+    assert profiles[0]['depth'][0] is None
+    assert list(profiles[1]['distance']) == [0]
+    assert profiles[1]['depth'] == [1.0]
@@ -0,0 +1,149 @@
+import zipfile
+
+import numpy as np
+import pytest
+
+from hydroengine_service import error_handler
+from hydroengine_service import raster_functions
+
+
+def test_windows():
+    bounds = (0, 0, 5000, 3000)
+    shape = raster_functions.get_shape(bounds, 10)
+    assert shape == (300, 500)
+
+    windows = raster_functions.get_windows(shape, 128)
+    assert len(windows) == 3 * 4
+    assert windows[-1] == (256, 384, 44, 116)
+
+    # windows cover the raster exactly once
+    covered = np.zeros(shape, dtype=int)
+    for row_off, col_off, rows, columns in windows:
+        covered[row_off:row_off + rows, col_off:col_off + columns] += 1
+    assert (covered == 1).all()
+
+
+def test_window_size():
+    assert raster_functions.get_window_size(1, 'float64') == 2048
+    assert raster_functions.get_window_size(1, 'float32') == 2048
+
+    # many bands, windows shrink to stay below the size limit
+    for n_bands, dtype in [(26, 'float64'), (5, 'int32'), (100, 'float64')]:
+        size = raster_functions.get_window_size(n_bands, dtype)
+        assert size ** 2 * n_bands * np.dtype(dtype).itemsize <= raster_functions.MAX_WINDOW_BYTES
+    assert raster_functions.get_window_size(5, 'int32') == 1024
+
+
+def test_pixel_size():
+    assert raster_functions.get_pixel_size('EPSG:3857', 30) == 30
+    assert raster_functions.get_pixel_size('EPSG:4326', raster_functions.DEGREE_LENGTH) == 1
+
+
+def test_iter_windows_bounded():
+    windows = [(i, 0, 1, 1) for i in range(50)]
+    fetched = []
+
+    def fetch(window):
+        fetched.append(window)
+        return np.zeros((1, 1, 1))
+
+    consumed = 0
+    for window, data in raster_functions.iter_windows(fetch, windows, workers=2):
+        consumed += 1
+        # windows are fetched ahead of the consumer by at most 2 x workers
+        assert len(fetched) - consumed < 4
+
+    assert consumed == 50
+    assert sorted(fetched) == windows
+
+
+def test_write_geotiff(tmp_path, monkeypatch):
+    rasterio = pytest.importorskip('rasterio')
+    monkeypatch.setattr(raster_functions, 'WINDOW_SIZE', 64)
+
+    bounds = (0, 0, 1000, 1500)
+    expected = np.arange(150 * 100, dtype='float32').reshape(1, 150, 100)
+
+    def fetch(window):
+        row_off, col_off, rows, columns = window
+        return expected[:, row_off:row_off + rows, col_off:col_off + columns]
+
+    progress = []
+    path = str(tmp_path / 'dem.tif')
+    raster_functions.write_geotiff(path, fetch, 'EPSG:3857', bounds, 10, ['elevation'], 'float32',
+                                   progress=lambda done, total: progress.append((done, total)), workers=4)
+
+    assert progress[-1] == (6, 6)
+    with rasterio.open(path) as src:
+        np.testing.assert_array_equal(src.read(), expected)
+        assert src.bounds == bounds
+
+
+def test_bundle_images(monkeypatch):
+    class Image(object):
+        def __init__(self, variable, bands=None):
+            self.variable = variable
+            self.bands = bands
+
+        def select(self, selectors, names):
+            return Image(self.variable, (selectors, names))
+
+    monkeypatch.setattr(raster_functions.ee, 'Image', Image)
+
+    images = raster_functions.get_bundle_images(['dem', 'LAI01', 'dem'])
+
+    # repeated variables are downloaded once, with the first band named by the variable
+    assert list(images) == ['dem', 'LAI01']
+    assert images['LAI01'].bands == ([0], ['LAI01'])
+
+    with pytest.raises(error_handler.InvalidUsage):
+        raster_functions.get_bundle_images(['dem', 'unknown'])
+
+    with pytest.raises(error_handler.InvalidUsage):
+        raster_functions.get_bundle_images('dem')
+
+
+def test_download_bundle(tmp_path, monkeypatch):
+    written = []
+
+    def download_raster(path, image, crs, bounds, cell_size, progress=None, cog=False, workers=None):
+        with open(path, 'wb') as f:
+            f.write(image.encode())
+        progress(1, 1)
+        written.append(image)
+
+    monkeypatch.setattr(raster_functions, 'download_raster', download_raster)
+
+    progress = []
+    path = str(tmp_path / 'bundle.zip')
+    images = {'dem': 'dem-image', 'LAI01': 'lai-image'}
+    raster_functions.download_bundle(path, images, 'EPSG:3857', (0, 0, 100, 100), 10,
+                                     progress=lambda done, total: progress.append((done, total)))
+
+    with zipfile.ZipFile(path) as f:
+        assert sorted(f.namelist()) == ['LAI01.tif', 'dem.tif']
+        assert f.read('dem.tif') == b'dem-image'
+
+    assert progress[-1] == (2, 2)
+
+
+def test_write_cog(tmp_path):
+    rasterio = pytest.importorskip('rasterio')
+
+    shape = (1500, 1000)
+    data = np.arange(shape[0] * shape[1], dtype='float32').reshape((1,) + shape)
+
+    def fetch(window):
+        row_off, col_off, rows, columns = window
+        return data[:, row_off:row_off + rows, col_off:col_off + columns]
+
+    src = str(tmp_path / 'src.tif')
+    dst = str(tmp_path / 'cog.tif')
+    raster_functions.write_geotiff(src, fetch, 'EPSG:3857', (0, 0, 10000, 15000), 10, ['waterdepth'], 'float32')
+    raster_functions.write_cog(src, dst)
+
+    assert raster_functions.get_overview_factors(shape) == [2, 4]
+    with rasterio.open(dst) as ds:
+        assert ds.overviews(1) == [2, 4]
+        assert ds.block_shapes[0] == (raster_functions.BLOCK_SIZE, raster_functions.BLOCK_SIZE)
+        np.testing.assert_array_equal(ds.read(), data)
@@ -0,0 +1,124 @@
+import gzip
+import json
+
+import pytest
+from flask import Flask
+
+from hydroengine_service import config
+from hydroengine_service import error_handler
+from hydroengine_service import response_functions
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    calls = []
+
+    @app.route('/content', methods=['GET', 'POST'])
+    def content():
+        return response_functions.json_response({'a': 1}, max_age=60)
+
+    @app.route('/keyed', methods=['GET', 'POST'])
+    @response_functions.cache_by_request(config.CACHE_MAX_AGE_STATIC)
+    def keyed():
+        calls.append(1)
+        return response_functions.json_response({'calls': len(calls)})
+
+    app.testing = True
+    client = app.test_client()
+    client.calls = calls
+    return client
+
+
+def test_content_etag_and_304(client):
+    r = client.get('/content')
+    assert r.status_code == 200
+    assert r.headers['ETag']
+    assert 'max-age=60' in r.headers['Cache-Control']
+
+    r2 = client.get('/content', headers={'If-None-Match': r.headers['ETag']})
+    assert r2.status_code == 304
+    assert r2.data == b''
+
+
+def test_request_etag_skips_route(client):
+    body = {'region': {'type': 'Point', 'coordinates': [4, 52]}, 'catchment_level': 6}
+    r = client.get('/keyed', data=json.dumps(body), content_type='application/json')
+    assert r.status_code == 200
+    assert len(client.calls) == 1
+
+    # same request, keys in different order, should give the same etag without evaluating
+    body = {'catchment_level': 6, 'region': {'coordinates': [4, 52], 'type': 'Point'}}
+    r2 = client.get('/keyed', data=json.dumps(body), content_type='application/json',
+                    headers={'If-None-Match': r.headers['ETag']})
+    assert r2.status_code == 304
+    assert len(client.calls) == 1
+
+    # different request
+    body['catchment_level'] = 5
+    r3 = client.get('/keyed', data=json.dumps(body), content_type='application/json',
+                    headers={'If-None-Match': r.headers['ETag']})
+    assert r3.status_code == 200
+    assert r3.headers['ETag'] != r.headers['ETag']
+
+
+def test_source_max_age():
+    assert response_functions.get_source_max_age('projects/dgds-gee/glossis/waterlevel') == 15 * 60
+    assert response_functions.get_source_max_age('projects/dgds-gee/gtsm/tidal_indicators') == config.CACHE_MAX_AGE_STATIC
+    assert response_functions.get_layer_max_age('projects/dgds-gee/gtsm/tidal_indicators') == config.CACHE_MAX_AGE_MAP
+
+
+def test_quantize_coordinates():
+    data = {
+        'type': 'FeatureCollection',
+        'features': [{
+            'type': 'Feature',
+            'properties': {'value': 1.123456789},
+            'geometry': {
+                'type': 'Polygon',
+                # ragged: exterior with a hole
+                'coordinates': [
+                    [[0.123456789, 0.987654321], [1.0, 0.0], [1.0, 1.0], [0.123456789, 0.987654321]],
+                    [[0.5, 0.5], [0.6, 0.5], [0.5, 0.6], [0.5, 0.5]]
+                ]
+            }
+        }]
+    }
+
+    result = response_functions.quantize_coordinates(data, 3)
+
+    feature = result['features'][0]
+    assert feature['geometry']['coordinates'][0][0] == [0.123, 0.988]
+    assert feature['geometry']['coordinates'][1][1] == [0.6, 0.5]
+    # properties are untouched
+    assert feature['properties']['value'] == 1.123456789
+
+
+def test_json_response_precision_and_compression():
+    app = Flask(__name__)
+    app.register_blueprint(error_handler.error_handler)
+    coordinates = [[i / 7.0, i / 3.0] for i in range(1000)]
+
+    @app.route('/line', methods=['GET', 'POST'])
+    def line():
+        return response_functions.json_response({'type': 'LineString', 'coordinates': coordinates})
+
+    client = app.test_client()
+
+    r = client.get('/line?precision=2', headers={'Accept-Encoding': 'gzip'})
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in r.headers['Vary']
+
+    result = json.loads(gzip.decompress(r.data))
+    assert result['coordinates'][1] == [0.14, 0.33]
+
+    # compression is deterministic, so are the etags
+    r2 = client.get('/line?precision=2', headers={'Accept-Encoding': 'gzip'})
+    assert r.headers['ETag'] == r2.headers['ETag']
+
+    r3 = client.get('/line')
+    assert 'Content-Encoding' not in r3.headers
+    assert json.loads(r3.data)['coordinates'][1] == coordinates[1]
+
+    r4 = client.post('/line', data=json.dumps({'precision': 'x'}), content_type='application/json')
+    assert r4.status_code == 400
@@ -0,0 +1,59 @@
+import ee
+import pytest
+
+from hydroengine_service import retry_functions
+
+
+def test_size_class():
+    assert retry_functions.get_size_class(0) == 0
+    assert retry_functions.get_size_class(5e6) == 6
+    assert retry_functions.get_size_class(1e9) == 9
+
+
+def test_adaptive_retry(monkeypatch):
+    retry = retry_functions.AdaptiveRetry(tile_scales=(1, 2), scale_factors=(2,), memory_time=60)
+    calls = []
+
+    def compute(tile_scale, factor):
+        calls.append((tile_scale, factor))
+        if factor == 1:
+            raise ee.EEException('User memory limit exceeded.')
+        return 'result'
+
+    assert retry.evaluate('test', 1e6, compute) == ('result', 2)
+    assert calls == [(1, 1), (2, 1), (2, 2)]
+
+    # the same size class starts with the largest tileScale, but at the requested scale
+    calls.clear()
+    assert retry.evaluate('test', 2e6, compute) == ('result', 2)
+    assert calls == [(2, 1), (2, 2)]
+
+    # other size classes start from the beginning
+    calls.clear()
+    retry.evaluate('test', 1e8, compute)
+    assert calls[0] == (1, 1)
+
+    # the remembered tileScale expires
+    now = retry_functions.time.time()
+    monkeypatch.setattr(retry_functions.time, 'time', lambda: now + 61)
+    calls.clear()
+    retry.evaluate('test', 1e6, compute)
+    assert calls[0] == (1, 1)
+
+
+def test_adaptive_retry_errors():
+    retry = retry_functions.AdaptiveRetry(tile_scales=(1, 2), scale_factors=())
+
+    def fail(tile_scale, factor):
+        raise ee.EEException('Image.load: Image asset not found.')
+
+    # other errors are not retried
+    with pytest.raises(ee.EEException, match='not found'):
+        retry.evaluate('test', 1e6, fail)
+
+    def timeout(tile_scale, factor):
+        raise ee.EEException('Computation timed out.')
+
+    # the last setting fails with the original error
+    with pytest.raises(ee.EEException, match='timed out'):
+        retry.evaluate('test', 1e6, timeout)
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from hydroengine_service import error_handler
+from hydroengine_service import geometry_functions
+from hydroengine_service import skeleton_functions
+
+# channel of about 1113 x 111 m at the equator
+CHANNEL = {'type': 'Polygon', 'coordinates': [[[0, 0], [0.01, 0], [0.01, 0.001], [0, 0.001], [0, 0]]]}
+
+
+def test_local_projection():
+    lonlat = np.array([[4.0, 52.0], [4.1, 52.05]])
+    origin = lonlat.mean(axis=0)
+
+    xy = skeleton_functions.to_local(lonlat, origin)
+
+    assert skeleton_functions.from_local(xy, origin) == pytest.approx(lonlat)
+    assert np.hypot(*(xy[1] - xy[0])) == pytest.approx(geometry_functions.line_length(lonlat), rel=1e-3)
+
+
+def test_points_in_rings():
+    outer = np.array([[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]], dtype=float)
+    hole = np.array([[4, 4], [6, 4], [6, 6], [4, 6], [4, 4]], dtype=float)
+    points = np.array([[1, 1], [5, 5], [11, 5]], dtype=float)
+
+    assert list(skeleton_functions.points_in_rings(points, [outer, hole])) == [True, False, False]
+
+
+def test_points_in_rings_chunked(monkeypatch):
+    ring = np.column_stack([np.cos(np.linspace(0, 2 * np.pi, 50)), np.sin(np.linspace(0, 2 * np.pi, 50))])
+    points = np.random.RandomState(0).uniform(-1.5, 1.5, (1000, 2))
+
+    expected = skeleton_functions.points_in_rings(points, [ring])
+    monkeypatch.setattr(skeleton_functions, 'MAX_PAIRS', 100)
+
+    assert (skeleton_functions.points_in_rings(points, [ring]) == expected).all()
+    assert (expected == (np.hypot(*points.T) < 0.99)).sum() > 990
+
+
+def test_simplify_line():
+    line = np.array([[0, 0], [1, 0.01], [2, 0], [3, 5], [4, 0]], dtype=float)
+
+    simplified = skeleton_functions.simplify_line(line, 0.1)
+
+    assert simplified.tolist() == [[0, 0], [2, 0], [3, 5], [4, 0]]
+
+
+def test_chains():
+    # a junction (0) with three arms, one of which is a chain of two edges
+    adjacency = {0: {1, 2, 3}, 1: {0}, 2: {0}, 3: {0, 4}, 4: {3}}
+
+    chains = skeleton_functions.get_chains(adjacency)
+
+    assert sorted(chains) == [[0, 1], [0, 2], [0, 3, 4]]
+
+
+def test_prune_branches():
+    positions = np.array([[0, 0], [-1, 1], [-1, -1], [10, 0]], dtype=float)
+    adjacency = {0: {1, 2, 3}, 1: {0}, 2: {0}, 3: {0}}
+
+    skeleton_functions.prune_branches(adjacency, positions, 5)
+
+    assert adjacency == {0: {3}, 3: {0}}
+
+
+def test_skeletonize_channel():
+    centerline = skeleton_functions.skeletonize(CHANNEL, 10)
+
+    assert len(centerline['features']) == 1
+
+    feature = centerline['features'][0]
+    coordinates = np.array(feature['geometry']['coordinates'])
+
+    # along the middle of the channel, ending half a width from the ends
+    assert coordinates[:, 1] == pytest.approx(0.0005, abs=1e-5)
+    assert geometry_functions.length(feature) == pytest.approx(1113 - 111, rel=0.02)
+    assert feature['properties']['width'] == pytest.approx(111, rel=0.05)
+
+
+def test_skeletonize_empty():
+    empty = {'type': 'FeatureCollection', 'features': []}
+    assert skeleton_functions.skeletonize(empty, 10) == empty
+
+
+def test_skeletonize_too_large(monkeypatch):
+    monkeypatch.setattr(skeleton_functions, 'MAX_SAMPLES', 100)
+
+    with pytest.raises(error_handler.InvalidUsage):
+        skeleton_functions.skeletonize(CHANNEL, 10)
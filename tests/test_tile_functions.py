@@ -0,0 +1,222 @@
+import http.server
+import os
+import sqlite3
+import threading
+import time
+
+import mapbox_vector_tile
+import numpy as np
+import pytest
+
+from hydroengine_service import cache_functions
+from hydroengine_service import error_handler
+from hydroengine_service import mbtiles_functions
+from hydroengine_service import tile_functions
+
+
+def test_tile_bounds():
+    west, south, east, north = tile_functions.get_tile_bounds(0, 0, 0)
+    assert (west, east) == pytest.approx((-180, 180))
+    assert north == pytest.approx(85.0511287798)
+
+    west, south, east, north = tile_functions.get_tile_bounds(1, 1, 0)
+    assert (west, south, east) == pytest.approx((0, 0, 180))
+
+    with pytest.raises(error_handler.InvalidUsage):
+        tile_functions.validate_tile(2, 4, 0)
+
+
+def test_mercator_round_trip():
+    lon = np.array([4.3, -120.0, 0.0])
+    lat = np.array([52.0, -33.9, 0.0])
+
+    x, y = tile_functions.lonlat_to_mercator(lon, lat)
+    lon2, lat2 = tile_functions.mercator_to_lonlat(x, y)
+
+    np.testing.assert_allclose(lon, lon2)
+    np.testing.assert_allclose(lat, lat2, atol=1e-9)
+
+
+def test_encode_vector_tile():
+    features = [{
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Polygon',
+            'coordinates': [
+                [[10, 10], [80, 10], [80, 60], [10, 60], [10, 10]],
+                [[20, 20], [30, 20], [30, 30], [20, 20]]
+            ]
+        },
+        'properties': {'Hylak_id': 1, 'Lake_name': None}
+    }]
+
+    data = tile_functions.encode_vector_tile('lakes', features, 1, 1, 0)
+    tile = mapbox_vector_tile.decode(data)
+
+    feature = tile['lakes']['features'][0]
+    assert feature['properties'] == {'Hylak_id': 1}
+    assert feature['geometry']['type'] == 'Polygon'
+
+    # empty tile
+    assert tile_functions.encode_vector_tile('lakes', [], 1, 1, 0) is not None
+
+
+def test_disk_cache(tmp_path):
+    cache = cache_functions.DiskCache(tmp_path)
+    assert cache.get('rivers/1/0/0') is None
+
+    cache.put('rivers/1/0/0', b'tile')
+    assert cache.get('rivers/1/0/0') == b'tile'
+
+
+def test_disk_cache_eviction(tmp_path):
+    cache = cache_functions.DiskCache(tmp_path, max_size=250)
+
+    for i in range(3):
+        cache.put(str(i), bytes(100))
+        # make sure modification times differ
+        path = cache.path(str(i))
+        os.utime(path, (time.time() - 10 + i, time.time() - 10 + i))
+
+    # oldest tile is evicted
+    assert cache.get('0') is None
+    assert cache.get('2') is not None
+
+
+class FakeTileHandler(http.server.BaseHTTPRequestHandler):
+    """serves png tiles for map id 'valid', 404 for other map ids"""
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if self.path.startswith('/valid/'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.end_headers()
+            self.wfile.write(b'\x89PNG' + self.path.encode())
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def tile_server():
+    server = http.server.HTTPServer(('127.0.0.1', 0), FakeTileHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    FakeTileHandler.requests = []
+    yield 'http://127.0.0.1:%d' % server.server_port
+    server.shutdown()
+    server.server_close()
+
+
+def test_raster_tile_proxy(tmp_path, tile_server):
+    map_ids = ['expired', 'valid']
+
+    def resolve():
+        return tile_server + '/' + map_ids.pop(0) + '/{z}/{x}/{y}'
+
+    proxy = tile_functions.RasterTileProxy(cache_functions.DiskCache(tmp_path), url_max_age=3600)
+    proxy.register('gebco', resolve, max_age=3600)
+
+    # expired map id is resolved again
+    data, cached = proxy.get_tile('gebco', 1, 0, 1)
+    assert not cached
+    assert data == b'\x89PNG/valid/1/0/1'
+    assert tile_functions.get_image_mimetype(data) == 'image/png'
+    assert len(FakeTileHandler.requests) == 2
+
+    data, cached = proxy.get_tile('gebco', 1, 0, 1)
+    assert cached
+    assert len(FakeTileHandler.requests) == 2
+
+    with pytest.raises(error_handler.InvalidUsage):
+        proxy.get_tile('unknown', 1, 0, 1)
+
+
+def test_raster_tile_proxy_resolves_layers_independently(tmp_path):
+    resolving = threading.Event()
+    release = threading.Event()
+
+    def resolve_slow():
+        resolving.set()
+        release.wait(5)
+        return 'slow/{z}/{x}/{y}'
+
+    proxy = tile_functions.RasterTileProxy(cache_functions.DiskCache(tmp_path), url_max_age=3600)
+    proxy.register('slow', resolve_slow, max_age=3600)
+    proxy.register('fast', lambda: 'fast/{z}/{x}/{y}', max_age=3600)
+
+    thread = threading.Thread(target=proxy.get_url_template, args=('slow',))
+    thread.start()
+    resolving.wait(5)
+
+    # not blocked by the layer being resolved
+    assert proxy.get_url_template('fast') == 'fast/{z}/{x}/{y}'
+    assert thread.is_alive()
+
+    release.set()
+    thread.join()
+
+
+def test_raster_tile_proxy_url_max_age(tmp_path, monkeypatch):
+    resolved = []
+
+    def resolve():
+        resolved.append(1)
+        return 'url/%d/{z}/{x}/{y}' % len(resolved)
+
+    proxy = tile_functions.RasterTileProxy(cache_functions.DiskCache(tmp_path), url_max_age=3600)
+    proxy.register('forecast', resolve, max_age=900)
+    assert proxy.layers['forecast']['url_max_age'] == 900
+
+    monkeypatch.setattr(tile_functions.time, 'time', lambda: 0)
+    assert proxy.get_url_template('forecast') == 'url/1/{z}/{x}/{y}'
+
+    # the url of a layer is resolved again after the max age of the layer
+    monkeypatch.setattr(tile_functions.time, 'time', lambda: 901)
+    assert proxy.get_url_template('forecast') == 'url/2/{z}/{x}/{y}'
+
+
+def test_mbtiles_export(tmp_path):
+    path = tmp_path / 'ssh-trend.mbtiles'
+
+    def fetch(z, x, y):
+        if (z, x, y) == (1, 0, 0):
+            return None
+        return b'\x89PNG%d/%d/%d' % (z, x, y)
+
+    n_tiles = mbtiles_functions.export_tiles(path, fetch, 'ssh-trend', (-180, -85, 180, 85), 0, 2, workers=4)
+    assert n_tiles == 1 + 4 + 16 - 1
+
+    archives = mbtiles_functions.TileArchives(tmp_path)
+    assert archives.get_tile('ssh-trend', 2, 3, 1) == b'\x89PNG2/3/1'
+    assert archives.get_tile('ssh-trend', 1, 0, 0) is None
+    assert archives.get_tile('ssh-trend', 3, 0, 0) is None
+    assert archives.get_tile('gebco', 0, 0, 0) is None
+
+    # exported while the archives are in use
+    mbtiles_functions.export_tiles(tmp_path / 'gebco.mbtiles', fetch, 'gebco', (-180, -85, 180, 85), 0, 0)
+    assert archives.get_tile('gebco', 0, 0, 0) == b'\x89PNG0/0/0'
+
+
+def test_tile_archives_reexport(tmp_path):
+    path = tmp_path / 'gebco.mbtiles'
+    mbtiles_functions.export_tiles(path, lambda z, x, y: b'\x89PNG1', 'gebco', (-180, -85, 180, 85), 0, 0)
+
+    archives = mbtiles_functions.TileArchives(tmp_path)
+    assert archives.get_tile('gebco', 0, 0, 0) == b'\x89PNG1'
+    archive = archives.get('gebco')
+
+    # exported again, with a later modification time
+    mbtiles_functions.export_tiles(path, lambda z, x, y: b'\x89PNG2', 'gebco', (-180, -85, 180, 85), 0, 0)
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    assert archives.get_tile('gebco', 0, 0, 0) == b'\x89PNG2'
+
+    # the connections of the replaced archive are closed
+    assert archives.get('gebco') is not archive
+    with pytest.raises(sqlite3.ProgrammingError):
+        archive.get_tile(0, 0, 0)
@@ -0,0 +1,75 @@
+import numpy as np
+
+from hydroengine_service import cache_functions
+from hydroengine_service import timeseries_functions
+
+
+def test_chunks():
+    times = list(range(0, 100 * 3600000, 3600000))
+
+    chunks = timeseries_functions.get_chunks(times, n_points=2, max_values=10 * 2 * 5)
+    assert len(chunks) == 10
+    assert chunks[0] == (0, 9 * 3600000 + 1)
+    assert chunks[-1][1] == times[-1] + 1
+
+    # every image is in exactly one chunk
+    counts = [sum(start <= t < end for start, end in chunks) for t in times]
+    assert counts == [1] * len(times)
+
+    assert timeseries_functions.get_chunks([], n_points=1) == []
+
+
+def test_parse_region():
+    table = [
+        ['id', 'longitude', 'latitude', 'time', 'waterlevel'],
+        ['a', 4.0, 52.0, 2000, 1.5],
+        ['b', 4.0, 52.0, 1000, None],
+    ]
+    lon, lat, t, v = timeseries_functions.parse_region(table)
+
+    assert t.dtype == np.int64
+    assert v.dtype == np.float32
+    assert list(t) == [2000, 1000]
+    assert v[0] == 1.5
+    assert np.isnan(v[1])
+
+    lon, lat, t, v = timeseries_functions.parse_region(table[:1])
+    assert len(t) == 0
+
+
+def test_split_by_point():
+    lon = np.array([4.0, 5.0, 4.0, 5.0])
+    lat = np.array([52.0, 53.0, 52.0, 53.0])
+    t = np.array([2000, 1000, 1000, 2000], dtype='int64')
+    v = np.array([1, 2, 3, 4], dtype='float32')
+
+    series = timeseries_functions.split_by_point([[5.01, 52.99], [4.01, 52.01]], lon, lat, t, v)
+
+    assert list(series[0]['t']) == [1000, 2000]
+    assert list(series[0]['v']) == [2, 4]
+    assert list(series[1]['t']) == [1000, 2000]
+    assert list(series[1]['v']) == [3, 1]
+
+    # a point without rows of its own (outside the footprint, masked) gets nothing
+    series = timeseries_functions.split_by_point([[4.0001, 52.0], [4.1, 52.0]], lon, lat, t, v, max_distance=100)
+    assert list(series[0]['t']) == [1000, 2000]
+    assert len(series[1]['t']) == 0
+    assert series[1]['v'].dtype == np.float32
+
+
+def test_cached_time_series(tmp_path):
+    cache = cache_functions.DiskCache(tmp_path)
+    points = [[4.0, 52.0], [5.0, 53.0]]
+    args = ('waterlevel', '2020-01-01', '2020-01-02', 1000, None, 'source', None)
+
+    for i, point in enumerate(points):
+        series = {'t': np.array([1000, 2000], dtype='int64'), 'v': np.array([i, i], dtype='float32')}
+        cache.put(timeseries_functions.get_fingerprint(point, *args), timeseries_functions._to_bytes(series))
+
+    # all points are cached, Earth Engine is not used
+    series = timeseries_functions.get_time_series(
+        None, 'waterlevel', points, '2020-01-01', '2020-01-02', 1000,
+        cache=cache, cache_args=('source', None))
+
+    assert [list(s['v']) for s in series] == [[0, 0], [1, 1]]
+    assert series[0]['t'].dtype == np.int64
@@ -0,0 +1,64 @@
+import pytest
+
+from hydroengine_service import cache_functions
+from hydroengine_service import error_handler
+from hydroengine_service import water_functions
+
+REGION = {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}
+
+
+def test_ids():
+    a = water_functions.get_water_mask_id(REGION, 30, '2010-01-01', '2011-01-01')
+    b = water_functions.get_water_mask_id(dict(reversed(list(REGION.items()))), 30, '2010-01-01', '2011-01-01')
+    c = water_functions.get_water_mask_id(REGION, 60, '2010-01-01', '2011-01-01')
+
+    assert a.startswith('water_mask-')
+    assert a == b
+    assert a != c
+
+    assert water_functions.get_network_id(a).startswith('network-')
+    assert water_functions.get_network_id(a) != water_functions.get_network_id(c)
+
+
+def test_get_or_compute(tmp_path):
+    cache = cache_functions.DiskCache(tmp_path)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'type': 'FeatureCollection', 'features': []}
+
+    first = water_functions.get_or_compute(cache, 'network-1', compute)
+    second = water_functions.get_or_compute(cache, 'network-1', compute)
+
+    assert first == second
+    assert len(calls) == 1
+
+    assert water_functions.require(cache, 'network-1', 'network') == first
+
+    with pytest.raises(error_handler.InvalidUsage):
+        water_functions.require(cache, 'network-2', 'network')
+
+    with pytest.raises(error_handler.InvalidUsage):
+        water_functions.require(cache, 'network-1', 'water_mask')
+
+
+def test_get_skeleton_cached(monkeypatch):
+    calls = []
+
+    def record(name, result):
+        def f(*args):
+            calls.append(name)
+            return result
+        return f
+
+    monkeypatch.setattr(water_functions, 'to_feature_collection', record('centerline', 'centerline'))
+    monkeypatch.setattr(water_functions.river_functions, 'generate_skeleton_distance', record('distance', 'distance'))
+    monkeypatch.setattr(water_functions.river_functions, 'generate_skeleton_from_voronoi', record('voronoi', None))
+
+    network = {'centerline': {'type': 'FeatureCollection', 'features': []}}
+    centerline, distance = water_functions.get_skeleton(network, 30, 'water_vector')
+
+    # the skeleton of a known network is not computed again
+    assert (centerline, distance) == ('centerline', 'distance')
+    assert calls == ['centerline', 'distance']
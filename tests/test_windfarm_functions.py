@@ -0,0 +1,48 @@
+from hydroengine_service import digitwin_functions
+
+
+def make_features(n):
+    return [
+        {
+            'type': 'Feature',
+            'geometry': None,
+            'properties': {
+                'wind_magnitude_mean': 8.0 + i,
+                'bathymetry': -30.0,
+                'distance_to_port': 100.0,
+                'n_turbines': 10,
+                'turbine_spacing': 1000
+            }
+        }
+        for i in range(n)
+    ]
+
+
+def test_compute_features():
+    features = make_features(3)
+    # masked pixels have no value
+    features[2]['properties']['distance_to_port'] = None
+
+    features = digitwin_functions.compute_features(features)
+
+    properties = features[0]['properties']
+    magnitude = 8.0 * digitwin_functions.WIND_CONVERSION
+    assert properties['wind_magnitude_mean_height'] == magnitude
+    assert properties['wind_power_total'] == digitwin_functions.windpower(magnitude) * 10
+    assert properties['levelized_cost_of_energy'] == digitwin_functions.lcoe(100.0, 30.0)
+    assert properties['area_per_turbine'] == 1000
+
+    assert features[1]['properties']['wind_power_mean'] > properties['wind_power_mean']
+    assert features[2]['properties']['levelized_cost_of_energy'] is None
+
+
+def test_compute_features_missing_properties():
+    features = make_features(1)
+    del features[0]['properties']['turbine_spacing']
+    del features[0]['properties']['n_turbines']
+
+    properties = digitwin_functions.compute_features(features)[0]['properties']
+
+    assert properties['area_per_turbine'] is None
+    assert properties['spacing'] is None
+    assert properties['wind_power_total'] is None